@@ -1,777 +1,3178 @@
-import { MongoClient } from 'mongodb'
+import { AsyncLocalStorage } from 'async_hooks'
+import { createHash } from 'crypto'
 import { v4 as uuidv4 } from 'uuid'
 import { NextResponse } from 'next/server'
 import bcrypt from 'bcryptjs'
 import jwt from 'jsonwebtoken'
+import { LRUCache } from '@/lib/cache'
+import { Counter, Histogram, registerCollector, renderMetrics } from '@/lib/metrics'
+import { getDb, getMongoClient, getPoolStats, setCommandHandlers, whenIndexesReady } from '@/lib/mongodb'
+import { eventStats, publish, subscribe } from '@/lib/events'
 
 const JWT_SECRET = process.env.JWT_SECRET || 'your-secret-key-change-in-production'
 
-// MongoDB connection
+// Products below this stock level are flagged as low stock
+const LOW_STOCK_THRESHOLD = 10
+// Maximum number of low stock products returned by the dashboard
+const LOW_STOCK_LIST_LIMIT = 20
+// Default and maximum number of products returned by a search
+const SEARCH_DEFAULT_LIMIT = 50
+const SEARCH_MAX_LIMIT = 200
+// Page size cap for paginated listings, and the default for sales
+const LIST_MAX_LIMIT = 1000
+
+// Fields a client may request with ?fields= on each listing
+const PRODUCT_FIELDS = ['id', 'barcode', 'name', 'cost_price', 'sale_price', 'stock_quantity', 'category', 'low_stock_alert', 'created_at']
+const SALE_FIELDS = ['id', 'total_amount', 'profit', 'payment_method', 'amount_received', 'change_given', 'items', 'date']
+// Maximum number of sales accepted by one POST /api/sales/batch
+const SALES_BATCH_MAX = 200
+
+// Sales older than this many days move from the sales collection to the
+// monthly archive. Off (0) unless the deployment opts in, since archiving
+// moves documents out of sales.
+const SALES_RETENTION_DAYS = parseInt(process.env.SALES_RETENTION_DAYS ?? 0) || 0
+// Archive: sales per bucket document, how often the job runs, and how long a
+// tenant stays locked by a run that died without releasing it
+const SALES_ARCHIVE_BUCKET_SIZE = 1000
+const SALES_ARCHIVE_INTERVAL_MS = 6 * 60 * 60 * 1000
+const SALES_ARCHIVE_LOCK_MS = 30 * 60 * 1000
+
+// Documents serialized per chunk of a streamed export
+const EXPORT_CHUNK_SIZE = 500
+
+// Product import: rows per bulkWrite, row cap per request, and errors listed in the report
+const IMPORT_CHUNK_SIZE = 1000
+const IMPORT_MAX_ROWS = 100000
+const IMPORT_MAX_ERRORS = 1000
+
+// Sales analytics: bucket sizes (in days) by name, default range, and caps on
+// the number of timeline buckets and top products returned
+const ANALYTICS_BUCKET_DAYS = { hour: 1 / 24, day: 1, week: 7 }
+const ANALYTICS_DEFAULT_DAYS = 30
+const ANALYTICS_MAX_BUCKETS = 5000
+const ANALYTICS_TOP_DEFAULT = 10
+const ANALYTICS_TOP_MAX = 100
+
+// Product catalog cache: tenants kept, entry lifetime, and the largest catalog worth caching
+const CATALOG_CACHE_TENANTS = parseInt(process.env.CATALOG_CACHE_TENANTS) || 100
+const CATALOG_CACHE_TTL_MS = (parseInt(process.env.CATALOG_CACHE_TTL_SECONDS) || 60) * 1000
+const CATALOG_CACHE_MAX_PRODUCTS = parseInt(process.env.CATALOG_CACHE_MAX_PRODUCTS) || 20000
+
+// Live events stream: keep-alive comment interval, and how many undelivered
+// events a slow client may accumulate before it is disconnected
+const EVENTS_HEARTBEAT_MS = 25000
+const EVENTS_MAX_QUEUED = 500
+
+// Auth caches: verified tokens and user profiles
+const TOKEN_CACHE_SIZE = parseInt(process.env.TOKEN_CACHE_SIZE) || 10000
+const TOKEN_CACHE_TTL_MS = 5 * 60 * 1000
+const USER_CACHE_SIZE = parseInt(process.env.USER_CACHE_SIZE) || 10000
+const USER_CACHE_TTL_MS = 5 * 60 * 1000
+
+// Read query coalescing: results kept, and how long a result is reused
+// (0 only shares queries in flight)
+const QUERY_CACHE_SIZE = parseInt(process.env.QUERY_CACHE_SIZE) || 5000
+const QUERY_CACHE_TTL_MS = parseInt(process.env.QUERY_CACHE_TTL_MS ?? 1000) || 0
+
+// Per-request timing, read by the Mongo command listeners below
+const requestTiming = new AsyncLocalStorage()
+// Timing of commands in flight, keyed by driver request id
+const pendingCommands = new Map()
+
+// Request metrics, exposed at GET /api/metrics
+const httpRequestsTotal = new Counter({
+  name: 'cloudpos_http_requests_total',
+  help: 'API requests by route, method and status',
+  labelNames: ['method', 'route', 'status']
+})
+const httpRequestDuration = new Histogram({
+  name: 'cloudpos_http_request_duration_seconds',
+  help: 'API request latency by route and method',
+  labelNames: ['method', 'route'],
+  buckets: [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+})
+const mongoCommandsTotal = new Counter({
+  name: 'cloudpos_mongo_commands_total',
+  help: 'MongoDB commands issued by route and method',
+  labelNames: ['method', 'route']
+})
+const mongoCommandSeconds = new Counter({
+  name: 'cloudpos_mongo_command_seconds_total',
+  help: 'Time spent in MongoDB commands by route and method',
+  labelNames: ['method', 'route']
+})
+
+// Attribute each command's round trip to the request that issued it. The
+// shared client forwards its command events here; a re-evaluated module
+// replaces these handlers rather than adding more.
+setCommandHandlers({
+  started(event) {
+    const timing = requestTiming.getStore()
+    if (timing) pendingCommands.set(event.requestId, timing)
+  },
+  finished(event) {
+    const timing = pendingCommands.get(event.requestId)
+    if (!timing) return
+    pendingCommands.delete(event.requestId)
+    timing.mongoCommands++
+    timing.mongoMs += event.duration
+  }
+})
+
+// MongoDB connection. The client is shared process-wide (see lib/mongodb.js);
+// this module only runs the backfills once.
 let client
-let db
+let connection
+let databaseReady
 
-async function connectToMongo() {
-  if (!client) {
-    client = new MongoClient(process.env.MONGO_URL)
-    await client.connect()
-    db = client.db(process.env.DB_NAME)
+function connectToMongo() {
+  if (!connection) {
+    connection = getDb().then(async db => {
+      client = await getMongoClient()
+      // Run in the background; requests are served while backfills run
+      databaseReady = prepareDatabase(db)
+      return db
+    })
+    connection.catch(() => { connection = null })
   }
-  return db
+  return connection
 }
 
-// Helper function to handle CORS
-function handleCORS(response) {
-  response.headers.set('Access-Control-Allow-Origin', process.env.CORS_ORIGINS || '*')
-  response.headers.set('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-  response.headers.set('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-  response.headers.set('Access-Control-Allow-Credentials', 'true')
-  return response
+// Once per process: wait for the indexes, then backfill fields added after data was written
+async function prepareDatabase(db) {
+  await whenIndexesReady()
+  await Promise.all([
+    backfillSearchTokens(db).catch(error => {
+      console.error('Search token backfill failed:', error)
+    }),
+    backfillCashRegisterTotals(db).catch(error => {
+      console.error('Cash register totals backfill failed:', error)
+    })
+  ])
+  scheduleSalesArchive(db)
 }
 
-// Verify JWT token from cookie
-function verifyToken(request) {
-  const cookie = request.headers.get('cookie')
-  if (!cookie) return null
+// Lowercase, accent-folded form of a string ("Café Ñandú" -> "cafe nandu")
+function normalizeText(text) {
+  return String(text || '')
+    .normalize('NFD')
+    .replace(/[\u0300-\u036f]/g, '')
+    .toLowerCase()
+}
+
+// Distinct normalized word tokens of a product name, stored as search_tokens
+function tokenizeName(name) {
+  return [...new Set(normalizeText(name).split(/[^a-z0-9]+/).filter(Boolean))]
+}
+
+// Compute search_tokens for products created before search tokens existed
+async function backfillSearchTokens(db) {
+  const products = db.collection('products')
+  const cursor = products.find({ search_tokens: { $exists: false } }, { projection: { _id: 1, name: 1 } })
+  let batch = []
+  
+  for await (const product of cursor) {
+    batch.push({
+      updateOne: {
+        filter: { _id: product._id },
+        update: { $set: { search_tokens: tokenizeName(product.name) } }
+      }
+    })
+    if (batch.length === 1000) {
+      await products.bulkWrite(batch, { ordered: false })
+      batch = []
+    }
+  }
+  if (batch.length > 0) {
+    await products.bulkWrite(batch, { ordered: false })
+  }
+}
+
+// Store running expense/withdrawal totals on registers opened before they existed
+async function backfillCashRegisterTotals(db) {
+  await db.collection('cash_registers').updateMany(
+    { status: 'open', total_expenses: { $exists: false } },
+    [{ $set: { total_expenses: { $sum: '$expenses.amount' }, total_withdrawals: { $sum: '$withdrawals.amount' } } }]
+  )
+}
+
+function escapeRegex(text) {
+  return text.replace(/[.*+?^${}()|[\]\\]/g, '\\$&')
+}
+
+// Relevance of a product for a search: exact barcode, then name prefix,
+// then number of query tokens matching the start of a name token
+function scoreProduct(product, search, queryTokens) {
+  if (product.barcode && product.barcode === search) return 1000
+  let score = 0
+  const name = normalizeText(product.name)
+  if (name.startsWith(queryTokens.join(' '))) score += 100
+  for (const token of queryTokens) {
+    if (product.search_tokens.includes(token)) score += 10
+    else if (product.search_tokens.some(candidate => candidate.startsWith(token))) score += 5
+  }
+  if (product.barcode && product.barcode.startsWith(search)) score += 1
+  return score
+}
+
+// Indexed type-ahead search: exact barcode fast path, otherwise every query
+// token must prefix-match a name token (or the query prefixes the barcode)
+async function searchProducts(db, userId, search, limit) {
+  const products = db.collection('products')
+  const projection = { _id: 0, catalog_version: 0 }
+  const strip = ({ search_tokens, ...rest }) => rest
   
-  const tokenMatch = cookie.match(/auth_token=([^;]+)/)
-  if (!tokenMatch) return null
+  const exact = await products.find({ user_id: userId, barcode: search }, { projection }).limit(limit).toArray()
+  if (exact.length > 0) {
+    return exact.map(strip)
+  }
   
-  try {
-    const decoded = jwt.verify(tokenMatch[1], JWT_SECRET)
-    return decoded
-  } catch (error) {
-    return null
+  // Candidate queries from the best scoring matches down: every token whole,
+  // the completed words whole with the last one still being typed, every
+  // token as a prefix, and last the barcode prefix. Later tiers only fill
+  // what the earlier ones left, so the cap never cuts a better match for a
+  // worse one that came first in index order.
+  const queryTokens = tokenizeName(search)
+  const tiers = []
+  if (queryTokens.length > 0) {
+    const prefixes = queryTokens.map(token => new RegExp(`^${token}`))
+    tiers.push({ search_tokens: { $all: queryTokens } })
+    if (queryTokens.length > 1) {
+      tiers.push({ search_tokens: { $all: [...queryTokens.slice(0, -1), prefixes[prefixes.length - 1]] } })
+    }
+    tiers.push({ search_tokens: { $all: prefixes } })
+  }
+  tiers.push({ barcode: { $regex: `^${escapeRegex(search)}` } })
+  
+  const cap = Math.min(limit * 4, SEARCH_MAX_LIMIT * 4)
+  const candidates = new Map()
+  for (const tier of tiers) {
+    if (candidates.size >= cap) break
+    const found = await products
+      .find({ user_id: userId, ...tier, id: { $nin: [...candidates.keys()] } }, { projection })
+      .limit(cap - candidates.size)
+      .toArray()
+    found.forEach(product => candidates.set(product.id, product))
   }
+  
+  return [...candidates.values()]
+    .map(product => ({ product, score: scoreProduct({ ...product, search_tokens: product.search_tokens || [] }, search, queryTokens) }))
+    .sort((a, b) => b.score - a.score || a.product.name.localeCompare(b.product.name))
+    .slice(0, limit)
+    .map(({ product }) => strip(product))
 }
 
-// OPTIONS handler for CORS
-export async function OPTIONS() {
-  return handleCORS(new NextResponse(null, { status: 200 }))
+// Collect the stages and index names of the winning plan(s) in an explain() output
+function summarizePlan(explain, summary = { stages: new Set(), indexes: new Set() }) {
+  if (Array.isArray(explain)) {
+    explain.forEach(entry => summarizePlan(entry, summary))
+  } else if (explain && typeof explain === 'object') {
+    for (const [key, value] of Object.entries(explain)) {
+      if (key === 'rejectedPlans') continue
+      if (key === 'stage' && typeof value === 'string') summary.stages.add(value)
+      if (key === 'indexName' && typeof value === 'string') summary.indexes.add(value)
+      summarizePlan(value, summary)
+    }
+  }
+  return summary
 }
 
-// Route handler function
-async function handleRoute(request, { params }) {
-  const { path = [] } = params
-  const route = `/${path.join('/')}`
-  const method = request.method
+// Explain the queries issued by each route for one tenant and flag collection scans
+async function explainRouteQueries(db, userId) {
+  const today = new Date()
+  today.setHours(0, 0, 0, 0)
+  
+  const queries = {
+    'auth.login': () => db.collection('users').find({ email: '' }).explain('queryPlanner'),
+    'auth.me': () => db.collection('users').find({ id: userId }).explain('queryPlanner'),
+    'products.list': () => db.collection('products').find({ user_id: userId }).sort({ created_at: -1, id: -1 }).explain('queryPlanner'),
+    'products.barcode': () => db.collection('products').find({ user_id: userId, barcode: '' }).explain('queryPlanner'),
+    'products.search_exact': () => db.collection('products').find({ user_id: userId, search_tokens: { $all: ['a'] } }).explain('queryPlanner'),
+    'products.search': () => db.collection('products').find({ user_id: userId, search_tokens: { $all: [/^a/] }, id: { $nin: [''] } }).explain('queryPlanner'),
+    'products.search_barcode': () => db.collection('products').find({ user_id: userId, barcode: { $regex: '^a' }, id: { $nin: [''] } }).explain('queryPlanner'),
+    'products.by_id': () => db.collection('products').find({ user_id: userId, id: { $in: [''] } }).explain('queryPlanner'),
+    'products.changes': () => db.collection('products').find({ user_id: userId, catalog_version: { $gt: 0 } }).explain('queryPlanner'),
+    'tombstones.changes': () => db.collection('product_tombstones').find({ user_id: userId, catalog_version: { $gt: 0 } }).explain('queryPlanner'),
+    'sales.list': () => db.collection('sales').find({ user_id: userId, date: { $gte: today } }).sort({ date: -1, id: -1 }).explain('queryPlanner'),
+    'sales.archive': () => db.collection('sales_archive').find({ user_id: userId, end_date: { $gte: today } }).sort({ end_date: -1 }).explain('queryPlanner'),
+    'sales.daily': () => db.collection('sales_daily').find({ user_id: userId, day: { $gte: '' } }).sort({ day: 1 }).explain('queryPlanner'),
+    'cash_register.current': () => db.collection('cash_registers').find({ user_id: userId, status: 'open' }).explain('queryPlanner'),
+    'cash_register.history': () => db.collection('cash_registers').find({ user_id: userId, status: 'closed' }).sort({ closed_at: -1 }).explain('queryPlanner'),
+    'dashboard.sales': () => db.collection('sales').aggregate([{ $match: { user_id: userId, date: { $gte: today } } }]).explain('queryPlanner'),
+    'dashboard.inventory': () => db.collection('products').aggregate([{ $match: { user_id: userId } }, { $count: 'count' }]).explain('queryPlanner')
+  }
+  
+  return Promise.all(Object.entries(queries).map(async ([name, explain]) => {
+    const { stages, indexes } = summarizePlan(await explain())
+    return {
+      query: name,
+      stages: [...stages],
+      indexes: [...indexes],
+      collscan: stages.has('COLLSCAN')
+    }
+  }))
+}
+
+// Timezone used to bucket sales into calendar days for the daily rollup
+const SALES_TIMEZONE = process.env.SALES_TIMEZONE || Intl.DateTimeFormat().resolvedOptions().timeZone
 
+const dayKeyFormatter = new Intl.DateTimeFormat('en-CA', {
+  timeZone: SALES_TIMEZONE,
+  year: 'numeric',
+  month: '2-digit',
+  day: '2-digit'
+})
+
+// Calendar day (YYYY-MM-DD) a date falls on in SALES_TIMEZONE
+function getDayKey(date) {
+  return dayKeyFormatter.format(date)
+}
+
+const zonedTimeFormatter = new Intl.DateTimeFormat('en-CA', {
+  timeZone: SALES_TIMEZONE,
+  hourCycle: 'h23',
+  year: 'numeric',
+  month: '2-digit',
+  day: '2-digit',
+  hour: '2-digit',
+  minute: '2-digit',
+  second: '2-digit'
+})
+
+// Offset of SALES_TIMEZONE from UTC at an instant, in milliseconds
+function getZoneOffset(time) {
+  const parts = Object.fromEntries(zonedTimeFormatter.formatToParts(new Date(time)).map(part => [part.type, part.value]))
+  const wallClock = Date.UTC(parts.year, parts.month - 1, parts.day, parts.hour, parts.minute, parts.second)
+  return wallClock - Math.floor(time / 1000) * 1000
+}
+
+// Instant a calendar day (YYYY-MM-DD) starts in SALES_TIMEZONE. The offset
+// is taken again at the result in case a DST change falls in between.
+function getDayStart(dayKey) {
+  const midnightUtc = Date.parse(`${dayKey}T00:00:00Z`)
+  const start = midnightUtc - getZoneOffset(midnightUtc)
+  return new Date(midnightUtc - getZoneOffset(start))
+}
+
+// Build the $inc update that folds one sale into its sales_daily document
+function buildDailyRollupUpdate(sale) {
+  const isCash = sale.payment_method === 'cash'
+  const inc = {
+    revenue: sale.total_amount,
+    profit: sale.profit,
+    sales_count: 1,
+    cash_revenue: isCash ? sale.total_amount : 0,
+    card_revenue: isCash ? 0 : sale.total_amount,
+    cash_count: isCash ? 1 : 0,
+    card_count: isCash ? 0 : 1
+  }
+  for (const item of sale.items) {
+    const key = `products.${item.product_id}`
+    inc[key] = (inc[key] || 0) + item.quantity
+  }
+  return {
+    $inc: inc,
+    $set: { updated_at: new Date() }
+  }
+}
+
+// Recompute every sales_daily document of a tenant from its raw sales, hot
+// and archived. Returns the number of days, or null when the tenant's sales
+// history is locked by an archive run or another rebuild.
+//
+// Sales recorded while a rebuild runs may be counted twice or not at all
+// (their $inc can land before or after the re-merge of their day), so run it
+// when the store is not selling, and again if sales came in meanwhile.
+async function rebuildSalesDaily(db, userId) {
+  // Shares the archive job's lock: sales must not move between tiers while
+  // they are counted, and two rebuilds must not interleave
+  const lockName = `sales_archive:${userId}`
+  if (!await acquireJobLock(db, lockName, SALES_ARCHIVE_LOCK_MS)) return null
   try {
-    const db = await connectToMongo()
+    return await recomputeSalesDaily(db, userId)
+  } finally {
+    await releaseJobLock(db, lockName)
+  }
+}
 
-    // ==================== AUTH ROUTES ====================
-    
-    // Register - POST /api/auth/register
-    if (route === '/auth/register' && method === 'POST') {
-      const body = await request.json()
-      const { email, password, store_name, currency_symbol } = body
-      
-      if (!email || !password || !store_name) {
-        return handleCORS(NextResponse.json(
-          { error: 'Email, password y nombre de tienda son requeridos' },
-          { status: 400 }
-        ))
-      }
-      
-      // Check if user already exists
-      const existingUser = await db.collection('users').findOne({ email })
-      if (existingUser) {
-        return handleCORS(NextResponse.json(
-          { error: 'El email ya está registrado' },
-          { status: 400 }
-        ))
-      }
-      
-      // NOTA: Guardando contraseña en texto plano para desarrollo/MVP
-      // TODO: Implementar sistema de reset password y volver a encriptar
-      const user = {
-        id: uuidv4(),
-        email,
-        password: password, // Guardando sin encriptar para poder recuperarla
-        store_name,
-        currency_symbol: currency_symbol || '$',
-        created_at: new Date()
-      }
-      
-      await db.collection('users').insertOne(user)
-      
-      // Create JWT token
-      const token = jwt.sign(
-        { userId: user.id, email: user.email },
-        JWT_SECRET,
-        { expiresIn: '7d' }
-      )
-      
-      const response = NextResponse.json({
-        message: 'Usuario registrado exitosamente',
-        user: { id: user.id, email: user.email, store_name: user.store_name }
-      })
-      
-      response.cookies.set('auth_token', token, {
-        httpOnly: true,
-        secure: process.env.NODE_ENV === 'production',
-        sameSite: 'lax',
-        maxAge: 60 * 60 * 24 * 7 // 7 days
-      })
-      
-      return handleCORS(response)
-    }
-    
-    // Login - POST /api/auth/login
-    if (route === '/auth/login' && method === 'POST') {
-      const body = await request.json()
-      const { email, password } = body
-      
-      if (!email || !password) {
-        return handleCORS(NextResponse.json(
-          { error: 'Email y password son requeridos' },
-          { status: 400 }
-        ))
+async function recomputeSalesDaily(db, userId) {
+  const dayExpression = { $dateToString: { format: '%Y-%m-%d', date: '$date', timezone: SALES_TIMEZONE } }
+  
+  // $merge needs the unique (user_id, day) index created by the startup index pass
+  await whenIndexesReady()
+  await db.collection('sales_daily').deleteMany({ user_id: userId })
+  
+  // Day totals, one document per day with at least one sale
+  await db.collection('sales').aggregate([
+    { $match: { user_id: userId } },
+    unionArchivedSales(userId),
+    {
+      $group: {
+        _id: dayExpression,
+        revenue: { $sum: '$total_amount' },
+        profit: { $sum: '$profit' },
+        sales_count: { $sum: 1 },
+        cash_revenue: { $sum: { $cond: [{ $eq: ['$payment_method', 'cash'] }, '$total_amount', 0] } },
+        card_revenue: { $sum: { $cond: [{ $eq: ['$payment_method', 'cash'] }, 0, '$total_amount'] } },
+        cash_count: { $sum: { $cond: [{ $eq: ['$payment_method', 'cash'] }, 1, 0] } },
+        card_count: { $sum: { $cond: [{ $eq: ['$payment_method', 'cash'] }, 0, 1] } }
       }
-      
-      const user = await db.collection('users').findOne({ email })
-      if (!user) {
-        return handleCORS(NextResponse.json(
-          { error: 'Credenciales inválidas' },
-          { status: 401 }
-        ))
+    },
+    { $addFields: { user_id: { $literal: userId }, day: '$_id', updated_at: '$$NOW' } },
+    { $project: { _id: 0 } },
+    { $merge: { into: 'sales_daily', on: ['user_id', 'day'], whenMatched: 'merge', whenNotMatched: 'insert' } }
+  ], { allowDiskUse: true }).toArray()
+  
+  // Units sold per product, merged into the day documents created above
+  await db.collection('sales').aggregate([
+    { $match: { user_id: userId } },
+    unionArchivedSales(userId),
+    { $unwind: '$items' },
+    {
+      $group: {
+        _id: { day: dayExpression, product_id: '$items.product_id' },
+        units: { $sum: '$items.quantity' }
       }
-      
-      // Comparación directa de contraseña (sin encriptación)
-      // NOTA: Para desarrollo/MVP. Implementar reset password y encriptación en producción
-      const isValidPassword = user.password === password
-      if (!isValidPassword) {
-        return handleCORS(NextResponse.json(
-          { error: 'Credenciales inválidas' },
-          { status: 401 }
-        ))
+    },
+    {
+      $group: {
+        _id: '$_id.day',
+        products: { $push: { k: '$_id.product_id', v: '$units' } }
       }
-      
-      const token = jwt.sign(
-        { userId: user.id, email: user.email },
-        JWT_SECRET,
-        { expiresIn: '7d' }
-      )
-      
-      const response = NextResponse.json({
-        message: 'Login exitoso',
-        user: { id: user.id, email: user.email, store_name: user.store_name, currency_symbol: user.currency_symbol }
-      })
-      
-      response.cookies.set('auth_token', token, {
-        httpOnly: true,
-        secure: process.env.NODE_ENV === 'production',
-        sameSite: 'lax',
-        maxAge: 60 * 60 * 24 * 7
-      })
-      
-      return handleCORS(response)
-    }
-    
-    // Logout - POST /api/auth/logout
-    if (route === '/auth/logout' && method === 'POST') {
-      const response = NextResponse.json({ message: 'Logout exitoso' })
-      response.cookies.delete('auth_token')
-      return handleCORS(response)
+    },
+    { $project: { _id: 0, user_id: { $literal: userId }, day: '$_id', products: { $arrayToObject: '$products' } } },
+    { $merge: { into: 'sales_daily', on: ['user_id', 'day'], whenMatched: 'merge', whenNotMatched: 'insert' } }
+  ], { allowDiskUse: true }).toArray()
+  
+  return db.collection('sales_daily').countDocuments({ user_id: userId })
+}
+
+// Sales tiers: recent sales live in `sales`. The retention job moves older
+// ones into `sales_archive` buckets (up to SALES_ARCHIVE_BUCKET_SIZE sales of
+// one month, newest first, stored without _id and user_id) and adds them to
+// the `sales_archive_months` summary of their month.
+
+// Calendar month (YYYY-MM) a date falls on in SALES_TIMEZONE
+function getMonthKey(date) {
+  return getDayKey(date).slice(0, 7)
+}
+
+// Lower and upper bound of a Mongo date condition ($gte/$gt, $lte/$lt)
+function getDateBounds(dateRange) {
+  return {
+    lower: dateRange?.$gte ?? dateRange?.$gt ?? null,
+    upper: dateRange?.$lte ?? dateRange?.$lt ?? null
+  }
+}
+
+// Whether a date satisfies a Mongo date condition, evaluated in JavaScript
+function matchesDateRange(date, dateRange) {
+  if (!dateRange) return true
+  return (dateRange.$gte === undefined || date >= dateRange.$gte) &&
+    (dateRange.$gt === undefined || date > dateRange.$gt) &&
+    (dateRange.$lte === undefined || date <= dateRange.$lte) &&
+    (dateRange.$lt === undefined || date < dateRange.$lt)
+}
+
+// Archive buckets (or month summaries) that may hold sales within a date condition
+function archiveBucketQuery(userId, dateRange) {
+  const { lower, upper } = getDateBounds(dateRange)
+  const query = { user_id: userId }
+  if (lower) query.end_date = { $gte: lower }
+  if (upper) query.start_date = { $lte: upper }
+  return query
+}
+
+// $unionWith stage that appends a tenant's archived sales within `dateRange`
+// (a condition on the sale date) to a pipeline over sales. They come out as
+// regular sale documents, newest bucket first.
+function unionArchivedSales(userId, dateRange = null) {
+  return {
+    $unionWith: {
+      coll: 'sales_archive',
+      pipeline: [
+        { $match: archiveBucketQuery(userId, dateRange) },
+        { $sort: { end_date: -1 } },
+        { $unwind: '$sales' },
+        { $replaceRoot: { newRoot: { $mergeObjects: ['$sales', { user_id: '$user_id' }] } } },
+        ...(dateRange ? [{ $match: { date: dateRange } }] : [])
+      ]
     }
-    
-    // Get current user - GET /api/auth/me
-    if (route === '/auth/me' && method === 'GET') {
-      const decoded = verifyToken(request)
-      if (!decoded) {
-        return handleCORS(NextResponse.json(
-          { error: 'No autenticado' },
-          { status: 401 }
-        ))
-      }
-      
-      const user = await db.collection('users').findOne({ id: decoded.userId })
-      if (!user) {
-        return handleCORS(NextResponse.json(
-          { error: 'Usuario no encontrado' },
-          { status: 404 }
-        ))
-      }
-      
-      return handleCORS(NextResponse.json({
-        user: {
-          id: user.id,
-          email: user.email,
-          store_name: user.store_name,
-          currency_symbol: user.currency_symbol
-        }
-      }))
+  }
+}
+
+// Sales dated before this belong in the archive
+function getArchiveCutoff() {
+  return new Date(Date.now() - SALES_RETENTION_DAYS * 86400000)
+}
+
+// Lock a named job across server processes. Returns false while another
+// process holds it; a lock that is never released expires after `ttlMs`.
+async function acquireJobLock(db, name, ttlMs) {
+  const now = new Date()
+  try {
+    await db.collection('job_locks').updateOne(
+      { name, locked_until: { $lte: now } },
+      { $set: { locked_until: new Date(now.getTime() + ttlMs), locked_at: now } },
+      { upsert: true }
+    )
+    return true
+  } catch (error) {
+    if (error.code !== 11000) throw error
+    return false
+  }
+}
+
+function releaseJobLock(db, name) {
+  return db.collection('job_locks').updateOne({ name }, { $set: { locked_until: new Date(0) } })
+}
+
+// Finish archiving a bucket: drop its sales from the hot collection and fold
+// them into the month summary. Safe to repeat, so a run that stopped halfway
+// is completed by the next one: a month already listing the bucket is left as is.
+async function settleArchiveBucket(db, bucket, session) {
+  await db.collection('sales').deleteMany(
+    { user_id: bucket.user_id, id: { $in: bucket.sales.map(sale => sale.id) } },
+    { session }
+  )
+  
+  const inc = {}
+  for (const sale of bucket.sales) {
+    for (const [key, value] of Object.entries(buildDailyRollupUpdate(sale).$inc)) {
+      inc[key] = (inc[key] || 0) + value
     }
+  }
+  try {
+    await db.collection('sales_archive_months').updateOne(
+      { user_id: bucket.user_id, month: bucket.month, buckets: { $ne: bucket.id } },
+      {
+        $inc: inc,
+        $min: { start_date: bucket.start_date },
+        $max: { end_date: bucket.end_date },
+        $push: { buckets: bucket.id },
+        $set: { updated_at: new Date() }
+      },
+      { upsert: true, session }
+    )
+  } catch (error) {
+    if (error.code !== 11000) throw error
+  }
+  
+  await db.collection('sales_archive').updateOne({ id: bucket.id }, { $unset: { pending: '' } }, { session })
+}
+
+// Move a tenant's sales dated before `cutoff` into archive buckets, oldest
+// first. Returns how many sales and buckets were written, or null when
+// another process is already archiving this tenant.
+async function archiveSales(db, userId, cutoff = getArchiveCutoff()) {
+  const lockName = `sales_archive:${userId}`
+  if (!await acquireJobLock(db, lockName, SALES_ARCHIVE_LOCK_MS)) return null
+  
+  try {
+    const archive = db.collection('sales_archive')
+    const result = { archived: 0, buckets: 0 }
     
-    // ==================== PROTECTED ROUTES ====================
-    // All routes below require authentication
-    
-    const decoded = verifyToken(request)
-    if (!decoded) {
-      return handleCORS(NextResponse.json(
-        { error: 'No autenticado' },
-        { status: 401 }
-      ))
+    // Complete the buckets a previous run left pending
+    for (const bucket of await archive.find({ user_id: userId, pending: true }).toArray()) {
+      await settleArchiveBucket(db, bucket)
     }
     
-    const userId = decoded.userId
-    
-    // ==================== PRODUCTS ROUTES ====================
-    
-    // Get all products - GET /api/products
-    if (route === '/products' && method === 'GET') {
-      const url = new URL(request.url)
-      const search = url.searchParams.get('search')
-      const barcode = url.searchParams.get('barcode')
-      
-      let query = { user_id: userId }
-      
-      if (search) {
-        query.$or = [
-          { name: { $regex: search, $options: 'i' } },
-          { barcode: { $regex: search, $options: 'i' } }
-        ]
-      }
-      
-      if (barcode) {
-        query.barcode = barcode
-      }
-      
-      const products = await db.collection('products')
-        .find(query)
-        .sort({ created_at: -1 })
+    const useTransactions = await supportsTransactions(db)
+    while (true) {
+      const sales = await db.collection('sales')
+        .find({ user_id: userId, date: { $lt: cutoff } }, { projection: { _id: 0, user_id: 0 } })
+        .sort({ date: 1, id: 1 })
+        .limit(SALES_ARCHIVE_BUCKET_SIZE)
         .toArray()
+      if (sales.length === 0) break
       
-      const cleanedProducts = products.map(({ _id, ...rest }) => rest)
-      return handleCORS(NextResponse.json(cleanedProducts))
-    }
-    
-    // Create product - POST /api/products
-    if (route === '/products' && method === 'POST') {
-      const body = await request.json()
-      const { barcode, name, cost_price, sale_price, stock_quantity, category } = body
-      
-      if (!name || !sale_price || stock_quantity === undefined) {
-        return handleCORS(NextResponse.json(
-          { error: 'Nombre, precio de venta y cantidad son requeridos' },
-          { status: 400 }
-        ))
-      }
-      
-      const product = {
+      // A bucket never spans two months
+      const month = getMonthKey(sales[0].date)
+      const bucketSales = sales.filter(sale => getMonthKey(sale.date) === month).reverse()
+      const bucket = {
         id: uuidv4(),
         user_id: userId,
-        barcode: barcode || '',
-        name,
-        cost_price: parseFloat(cost_price) || 0,
-        sale_price: parseFloat(sale_price),
-        stock_quantity: parseInt(stock_quantity),
-        category: category || 'General',
-        low_stock_alert: parseInt(stock_quantity) < 10,
+        month,
+        start_date: bucketSales[bucketSales.length - 1].date,
+        end_date: bucketSales[0].date,
+        sales_count: bucketSales.length,
+        sales: bucketSales,
+        pending: true,
         created_at: new Date()
       }
       
-      await db.collection('products').insertOne(product)
-      const { _id, ...cleanProduct } = product
-      
-      return handleCORS(NextResponse.json(cleanProduct))
-    }
-    
-    // Update product - PUT /api/products/:id
-    if (route.startsWith('/products/') && method === 'PUT') {
-      const productId = path[1]
-      const body = await request.json()
-      
-      const updateData = {
-        ...body,
-        cost_price: body.cost_price ? parseFloat(body.cost_price) : 0,
-        sale_price: body.sale_price ? parseFloat(body.sale_price) : 0,
-        stock_quantity: body.stock_quantity !== undefined ? parseInt(body.stock_quantity) : 0,
-        low_stock_alert: (body.stock_quantity !== undefined ? parseInt(body.stock_quantity) : 0) < 10
-      }
-      
-      const result = await db.collection('products').updateOne(
-        { id: productId, user_id: userId },
-        { $set: updateData }
-      )
-      
-      if (result.matchedCount === 0) {
-        return handleCORS(NextResponse.json(
-          { error: 'Producto no encontrado' },
-          { status: 404 }
-        ))
+      // With transactions the bucket replaces its hot sales atomically;
+      // otherwise readers may see both copies until the bucket is settled
+      if (useTransactions) {
+        const session = client.startSession()
+        try {
+          await session.withTransaction(async () => {
+            await archive.insertOne(bucket, { session })
+            await settleArchiveBucket(db, bucket, session)
+          })
+        } finally {
+          await session.endSession()
+        }
+      } else {
+        await archive.insertOne(bucket)
+        await settleArchiveBucket(db, bucket)
       }
       
-      return handleCORS(NextResponse.json({ message: 'Producto actualizado' }))
+      result.archived += bucketSales.length
+      result.buckets++
     }
     
-    // Delete product - DELETE /api/products/:id
-    if (route.startsWith('/products/') && method === 'DELETE') {
-      const productId = path[1]
-      
-      const result = await db.collection('products').deleteOne({
-        id: productId,
-        user_id: userId
-      })
-      
-      if (result.deletedCount === 0) {
-        return handleCORS(NextResponse.json(
-          { error: 'Producto no encontrado' },
-          { status: 404 }
-        ))
+    return result
+  } finally {
+    await releaseJobLock(db, lockName)
+  }
+}
+
+// Archive every tenant's old sales now and every SALES_ARCHIVE_INTERVAL_MS.
+// Started once per process; the per-tenant lock keeps several processes from
+// archiving the same tenant at the same time.
+function scheduleSalesArchive(db) {
+  if (SALES_RETENTION_DAYS <= 0 || globalThis.__cloudposSalesArchive) return
+  
+  const run = async () => {
+    const users = await db.collection('users').find({}, { projection: { _id: 0, id: 1 } }).toArray()
+    let archived = 0
+    for (const user of users) {
+      try {
+        archived += (await archiveSales(db, user.id))?.archived || 0
+      } catch (error) {
+        console.error(`Sales archive failed for user ${user.id}:`, error)
       }
-      
-      return handleCORS(NextResponse.json({ message: 'Producto eliminado' }))
     }
-    
-    // ==================== SALES ROUTES ====================
-    
-    // Create sale - POST /api/sales
-    if (route === '/sales' && method === 'POST') {
-      const body = await request.json()
-      const { items, payment_method, amount_received } = body
-      
-      if (!items || items.length === 0) {
-        return handleCORS(NextResponse.json(
-          { error: 'No hay items en la venta' },
-          { status: 400 }
-        ))
-      }
-      
-      // Validate stock and calculate totals
-      let total_amount = 0
-      let total_cost = 0
-      const saleItems = []
-      
-      for (const item of items) {
-        const product = await db.collection('products').findOne({
-          id: item.product_id,
-          user_id: userId
-        })
-        
-        if (!product) {
-          return handleCORS(NextResponse.json(
-            { error: `Producto ${item.product_id} no encontrado` },
-            { status: 404 }
-          ))
-        }
-        
-        if (product.stock_quantity < item.quantity) {
-          return handleCORS(NextResponse.json(
-            { error: `Stock insuficiente para ${product.name}. Disponible: ${product.stock_quantity}` },
-            { status: 400 }
-          ))
-        }
-        
-        const itemTotal = product.sale_price * item.quantity
-        const itemCost = product.cost_price * item.quantity
-        
-        total_amount += itemTotal
-        total_cost += itemCost
-        
-        saleItems.push({
-          product_id: product.id,
-          product_name: product.name,
-          quantity: item.quantity,
-          price_at_sale: product.sale_price,
-          cost_at_sale: product.cost_price
-        })
-        
-        // Update stock
-        await db.collection('products').updateOne(
-          { id: product.id, user_id: userId },
-          { 
-            $inc: { stock_quantity: -item.quantity },
-            $set: { low_stock_alert: (product.stock_quantity - item.quantity) < 10 }
-          }
-        )
-      }
-      
-      const sale = {
-        id: uuidv4(),
-        user_id: userId,
-        total_amount,
-        profit: total_amount - total_cost,
-        payment_method: payment_method || 'cash',
-        amount_received: amount_received || total_amount,
-        change_given: (amount_received || total_amount) - total_amount,
-        items: saleItems,
-        date: new Date()
-      }
-      
-      await db.collection('sales').insertOne(sale)
-      
-      // Update cash register if open
-      const openCashRegister = await db.collection('cash_registers').findOne({
-        user_id: userId,
-        status: 'open'
-      })
-      
-      if (openCashRegister) {
-        const updateFields = {}
-        if (payment_method === 'cash') {
-          updateFields.cash_sales = openCashRegister.cash_sales + total_amount
-        } else {
-          updateFields.card_sales = openCashRegister.card_sales + total_amount
-        }
-        
-        // Recalculate expected cash
-        const newCashSales = payment_method === 'cash' 
-          ? openCashRegister.cash_sales + total_amount 
-          : openCashRegister.cash_sales
-        const totalExpenses = openCashRegister.expenses.reduce((sum, e) => sum + e.amount, 0)
-        const totalWithdrawals = openCashRegister.withdrawals.reduce((sum, w) => sum + w.amount, 0)
-        updateFields.expected_cash = openCashRegister.initial_cash + newCashSales - totalExpenses - totalWithdrawals
-        
-        await db.collection('cash_registers').updateOne(
-          { id: openCashRegister.id },
-          { $set: updateFields }
-        )
-      }
-      
-      const { _id, ...cleanSale } = sale
-      
-      return handleCORS(NextResponse.json(cleanSale))
+    if (archived > 0) {
+      console.log(`Archived ${archived} sales older than ${SALES_RETENTION_DAYS} days`)
     }
-    
-    // Get all sales - GET /api/sales
-    if (route === '/sales' && method === 'GET') {
-      const url = new URL(request.url)
-      const startDate = url.searchParams.get('start_date')
-      const endDate = url.searchParams.get('end_date')
-      
-      let query = { user_id: userId }
-      
-      if (startDate || endDate) {
-        query.date = {}
-        if (startDate) query.date.$gte = new Date(startDate)
-        if (endDate) query.date.$lte = new Date(endDate)
-      }
-      
-      const sales = await db.collection('sales')
-        .find(query)
-        .sort({ date: -1 })
-        .limit(1000)
-        .toArray()
-      
-      const cleanedSales = sales.map(({ _id, ...rest }) => rest)
-      return handleCORS(NextResponse.json(cleanedSales))
+  }
+  const runSafely = () => run().catch(error => console.error('Sales archive run failed:', error))
+  
+  globalThis.__cloudposSalesArchive = setInterval(runSafely, SALES_ARCHIVE_INTERVAL_MS)
+  globalThis.__cloudposSalesArchive.unref?.()
+  runSafely()
+}
+
+// Parse ?limit=, ?after= and ?fields= of a listing request. Throws a
+// RangeError with a user facing message when a parameter is invalid.
+function parseListParams(searchParams, { allowedFields, defaultLimit }) {
+  const rawLimit = searchParams.get('limit')
+  const limit = rawLimit === null ? defaultLimit : parseInt(rawLimit)
+  if (limit !== null && !(limit > 0)) {
+    throw new RangeError('El parámetro limit debe ser un número mayor a 0')
+  }
+  
+  let after = null
+  const rawAfter = searchParams.get('after')
+  if (rawAfter) {
+    try {
+      const [sortValue, id] = JSON.parse(Buffer.from(rawAfter, 'base64url').toString())
+      after = { sortValue: new Date(sortValue), id }
+    } catch (error) {
+      after = null
     }
-    
-    // ==================== CASH REGISTER ROUTES ====================
-    
-    // Open cash register - POST /api/cash-register/open
-    if (route === '/cash-register/open' && method === 'POST') {
-      const body = await request.json()
-      const { initial_cash } = body
-      
-      if (initial_cash === undefined || initial_cash < 0) {
-        return handleCORS(NextResponse.json(
-          { error: 'El fondo inicial es requerido y debe ser mayor o igual a 0' },
-          { status: 400 }
-        ))
-      }
-      
-      // Get user info
-      const user = await db.collection('users').findOne({ id: userId })
-      
-      // Check if there's already an open cash register
-      const existingOpen = await db.collection('cash_registers').findOne({
-        user_id: userId,
-        status: 'open'
+    if (!after || isNaN(after.sortValue) || typeof after.id !== 'string') {
+      throw new RangeError('Cursor inválido')
+    }
+  }
+  
+  let projection = { _id: 0, search_tokens: 0, catalog_version: 0 }
+  const rawFields = searchParams.get('fields')
+  if (rawFields) {
+    const fields = rawFields.split(',').map(field => field.trim()).filter(Boolean)
+    const unknown = fields.filter(field => !allowedFields.includes(field))
+    if (unknown.length > 0) {
+      throw new RangeError(`Campos desconocidos: ${unknown.join(', ')}`)
+    }
+    projection = { _id: 0 }
+    fields.forEach(field => { projection[field] = 1 })
+  }
+  
+  return { limit: limit === null ? null : Math.min(limit, LIST_MAX_LIMIT), after, projection }
+}
+
+// Keyset pagination on (sortField, id), both descending. Returns one page,
+// the cursor of the next page (null on the last one) and the total count.
+async function paginate(collection, query, sortField, { limit, after, projection }) {
+  let pageQuery = query
+  if (after) {
+    pageQuery = {
+      $and: [query, {
+        $or: [
+          { [sortField]: { $lt: after.sortValue } },
+          { [sortField]: after.sortValue, id: { $lt: after.id } }
+        ]
+      }]
+    }
+  }
+  
+  // The sort key and id are always returned so the next cursor can be built
+  const isInclusion = Object.values(projection).some(value => value === 1)
+  let cursor = collection
+    .find(pageQuery, { projection: isInclusion ? { ...projection, [sortField]: 1, id: 1 } : projection })
+    .sort({ [sortField]: -1, id: -1 })
+  if (limit !== null) {
+    cursor = cursor.limit(limit + 1)
+  }
+  
+  const [documents, total] = await Promise.all([cursor.toArray(), collection.countDocuments(query)])
+  
+  let nextCursor = null
+  if (limit !== null && documents.length > limit) {
+    documents.length = limit
+    const last = documents[documents.length - 1]
+    nextCursor = encodeCursor(last[sortField], last.id)
+  }
+  
+  return { documents, nextCursor, total }
+}
+
+// Opaque ?after= cursor pointing past a document with this sort key and id
+function encodeCursor(sortValue, id) {
+  return Buffer.from(JSON.stringify([sortValue, id])).toString('base64url')
+}
+
+// JSON response for one page, with X-Total-Count and X-Next-Cursor headers
+function paginatedResponse({ documents, nextCursor, total }) {
+  const response = NextResponse.json(documents)
+  response.headers.set('X-Total-Count', String(total))
+  if (nextCursor) {
+    response.headers.set('X-Next-Cursor', nextCursor)
+  }
+  return response
+}
+
+// Listing order of sales: newest first, then by descending id
+function compareSalesDesc(a, b) {
+  return b.date - a.date || (a.id < b.id ? 1 : a.id > b.id ? -1 : 0)
+}
+
+// Number of archived sales within `dateRange`. Months fully inside the range
+// come from their summaries; only the months it cuts read their buckets.
+async function countArchivedSales(db, userId, dateRange) {
+  const months = await db.collection('sales_archive_months')
+    .find(archiveBucketQuery(userId, dateRange), { projection: { _id: 0, month: 1, sales_count: 1, start_date: 1, end_date: 1 } })
+    .toArray()
+  
+  let total = 0
+  const partialMonths = []
+  for (const month of months) {
+    if (matchesDateRange(month.start_date, dateRange) && matchesDateRange(month.end_date, dateRange)) {
+      total += month.sales_count
+    } else {
+      partialMonths.push(month.month)
+    }
+  }
+  
+  if (partialMonths.length > 0) {
+    const [partial] = await db.collection('sales_archive').aggregate([
+      { $match: { user_id: userId, month: { $in: partialMonths } } },
+      { $unwind: '$sales' },
+      { $match: { 'sales.date': dateRange } },
+      { $count: 'count' }
+    ]).toArray()
+    total += partial?.count || 0
+  }
+  return total
+}
+
+// Up to `limit` archived sales in listing order, after the `after` cursor and
+// not older than `floor`. Buckets are read newest first, and reading stops
+// once the page is full and the next bucket only holds older sales.
+async function readArchivedSales(db, userId, { dateRange, after, floor, limit }) {
+  const range = { ...dateRange }
+  if (floor && !(range.$gte >= floor)) range.$gte = floor
+  if (after && !(range.$lte <= after.sortValue)) range.$lte = after.sortValue
+  const isPastCursor = sale => !after || sale.date < after.sortValue ||
+    (sale.date.getTime() === after.sortValue.getTime() && sale.id < after.id)
+  
+  const max = limit ?? Infinity
+  const page = []
+  const buckets = db.collection('sales_archive')
+    .find(archiveBucketQuery(userId, range), { projection: { _id: 0, end_date: 1, sales: 1 } })
+    .sort({ end_date: -1 })
+  for await (const bucket of buckets) {
+    if (page.length >= max && bucket.end_date < page[page.length - 1].date) break
+    for (const sale of bucket.sales) {
+      if (matchesDateRange(sale.date, range) && isPastCursor(sale)) page.push({ ...sale, user_id: userId })
+    }
+    page.sort(compareSalesDesc)
+    if (page.length > max) page.length = max
+  }
+  return page
+}
+
+// paginate() over hot and archived sales. Archived sales only take part when
+// they sort before the last hot sale of the page, so pages of recent sales
+// never read archive buckets.
+async function paginateSales(db, userId, dateRange, listParams) {
+  const query = dateRange ? { user_id: userId, date: dateRange } : { user_id: userId }
+  const [hot, archivedTotal] = await Promise.all([
+    paginate(db.collection('sales'), query, 'date', listParams),
+    countArchivedSales(db, userId, dateRange)
+  ])
+  const total = hot.total + archivedTotal
+  if (archivedTotal === 0) return { ...hot, total }
+  
+  const { limit, after, projection } = listParams
+  const floor = hot.nextCursor ? hot.documents[hot.documents.length - 1].date : null
+  const archived = await readArchivedSales(db, userId, { dateRange, after, floor, limit: limit === null ? null : limit + 1 })
+  if (archived.length === 0) return { ...hot, total }
+  
+  // Archived sales have none of the fields an exclusion projection removes
+  const isInclusion = Object.values(projection).some(value => value === 1)
+  const documents = [
+    ...hot.documents,
+    ...archived.map(sale => isInclusion ? pickFields(sale, { ...projection, date: 1, id: 1 }) : sale)
+  ].sort(compareSalesDesc)
+  
+  let nextCursor = hot.nextCursor
+  if (limit !== null && documents.length > limit) {
+    documents.length = limit
+    const last = documents[limit - 1]
+    nextCursor = encodeCursor(last.date, last.id)
+  }
+  return { documents, nextCursor, total }
+}
+
+// Quote a CSV cell when needed and neutralize spreadsheet formulas
+function csvCell(value) {
+  if (value === null || value === undefined) return ''
+  if (value instanceof Date) return value.toISOString()
+  let text = String(value)
+  if (typeof value === 'string' && /^[=+\-@]/.test(text)) {
+    text = `'${text}`
+  }
+  return /[",\r\n]/.test(text) ? `"${text.replace(/"/g, '""')}"` : text
+}
+
+function csvLine(cells) {
+  return cells.map(csvCell).join(',') + '\r\n'
+}
+
+// Parse a CSV byte stream into rows of cells as it arrives (RFC 4180: quoted
+// cells may contain commas, quotes and line breaks). A UTF-8 BOM is skipped.
+async function* parseCsvStream(stream) {
+  const decoder = new TextDecoder()
+  let row = []
+  let cell = ''
+  let inQuotes = false
+  let pendingQuote = false
+  let started = false
+  
+  for await (const chunk of stream) {
+    let text = decoder.decode(chunk, { stream: true })
+    if (!started && text.length > 0) {
+      started = true
+      if (text.charCodeAt(0) === 0xFEFF) text = text.slice(1)
+    }
+    for (let i = 0; i < text.length; i++) {
+      const char = text[i]
+      if (pendingQuote) {
+        pendingQuote = false
+        if (char === '"') {
+          cell += '"'
+          continue
+        }
+        inQuotes = false
+      }
+      if (inQuotes) {
+        if (char === '"') pendingQuote = true
+        else cell += char
+      } else if (char === '"' && cell === '') {
+        inQuotes = true
+      } else if (char === ',') {
+        row.push(cell)
+        cell = ''
+      } else if (char === '\n') {
+        row.push(cell.endsWith('\r') ? cell.slice(0, -1) : cell)
+        yield row
+        row = []
+        cell = ''
+      } else {
+        cell += char
+      }
+    }
+  }
+  if (cell !== '' || row.length > 0) {
+    row.push(cell.endsWith('\r') ? cell.slice(0, -1) : cell)
+    yield row
+  }
+}
+
+// Stream a Mongo cursor as CSV. Documents are only read from the cursor when
+// the client pulls the next chunk, so memory stays constant for any size.
+function streamCsv(cursor, header, toRows) {
+  const encoder = new TextEncoder()
+  return new ReadableStream({
+    start(controller) {
+      // BOM so spreadsheet applications detect UTF-8
+      controller.enqueue(encoder.encode('\uFEFF' + csvLine(header)))
+    },
+    async pull(controller) {
+      try {
+        let chunk = ''
+        for (let count = 0; count < EXPORT_CHUNK_SIZE; count++) {
+          const document = await cursor.next()
+          if (!document) {
+            if (chunk) controller.enqueue(encoder.encode(chunk))
+            controller.close()
+            await cursor.close()
+            return
+          }
+          chunk += toRows(document).map(csvLine).join('')
+        }
+        controller.enqueue(encoder.encode(chunk))
+      } catch (error) {
+        console.error('Export stream error:', error)
+        controller.error(error)
+        await cursor.close()
+      }
+    },
+    async cancel() {
+      await cursor.close()
+    }
+  })
+}
+
+function csvResponse(stream, filename) {
+  return new NextResponse(stream, {
+    headers: {
+      'Content-Type': 'text/csv; charset=utf-8',
+      'Content-Disposition': `attachment; filename="${filename}"`,
+      'Cache-Control': 'no-store'
+    }
+  })
+}
+
+// Per-tenant product catalogs, indexed by id and barcode. Writes made through
+// this process keep entries exact; the TTL bounds staleness from other processes.
+const catalogCache = new LRUCache({ max: CATALOG_CACHE_TENANTS, ttl: CATALOG_CACHE_TTL_MS })
+const catalogLoads = new Map()
+// Bumped on every invalidation so a load racing a write is not stored
+const catalogGenerations = new Map()
+
+// Cached catalog of a tenant, or null when it is too large to cache
+async function getCatalog(db, userId) {
+  const cached = catalogCache.get(userId)
+  if (cached) return cached.tooLarge ? null : cached
+  
+  // Concurrent misses share one load
+  let pending = catalogLoads.get(userId)
+  if (!pending) {
+    const generation = catalogGenerations.get(userId) || 0
+    pending = loadCatalog(db, userId)
+      .then(catalog => {
+        if ((catalogGenerations.get(userId) || 0) === generation) {
+          catalogCache.set(userId, catalog)
+        }
+        return catalog
       })
-      
-      if (existingOpen) {
-        return handleCORS(NextResponse.json(
-          { error: 'Ya existe una caja abierta. Ciérrala antes de abrir una nueva.' },
+      .finally(() => {
+        if (catalogLoads.get(userId) === pending) catalogLoads.delete(userId)
+      })
+    catalogLoads.set(userId, pending)
+  }
+  
+  const catalog = await pending
+  return catalog.tooLarge ? null : catalog
+}
+
+// The catalog remembers the version it was read at, taken before the read so
+// it never claims writes it may have missed, and a revision counting the stock
+// changes applied to it since; together they identify what it holds.
+async function loadCatalog(db, userId) {
+  const version = await getSettledCatalogVersion(db, userId)
+  const products = await db.collection('products')
+    .find({ user_id: userId }, { projection: { _id: 0, search_tokens: 0, catalog_version: 0 } })
+    .sort({ created_at: -1, id: -1 })
+    .limit(CATALOG_CACHE_MAX_PRODUCTS + 1)
+    .toArray()
+  
+  if (products.length > CATALOG_CACHE_MAX_PRODUCTS) {
+    return { tooLarge: true }
+  }
+  
+  const byId = new Map()
+  const byBarcode = new Map()
+  for (const product of products) {
+    byId.set(product.id, product)
+    if (product.barcode) {
+      if (!byBarcode.has(product.barcode)) byBarcode.set(product.barcode, [])
+      byBarcode.get(product.barcode).push(product)
+    }
+  }
+  return { products, byId, byBarcode, version, revision: 0 }
+}
+
+function invalidateCatalog(userId) {
+  catalogCache.delete(userId)
+  catalogLoads.delete(userId)
+  catalogGenerations.set(userId, (catalogGenerations.get(userId) || 0) + 1)
+}
+
+// Apply the stock decrements of a completed sale to the cached catalog
+function applyCatalogStockChanges(userId, quantities) {
+  // A load in flight may have read the stock from before this sale: keep it
+  // from being cached
+  if (catalogLoads.has(userId)) {
+    invalidateCatalog(userId)
+    return
+  }
+  const catalog = catalogCache.peek(userId)
+  if (!catalog || catalog.tooLarge) return
+  for (const [productId, quantity] of Object.entries(quantities)) {
+    const product = catalog.byId.get(productId)
+    if (!product) {
+      invalidateCatalog(userId)
+      return
+    }
+    product.stock_quantity -= quantity
+    product.low_stock_alert = product.stock_quantity < LOW_STOCK_THRESHOLD
+  }
+  catalog.revision++
+}
+
+// Results of identical read queries, keyed by tenant, route and normalized
+// parameters. Concurrent callers share one query in flight and the result is
+// reused for QUERY_CACHE_TTL_MS. Each write request of a tenant bumps its
+// generation, which drops its cached results and detaches the queries in
+// flight, so nothing read before a write is served after it. Results are
+// shared between callers and must not be mutated.
+const queryCache = new LRUCache({ max: QUERY_CACHE_SIZE, ttl: QUERY_CACHE_TTL_MS })
+const queryLoads = new Map()
+const queryGenerations = new Map()
+let querySharedLoads = 0
+
+async function coalesceQuery(userId, route, params, load) {
+  const key = JSON.stringify([userId, route, params])
+  const generation = queryGenerations.get(userId) || 0
+  
+  if (QUERY_CACHE_TTL_MS > 0) {
+    const cached = queryCache.get(key)
+    if (cached?.generation === generation) return cached.value
+    if (cached) queryCache.delete(key)
+  }
+  
+  const inFlight = queryLoads.get(key)
+  if (inFlight?.generation === generation) {
+    querySharedLoads++
+    return inFlight.promise
+  }
+  
+  const promise = load()
+    .then(value => {
+      if (QUERY_CACHE_TTL_MS > 0 && (queryGenerations.get(userId) || 0) === generation) {
+        queryCache.set(key, { generation, value })
+      }
+      return value
+    })
+    .finally(() => {
+      if (queryLoads.get(key)?.promise === promise) queryLoads.delete(key)
+    })
+  queryLoads.set(key, { generation, promise })
+  return promise
+}
+
+function invalidateQueries(userId) {
+  queryGenerations.set(userId, (queryGenerations.get(userId) || 0) + 1)
+}
+
+// Per-tenant catalog versions. Every write to a tenant's products bumps a
+// counter in catalog_versions and stamps the new value on the documents it
+// touches (catalog_version), or on a tombstone in product_tombstones for a
+// deletion, so terminals can fetch only what changed since the version they hold.
+//
+// A version is taken before its write lands, so a reader may see version N
+// while a write holding N-1 is still in flight. Writes in flight are tracked
+// per tenant and readers never report a version that may still be pending.
+// Like the catalog cache, this assumes a single server process.
+const knownCatalogVersions = new Map()
+const pendingCatalogWrites = new Map()
+
+function noteCatalogVersion(userId, version) {
+  if (version > (knownCatalogVersions.get(userId) || 0)) knownCatalogVersions.set(userId, version)
+}
+
+// Run `write(version)` with the tenant's next catalog version
+async function withCatalogVersion(db, userId, write) {
+  // Registered before the counter moves: the version this write gets is at
+  // least one above the highest this process has seen
+  const token = {}
+  if (!pendingCatalogWrites.has(userId)) pendingCatalogWrites.set(userId, new Map())
+  pendingCatalogWrites.get(userId).set(token, (knownCatalogVersions.get(userId) || 0) + 1)
+  try {
+    const { version } = await db.collection('catalog_versions').findOneAndUpdate(
+      { user_id: userId },
+      { $inc: { version: 1 } },
+      { upsert: true, returnDocument: 'after', projection: { _id: 0, version: 1 } }
+    )
+    noteCatalogVersion(userId, version)
+    return await write(version)
+  } finally {
+    const pending = pendingCatalogWrites.get(userId)
+    pending.delete(token)
+    if (pending.size === 0) pendingCatalogWrites.delete(userId)
+  }
+}
+
+// Highest catalog version whose writes, and all earlier ones, have landed
+async function getSettledCatalogVersion(db, userId) {
+  const counter = await db.collection('catalog_versions').findOne(
+    { user_id: userId },
+    { projection: { _id: 0, version: 1 } }
+  )
+  const current = counter?.version || 0
+  noteCatalogVersion(userId, current)
+  
+  const pending = pendingCatalogWrites.get(userId)
+  if (!pending) return current
+  return Math.min(current, Math.min(...pending.values()) - 1)
+}
+
+// Whether the deployment is a replica set or sharded cluster (transactions available)
+let transactionsSupported
+
+async function supportsTransactions(db) {
+  if (transactionsSupported === undefined) {
+    const hello = await db.admin().command({ hello: 1 })
+    transactionsSupported = Boolean(hello.setName) || hello.msg === 'isdbgrid'
+  }
+  return transactionsSupported
+}
+
+// Conditional stock decrement: only matches while enough stock is left, and
+// recomputes low_stock_alert from the resulting quantity in the same write
+function buildStockDecrement(userId, productId, quantity, version) {
+  const newStock = { $subtract: ['$stock_quantity', quantity] }
+  return {
+    filter: { id: productId, user_id: userId, stock_quantity: { $gte: quantity } },
+    update: [{
+      $set: {
+        stock_quantity: newStock,
+        low_stock_alert: { $lt: [newStock, LOW_STOCK_THRESHOLD] },
+        catalog_version: version
+      }
+    }]
+  }
+}
+
+// Atomically decrement stock for every line of a sale, all or nothing.
+// `quantities` maps product id to units sold. Returns the ids whose stock
+// could not be decremented (empty when the whole sale was applied).
+async function decrementStock(db, userId, quantities) {
+  return withCatalogVersion(db, userId, async version => {
+    const products = db.collection('products')
+    const entries = Object.entries(quantities)
+    
+    if (await supportsTransactions(db)) {
+      const session = client.startSession()
+      try {
+        await session.withTransaction(async () => {
+          const result = await products.bulkWrite(
+            entries.map(([productId, quantity]) => ({ updateOne: buildStockDecrement(userId, productId, quantity, version) })),
+            { session, ordered: false }
+          )
+          if (result.matchedCount !== entries.length) {
+            throw Object.assign(new Error('Insufficient stock'), { insufficientStock: true })
+          }
+        })
+        return []
+      } catch (error) {
+        if (!error.insufficientStock) throw error
+        // The transaction was rolled back; report which lines are short now
+        const current = await products
+          .find({ id: { $in: entries.map(([productId]) => productId) }, user_id: userId }, { projection: { _id: 0, id: 1, stock_quantity: 1 } })
+          .toArray()
+        const stockById = Object.fromEntries(current.map(product => [product.id, product.stock_quantity]))
+        return entries
+          .filter(([productId, quantity]) => !(stockById[productId] >= quantity))
+          .map(([productId]) => productId)
+      } finally {
+        await session.endSession()
+      }
+    }
+    
+    // Standalone servers have no transactions: issue the conditional updates
+    // concurrently and compensate the lines that were applied if any failed
+    const results = await Promise.all(entries.map(([productId, quantity]) => {
+      const { filter, update } = buildStockDecrement(userId, productId, quantity, version)
+      return products.updateOne(filter, update)
+    }))
+    const failed = entries.filter((_, index) => results[index].matchedCount === 0)
+    
+    if (failed.length > 0) {
+      const applied = entries.filter((_, index) => results[index].matchedCount === 1)
+      await restoreStock(db, userId, Object.fromEntries(applied))
+    }
+    
+    return failed.map(([productId]) => productId)
+  })
+}
+
+// Give back stock taken by decrementStock(); `quantities` maps product id to units
+async function restoreStock(db, userId, quantities) {
+  const entries = Object.entries(quantities)
+  if (entries.length === 0) return
+  await withCatalogVersion(db, userId, version => db.collection('products').bulkWrite(entries.map(([productId, quantity]) => ({
+    updateOne: {
+      filter: { id: productId, user_id: userId },
+      update: [{
+        $set: {
+          stock_quantity: { $add: ['$stock_quantity', quantity] },
+          low_stock_alert: { $lt: [{ $add: ['$stock_quantity', quantity] }, LOW_STOCK_THRESHOLD] },
+          catalog_version: version
+        }
+      }]
+    }
+  })), { ordered: false }))
+}
+
+// Units per product of a sale's items (a product may appear on more than one
+// line), or null when a line has no product or a non-positive quantity
+function collectQuantities(items) {
+  const quantities = {}
+  for (const item of items) {
+    const quantity = parseInt(item.quantity)
+    if (!item.product_id || !(quantity > 0)) return null
+    quantities[item.product_id] = (quantities[item.product_id] || 0) + quantity
+  }
+  return quantities
+}
+
+// Sum several quantity maps into one
+function mergeQuantities(quantityMaps) {
+  const merged = {}
+  for (const quantities of quantityMaps) {
+    for (const [productId, quantity] of Object.entries(quantities)) {
+      merged[productId] = (merged[productId] || 0) + quantity
+    }
+  }
+  return merged
+}
+
+// Build a sale document from the current product data. A line that already
+// carries a price_at_sale (a sale charged offline) keeps it; cost always
+// comes from the product.
+function buildSale(userId, { id, items, payment_method, amount_received, date }, productsById) {
+  let total_amount = 0
+  let total_cost = 0
+  const saleItems = []
+  
+  for (const item of items) {
+    const product = productsById[item.product_id]
+    const quantity = parseInt(item.quantity)
+    const price = item.price_at_sale ?? product.sale_price
+    
+    total_amount += price * quantity
+    total_cost += product.cost_price * quantity
+    
+    saleItems.push({
+      product_id: product.id,
+      product_name: product.name,
+      quantity,
+      price_at_sale: price,
+      cost_at_sale: product.cost_price
+    })
+  }
+  
+  return {
+    id: id || uuidv4(),
+    user_id: userId,
+    total_amount,
+    profit: total_amount - total_cost,
+    payment_method: payment_method || 'cash',
+    amount_received: amount_received || total_amount,
+    change_given: (amount_received || total_amount) - total_amount,
+    items: saleItems,
+    date: date || new Date()
+  }
+}
+
+// Copy the fields an inclusion projection selects from a document
+function pickFields(document, projection) {
+  return Object.fromEntries(Object.keys(projection).filter(field => projection[field] === 1).map(field => [field, document[field]]))
+}
+
+// Register fields pushed to live clients whenever the totals change
+const CASH_REGISTER_TOTALS_PROJECTION = {
+  _id: 0,
+  id: 1,
+  status: 1,
+  initial_cash: 1,
+  cash_sales: 1,
+  card_sales: 1,
+  total_expenses: 1,
+  total_withdrawals: 1,
+  expected_cash: 1
+}
+
+// Fold recorded sales into the sales_daily rollup and the open cash register,
+// then push the sales, stock changes and register totals to live clients
+async function applySalesToAggregates(db, userId, sales) {
+  const cashTotal = sales.filter(sale => sale.payment_method === 'cash').reduce((sum, sale) => sum + sale.total_amount, 0)
+  const cardTotal = sales.filter(sale => sale.payment_method !== 'cash').reduce((sum, sale) => sum + sale.total_amount, 0)
+  
+  await Promise.all([
+    db.collection('sales_daily').bulkWrite(sales.map(sale => ({
+      updateOne: {
+        filter: { user_id: userId, day: getDayKey(sale.date) },
+        update: buildDailyRollupUpdate(sale),
+        upsert: true
+      }
+    })), { ordered: false }),
+    // Add the sales to the open cash register, if any, in one atomic update
+    db.collection('cash_registers').findOneAndUpdate(
+      { user_id: userId, status: 'open' },
+      { $inc: { cash_sales: cashTotal, card_sales: cardTotal, expected_cash: cashTotal } },
+      { returnDocument: 'after', projection: CASH_REGISTER_TOTALS_PROJECTION }
+    ).then(cashRegister => {
+      if (cashRegister) publish(userId, 'cash_register', cashRegister)
+    })
+  ])
+  
+  for (const sale of sales) {
+    publish(userId, 'sale', {
+      id: sale.id,
+      total_amount: sale.total_amount,
+      profit: sale.profit,
+      payment_method: sale.payment_method,
+      items_count: sale.items.reduce((sum, item) => sum + item.quantity, 0),
+      date: sale.date
+    })
+  }
+  const sold = mergeQuantities(sales.map(sale => collectQuantities(sale.items)))
+  publish(userId, 'stock', {
+    changes: Object.entries(sold).map(([product_id, quantity]) => ({ product_id, delta: -quantity }))
+  })
+}
+
+// Helper function to handle CORS
+function handleCORS(response) {
+  response.headers.set('Access-Control-Allow-Origin', process.env.CORS_ORIGINS || '*')
+  response.headers.set('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
+  response.headers.set('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+  response.headers.set('Access-Control-Allow-Credentials', 'true')
+  response.headers.set('Access-Control-Expose-Headers', 'X-Total-Count, X-Next-Cursor')
+  return response
+}
+
+// Verified JWT payloads keyed by a hash of the token, so repeat requests skip
+// the HMAC check. Entries never outlive the token's own expiry.
+const tokenCache = new LRUCache({ max: TOKEN_CACHE_SIZE, ttl: TOKEN_CACHE_TTL_MS })
+
+function hashToken(token) {
+  return createHash('sha256').update(token).digest('base64url')
+}
+
+function getAuthToken(request) {
+  return request.cookies.get('auth_token')?.value || null
+}
+
+// Verify JWT token from cookie
+function verifyToken(request) {
+  const token = getAuthToken(request)
+  if (!token) return null
+  
+  const key = hashToken(token)
+  const cached = tokenCache.get(key)
+  if (cached) return cached
+  
+  try {
+    const decoded = jwt.verify(token, JWT_SECRET)
+    const ttl = decoded.exp ? Math.min(TOKEN_CACHE_TTL_MS, decoded.exp * 1000 - Date.now()) : TOKEN_CACHE_TTL_MS
+    if (ttl > 0) {
+      tokenCache.set(key, decoded, ttl)
+    }
+    return decoded
+  } catch (error) {
+    return null
+  }
+}
+
+// Public profile of a user, cached by id. Nothing edits profiles yet; any
+// route that does must call userCache.delete(userId) after writing.
+const userCache = new LRUCache({ max: USER_CACHE_SIZE, ttl: USER_CACHE_TTL_MS })
+
+async function getUserProfile(db, userId) {
+  const cached = userCache.get(userId)
+  if (cached) return cached
+  
+  const user = await db.collection('users').findOne(
+    { id: userId },
+    { projection: { _id: 0, id: 1, email: 1, store_name: 1, currency_symbol: 1 } }
+  )
+  if (user) {
+    userCache.set(userId, user)
+  }
+  return user
+}
+
+// OPTIONS handler for CORS
+export async function OPTIONS() {
+  return handleCORS(new NextResponse(null, { status: 200 }))
+}
+
+// ==================== AUTH ROUTES ====================
+
+// Register - POST /api/auth/register
+async function register({ request, db }) {
+  const body = await request.json()
+  const { email, password, store_name, currency_symbol } = body
+  
+  if (!email || !password || !store_name) {
+    return NextResponse.json(
+      { error: 'Email, password y nombre de tienda son requeridos' },
+      { status: 400 }
+    )
+  }
+  
+  // Check if user already exists
+  const existingUser = await db.collection('users').findOne({ email })
+  if (existingUser) {
+    return NextResponse.json(
+      { error: 'El email ya está registrado' },
+      { status: 400 }
+    )
+  }
+  
+  // NOTA: Guardando contraseña en texto plano para desarrollo/MVP
+  // TODO: Implementar sistema de reset password y volver a encriptar
+  const user = {
+    id: uuidv4(),
+    email,
+    password: password, // Guardando sin encriptar para poder recuperarla
+    store_name,
+    currency_symbol: currency_symbol || '$',
+    created_at: new Date()
+  }
+  
+  await db.collection('users').insertOne(user)
+  
+  // Create JWT token
+  const token = jwt.sign(
+    { userId: user.id, email: user.email },
+    JWT_SECRET,
+    { expiresIn: '7d' }
+  )
+  
+  const response = NextResponse.json({
+    message: 'Usuario registrado exitosamente',
+    user: { id: user.id, email: user.email, store_name: user.store_name }
+  })
+  
+  response.cookies.set('auth_token', token, {
+    httpOnly: true,
+    secure: process.env.NODE_ENV === 'production',
+    sameSite: 'lax',
+    maxAge: 60 * 60 * 24 * 7 // 7 days
+  })
+  
+  return response
+}
+
+// Login - POST /api/auth/login
+async function login({ request, db }) {
+  const body = await request.json()
+  const { email, password } = body
+  
+  if (!email || !password) {
+    return NextResponse.json(
+      { error: 'Email y password son requeridos' },
+      { status: 400 }
+    )
+  }
+  
+  const user = await db.collection('users').findOne({ email })
+  if (!user) {
+    return NextResponse.json(
+      { error: 'Credenciales inválidas' },
+      { status: 401 }
+    )
+  }
+  
+  // Comparación directa de contraseña (sin encriptación)
+  // NOTA: Para desarrollo/MVP. Implementar reset password y encriptación en producción
+  const isValidPassword = user.password === password
+  if (!isValidPassword) {
+    return NextResponse.json(
+      { error: 'Credenciales inválidas' },
+      { status: 401 }
+    )
+  }
+  
+  const token = jwt.sign(
+    { userId: user.id, email: user.email },
+    JWT_SECRET,
+    { expiresIn: '7d' }
+  )
+  
+  const response = NextResponse.json({
+    message: 'Login exitoso',
+    user: { id: user.id, email: user.email, store_name: user.store_name, currency_symbol: user.currency_symbol }
+  })
+  
+  response.cookies.set('auth_token', token, {
+    httpOnly: true,
+    secure: process.env.NODE_ENV === 'production',
+    sameSite: 'lax',
+    maxAge: 60 * 60 * 24 * 7
+  })
+  
+  return response
+}
+
+// Logout - POST /api/auth/logout
+async function logout({ request }) {
+  const token = getAuthToken(request)
+  if (token) {
+    tokenCache.delete(hashToken(token))
+  }
+  const response = NextResponse.json({ message: 'Logout exitoso' })
+  response.cookies.delete('auth_token')
+  return response
+}
+
+// Get current user - GET /api/auth/me
+async function getCurrentUser({ db, userId }) {
+  const user = await getUserProfile(db, userId)
+  if (!user) {
+    return NextResponse.json(
+      { error: 'Usuario no encontrado' },
+      { status: 404 }
+    )
+  }
+  
+  return NextResponse.json({
+    user: {
+      id: user.id,
+      email: user.email,
+      store_name: user.store_name,
+      currency_symbol: user.currency_symbol
+    }
+  })
+}
+
+// ==================== PRODUCTS ROUTES ====================
+
+// Get all products - GET /api/products
+// Responses carry an ETag derived from the catalog version they were read at,
+// so unchanged catalogs are revalidated with a 304 and no body. Barcode scans
+// and full listings served from the catalog cache take it from the cached
+// snapshot, so they cost no extra query.
+async function listProducts({ request, db, userId }) {
+  const url = new URL(request.url)
+  const search = url.searchParams.get('search')?.trim()
+  const barcode = url.searchParams.get('barcode')
+  
+  if (search) {
+    const limit = Math.min(parseInt(url.searchParams.get('limit')) || SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    const version = await getSettledCatalogVersion(db, userId)
+    return conditionalResponse(request, userId, url, version, async () => {
+      // Type-ahead from many terminals repeats the same prefixes
+      const products = await coalesceQuery(userId, 'products.search', [search, limit], () => searchProducts(db, userId, search, limit))
+      return NextResponse.json(products)
+    })
+  }
+  
+  let listParams
+  try {
+    listParams = parseListParams(url.searchParams, { allowedFields: PRODUCT_FIELDS, defaultLimit: null })
+  } catch (error) {
+    if (!(error instanceof RangeError)) throw error
+    return NextResponse.json({ error: error.message }, { status: 400 })
+  }
+  
+  // Barcode scans and full catalog loads are served from the catalog cache.
+  // Paged or projected requests always go to the database, so a URL answers
+  // the same whether or not the tenant's catalog is cached.
+  const isUnpaged = !listParams.limit && !listParams.after && !url.searchParams.get('fields')
+  if (isUnpaged) {
+    const catalog = await getCatalog(db, userId)
+    if (catalog) {
+      return conditionalResponse(request, userId, url, `${catalog.version}.${catalog.revision}`, () => {
+        const documents = barcode ? (catalog.byBarcode.get(barcode) || []) : catalog.products
+        return paginatedResponse({ documents, nextCursor: null, total: documents.length })
+      })
+    }
+  }
+  
+  let query = { user_id: userId }
+  
+  // A scan outside the cache is a single indexed lookup: not worth a version read
+  if (barcode) {
+    query.barcode = barcode
+    return paginatedResponse(await paginate(db.collection('products'), query, 'created_at', listParams))
+  }
+  
+  const version = await getSettledCatalogVersion(db, userId)
+  return conditionalResponse(request, userId, url, version, async () => {
+    const page = await paginate(db.collection('products'), query, 'created_at', listParams)
+    return paginatedResponse(page)
+  })
+}
+
+// 304 when the client already holds this version of the listing, otherwise
+// the response from `build` tagged with it. The version must be read before
+// the body so the tag never claims writes the body may have missed.
+async function conditionalResponse(request, userId, url, version, build) {
+  const etag = `W/"${version}-${createHash('sha256').update(`${userId}${url.search}`).digest('hex').slice(0, 16)}"`
+  const ifNoneMatch = request.headers.get('if-none-match')
+  if (ifNoneMatch && ifNoneMatch.split(',').some(tag => tag.trim() === etag)) {
+    return new NextResponse(null, { status: 304, headers: { ETag: etag, 'Cache-Control': 'private, no-cache' } })
+  }
+  
+  const response = await build()
+  if (response.status === 200) {
+    response.headers.set('ETag', etag)
+    response.headers.set('Cache-Control', 'private, no-cache')
+  }
+  return response
+}
+
+// Catalog changes since a version - GET /api/products/changes?since=<version>
+// Returns the products written and the ids deleted after `since`, plus the
+// version to send next time. since=0 (or a version this server never issued)
+// returns the whole catalog with full: true.
+async function getProductChanges({ request, db, userId }) {
+  const url = new URL(request.url)
+  const since = parseInt(url.searchParams.get('since') ?? '0')
+  if (!(since >= 0)) {
+    return NextResponse.json(
+      { error: 'since debe ser un número de versión válido' },
+      { status: 400 }
+    )
+  }
+  
+  const version = await getSettledCatalogVersion(db, userId)
+  const full = since === 0 || since > version
+  const projection = { _id: 0, search_tokens: 0 }
+  
+  const [changed, deleted] = await Promise.all([
+    db.collection('products')
+      .find(full ? { user_id: userId } : { user_id: userId, catalog_version: { $gt: since } }, { projection })
+      .toArray(),
+    full ? [] : db.collection('product_tombstones')
+      .find({ user_id: userId, catalog_version: { $gt: since } }, { projection: { _id: 0, id: 1 } })
+      .toArray()
+  ])
+  
+  return NextResponse.json({
+    version,
+    full,
+    changed,
+    deleted: deleted.map(tombstone => tombstone.id)
+  })
+}
+
+// Import column names: API field names and the headers of the inventory export
+const IMPORT_COLUMNS = {
+  barcode: 'barcode',
+  'codigo de barras': 'barcode',
+  name: 'name',
+  nombre: 'name',
+  category: 'category',
+  categoria: 'category',
+  cost_price: 'cost_price',
+  'precio costo': 'cost_price',
+  sale_price: 'sale_price',
+  'precio venta': 'sale_price',
+  stock_quantity: 'stock_quantity',
+  stock: 'stock_quantity'
+}
+
+// Validate one import row. Only the fields present are written, so a row with
+// just a barcode and prices updates the prices and leaves the stock alone.
+function parseImportRow(raw) {
+  if (!raw || typeof raw !== 'object' || Array.isArray(raw)) {
+    return { barcode: null, error: 'Fila inválida' }
+  }
+  const present = key => raw[key] !== undefined && raw[key] !== null && String(raw[key]).trim() !== ''
+  const number = key => Number(String(raw[key]).trim().replace(',', '.'))
+  
+  const barcode = present('barcode') ? String(raw.barcode).trim() : null
+  if (!barcode) {
+    return { barcode, error: 'El código de barras es requerido' }
+  }
+  
+  const fields = {}
+  if (present('name')) fields.name = String(raw.name).trim()
+  if (present('category')) fields.category = String(raw.category).trim()
+  if (present('cost_price')) {
+    fields.cost_price = number('cost_price')
+    if (!(fields.cost_price >= 0)) return { barcode, error: 'El precio de costo debe ser un número mayor o igual a 0' }
+  }
+  if (present('sale_price')) {
+    fields.sale_price = number('sale_price')
+    if (!(fields.sale_price > 0)) return { barcode, error: 'El precio de venta debe ser un número mayor a 0' }
+  }
+  if (present('stock_quantity')) {
+    fields.stock_quantity = number('stock_quantity')
+    if (!Number.isInteger(fields.stock_quantity) || fields.stock_quantity < 0) {
+      return { barcode, error: 'El stock debe ser un entero mayor o igual a 0' }
+    }
+  }
+  return { barcode, fields }
+}
+
+// Upsert one chunk of validated rows by (user_id, barcode) in a single
+// unordered bulkWrite. Returns the counts and the rows that failed.
+async function writeImportChunk(db, userId, rows) {
+  const outcome = { created: 0, updated: 0, failures: [] }
+  const products = db.collection('products')
+  const existing = await products
+    .find({ user_id: userId, barcode: { $in: rows.map(row => row.barcode) } }, { projection: { _id: 0, barcode: 1 } })
+    .toArray()
+  const existingBarcodes = new Set(existing.map(product => product.barcode))
+  
+  const writeRows = rows.filter(row => {
+    if (existingBarcodes.has(row.barcode) || (row.fields.name !== undefined && row.fields.sale_price !== undefined)) return true
+    outcome.failures.push({ row: row.row, barcode: row.barcode, error: 'Nombre y precio de venta son requeridos para productos nuevos' })
+    return false
+  })
+  if (writeRows.length === 0) return outcome
+  
+  await withCatalogVersion(db, userId, async version => {
+    const now = new Date()
+    const operations = writeRows.map(({ barcode, fields }) => {
+      const set = { ...fields, catalog_version: version }
+      if (fields.name !== undefined) set.search_tokens = tokenizeName(fields.name)
+      if (fields.stock_quantity !== undefined) set.low_stock_alert = fields.stock_quantity < LOW_STOCK_THRESHOLD
+      
+      // Defaults for new products, for the fields the row leaves out
+      const setOnInsert = { id: uuidv4(), created_at: now }
+      if (fields.category === undefined) setOnInsert.category = 'General'
+      if (fields.cost_price === undefined) setOnInsert.cost_price = 0
+      if (fields.stock_quantity === undefined) Object.assign(setOnInsert, { stock_quantity: 0, low_stock_alert: true })
+      
+      return {
+        updateOne: {
+          filter: { user_id: userId, barcode },
+          update: { $set: set, $setOnInsert: setOnInsert },
+          upsert: true
+        }
+      }
+    })
+    
+    let result
+    try {
+      result = await products.bulkWrite(operations, { ordered: false })
+    } catch (error) {
+      if (!error.writeErrors || !error.result) throw error
+      for (const writeError of [].concat(error.writeErrors)) {
+        const row = writeRows[writeError.index]
+        outcome.failures.push({ row: row.row, barcode: row.barcode, error: writeError.errmsg || 'Error al guardar el producto' })
+      }
+      result = error.result
+    }
+    outcome.created = result.upsertedCount
+    outcome.updated = result.matchedCount
+  })
+  return outcome
+}
+
+// Import products - POST /api/products/import
+// Accepts CSV (text/csv, header row required, parsed as it streams in) or a
+// JSON array of products (application/json). Rows are upserted by barcode in
+// chunks; the response reports counts and the rows that failed, by row number
+// (the spreadsheet row for CSV, the 1-based position for JSON).
+async function importProducts({ request, db, userId }) {
+  const contentType = request.headers.get('content-type') || ''
+  const isJson = contentType.includes('application/json')
+  if (!isJson && !contentType.includes('text/csv')) {
+    return NextResponse.json(
+      { error: 'El contenido debe ser text/csv o application/json' },
+      { status: 400 }
+    )
+  }
+  
+  const report = { processed: 0, created: 0, updated: 0, failed: 0, truncated: false, errors: [] }
+  const fail = ({ row, barcode, error }) => {
+    report.failed++
+    if (report.errors.length < IMPORT_MAX_ERRORS) report.errors.push({ row, barcode, error })
+  }
+  
+  const seenBarcodes = new Map()
+  let chunk = []
+  let written = false
+  
+  const flush = async () => {
+    if (chunk.length === 0) return
+    written = true
+    const outcome = await writeImportChunk(db, userId, chunk)
+    chunk = []
+    report.created += outcome.created
+    report.updated += outcome.updated
+    outcome.failures.forEach(fail)
+  }
+  
+  const addRow = async (row, raw) => {
+    report.processed++
+    const { barcode, fields, error } = parseImportRow(raw)
+    if (error) return fail({ row, barcode, error })
+    if (seenBarcodes.has(barcode)) {
+      return fail({ row, barcode, error: `Código de barras repetido (fila ${seenBarcodes.get(barcode)})` })
+    }
+    seenBarcodes.set(barcode, row)
+    
+    chunk.push({ row, barcode, fields })
+    if (chunk.length >= IMPORT_CHUNK_SIZE) await flush()
+  }
+  
+  try {
+    if (isJson) {
+      let body
+      try {
+        body = await request.json()
+      } catch (error) {
+        return NextResponse.json({ error: 'JSON inválido' }, { status: 400 })
+      }
+      const rows = Array.isArray(body) ? body : body?.products
+      if (!Array.isArray(rows) || rows.length > IMPORT_MAX_ROWS) {
+        return NextResponse.json(
+          { error: `Se requiere una lista de hasta ${IMPORT_MAX_ROWS} productos` },
           { status: 400 }
-        ))
+        )
+      }
+      for (let index = 0; index < rows.length; index++) {
+        await addRow(index + 1, rows[index])
+      }
+    } else {
+      if (!request.body) {
+        return NextResponse.json({ error: 'El archivo CSV está vacío' }, { status: 400 })
+      }
+      let columns = null
+      let rowNumber = 0
+      for await (const cells of parseCsvStream(request.body)) {
+        rowNumber++
+        if (!columns) {
+          columns = cells.map(header => IMPORT_COLUMNS[normalizeText(header).trim()] || null)
+          if (!columns.includes('barcode')) {
+            return NextResponse.json(
+              { error: 'El CSV requiere una columna barcode (o "Código de Barras")' },
+              { status: 400 }
+            )
+          }
+          continue
+        }
+        if (cells.length === 1 && cells[0].trim() === '') continue
+        if (report.processed >= IMPORT_MAX_ROWS) {
+          report.truncated = true
+          break
+        }
+        
+        const raw = {}
+        columns.forEach((field, index) => {
+          // Undo the formula guard the export adds to text cells
+          if (field && index < cells.length) raw[field] = cells[index].replace(/^'(?=[=+\-@])/, '')
+        })
+        await addRow(rowNumber, raw)
+      }
+    }
+    
+    await flush()
+  } finally {
+    if (written) {
+      invalidateCatalog(userId)
+      publish(userId, 'catalog', { action: 'imported' })
+    }
+  }
+  
+  return NextResponse.json(report)
+}
+
+// Create product - POST /api/products
+async function createProduct({ request, db, userId }) {
+  const body = await request.json()
+  const { barcode, name, cost_price, sale_price, stock_quantity, category } = body
+  
+  if (!name || !sale_price || stock_quantity === undefined) {
+    return NextResponse.json(
+      { error: 'Nombre, precio de venta y cantidad son requeridos' },
+      { status: 400 }
+    )
+  }
+  
+  const product = {
+    id: uuidv4(),
+    user_id: userId,
+    barcode: barcode || '',
+    name,
+    cost_price: parseFloat(cost_price) || 0,
+    sale_price: parseFloat(sale_price),
+    stock_quantity: parseInt(stock_quantity),
+    category: category || 'General',
+    low_stock_alert: parseInt(stock_quantity) < 10,
+    search_tokens: tokenizeName(name),
+    created_at: new Date()
+  }
+  
+  await withCatalogVersion(db, userId, version => {
+    product.catalog_version = version
+    return db.collection('products').insertOne(product)
+  })
+  invalidateCatalog(userId)
+  publish(userId, 'catalog', { action: 'created', product_id: product.id })
+  const { _id, search_tokens, catalog_version, ...cleanProduct } = product
+  
+  return NextResponse.json(cleanProduct)
+}
+
+// Update product - PUT /api/products/:id
+async function updateProduct({ request, db, userId, params }) {
+  const productId = params.id
+  const body = await request.json()
+  
+  const updateData = {
+    ...body,
+    cost_price: body.cost_price ? parseFloat(body.cost_price) : 0,
+    sale_price: body.sale_price ? parseFloat(body.sale_price) : 0,
+    stock_quantity: body.stock_quantity !== undefined ? parseInt(body.stock_quantity) : 0,
+    low_stock_alert: (body.stock_quantity !== undefined ? parseInt(body.stock_quantity) : 0) < 10
+  }
+  
+  if (body.name !== undefined) {
+    updateData.search_tokens = tokenizeName(body.name)
+  }
+  
+  const result = await withCatalogVersion(db, userId, version => db.collection('products').updateOne(
+    { id: productId, user_id: userId },
+    { $set: { ...updateData, catalog_version: version } }
+  ))
+  
+  if (result.matchedCount === 0) {
+    return NextResponse.json(
+      { error: 'Producto no encontrado' },
+      { status: 404 }
+    )
+  }
+  
+  invalidateCatalog(userId)
+  publish(userId, 'catalog', { action: 'updated', product_id: productId })
+  return NextResponse.json({ message: 'Producto actualizado' })
+}
+
+// Delete product - DELETE /api/products/:id
+async function deleteProduct({ db, userId, params }) {
+  const productId = params.id
+  
+  // Leave a tombstone so synced terminals drop the product too
+  const result = await withCatalogVersion(db, userId, async version => {
+    const deleted = await db.collection('products').deleteOne({
+      id: productId,
+      user_id: userId
+    })
+    if (deleted.deletedCount > 0) {
+      await db.collection('product_tombstones').insertOne({
+        id: productId,
+        user_id: userId,
+        catalog_version: version,
+        deleted_at: new Date()
+      })
+    }
+    return deleted
+  })
+  
+  if (result.deletedCount === 0) {
+    return NextResponse.json(
+      { error: 'Producto no encontrado' },
+      { status: 404 }
+    )
+  }
+  
+  invalidateCatalog(userId)
+  publish(userId, 'catalog', { action: 'deleted', product_id: productId })
+  return NextResponse.json({ message: 'Producto eliminado' })
+}
+
+// ==================== SALES ROUTES ====================
+
+// Create sale - POST /api/sales
+async function createSale({ request, db, userId }) {
+  const body = await request.json()
+  const { items, payment_method, amount_received } = body
+  
+  if (!items || items.length === 0) {
+    return NextResponse.json(
+      { error: 'No hay items en la venta' },
+      { status: 400 }
+    )
+  }
+  
+  const quantities = collectQuantities(items)
+  if (!quantities) {
+    return NextResponse.json(
+      { error: 'Cada item requiere un producto y una cantidad mayor a 0' },
+      { status: 400 }
+    )
+  }
+  
+  // Fetch every product of the sale in a single query
+  const products = await db.collection('products')
+    .find({ id: { $in: Object.keys(quantities) }, user_id: userId })
+    .toArray()
+  const productsById = Object.fromEntries(products.map(product => [product.id, product]))
+  
+  for (const [productId, quantity] of Object.entries(quantities)) {
+    const product = productsById[productId]
+    
+    if (!product) {
+      return NextResponse.json(
+        { error: `Producto ${productId} no encontrado` },
+        { status: 404 }
+      )
+    }
+    
+    if (product.stock_quantity < quantity) {
+      return NextResponse.json(
+        { error: `Stock insuficiente para ${product.name}. Disponible: ${product.stock_quantity}` },
+        { status: 400 }
+      )
+    }
+  }
+  
+  // Apply all decrements at once; nothing is written if any line falls short
+  const shortProductIds = await decrementStock(db, userId, quantities)
+  if (shortProductIds.length > 0) {
+    const product = productsById[shortProductIds[0]]
+    return NextResponse.json(
+      { error: `Stock insuficiente para ${product.name}` },
+      { status: 400 }
+    )
+  }
+  
+  // Online sales are always charged at the current price
+  const sale = buildSale(userId, {
+    items: items.map(({ product_id, quantity }) => ({ product_id, quantity })),
+    payment_method,
+    amount_received
+  }, productsById)
+  
+  try {
+    await db.collection('sales').insertOne(sale)
+  } catch (error) {
+    // No sale was recorded: give the units back (and drop any catalog read
+    // in between) before failing
+    await restoreStock(db, userId, quantities)
+    invalidateCatalog(userId)
+    throw error
+  }
+  
+  applyCatalogStockChanges(userId, quantities)
+  await applySalesToAggregates(db, userId, [sale])
+  
+  const { _id, ...cleanSale } = sale
+  
+  return NextResponse.json(cleanSale)
+}
+
+// Record a batch of sales made offline - POST /api/sales/batch
+// Each sale carries a client generated UUID (client_id) used as its id,
+// so retrying a batch never records a sale twice.
+async function createSalesBatch({ request, db, userId }) {
+  let body
+  try {
+    body = await request.json()
+  } catch (error) {
+    return NextResponse.json({ error: 'JSON inválido' }, { status: 400 })
+  }
+  const saleRequests = Array.isArray(body?.sales) ? body.sales : null
+  
+  if (!saleRequests || saleRequests.length === 0 || saleRequests.length > SALES_BATCH_MAX) {
+    return NextResponse.json(
+      { error: `Se requiere una lista de 1 a ${SALES_BATCH_MAX} ventas` },
+      { status: 400 }
+    )
+  }
+  
+  const uuidPattern = /^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$/i
+  const results = saleRequests.map(saleRequest => ({ client_id: saleRequest?.client_id ?? null }))
+  const reject = (index, error) => { Object.assign(results[index], { status: 'rejected', error }) }
+  
+  // Validate shape and drop keys repeated within the batch
+  const pending = []
+  const seenKeys = new Map()
+  saleRequests.forEach((saleRequest, index) => {
+    const clientId = saleRequest?.client_id
+    if (typeof clientId !== 'string' || !uuidPattern.test(clientId)) {
+      return reject(index, 'client_id debe ser un UUID')
+    }
+    if (seenKeys.has(clientId)) {
+      results[index].duplicateOf = seenKeys.get(clientId)
+      return
+    }
+    seenKeys.set(clientId, index)
+    
+    const quantities = Array.isArray(saleRequest.items) && saleRequest.items.length > 0
+      ? collectQuantities(saleRequest.items)
+      : null
+    if (!quantities) {
+      return reject(index, 'Cada item requiere un producto y una cantidad mayor a 0')
+    }
+    
+    // The terminal charged the customer at the price it showed: keep it,
+    // as long as every line is priced and the lines add up to the total
+    const items = []
+    for (const item of saleRequest.items) {
+      const price = item.price_at_sale
+      if (price !== undefined && !(typeof price === 'number' && Number.isFinite(price) && price >= 0)) {
+        return reject(index, 'price_at_sale debe ser un número mayor o igual a 0')
+      }
+      items.push({ product_id: item.product_id, quantity: item.quantity, price_at_sale: price })
+    }
+    if (saleRequest.total_amount !== undefined) {
+      if (items.some(item => item.price_at_sale === undefined)) {
+        return reject(index, 'total_amount requiere price_at_sale en cada item')
+      }
+      const linesTotal = items.reduce((sum, item) => sum + item.price_at_sale * parseInt(item.quantity), 0)
+      if (!(Math.abs(linesTotal - saleRequest.total_amount) < 0.005)) {
+        return reject(index, 'total_amount no coincide con los items')
+      }
+    }
+    
+    // Keep the time the sale was made offline, but never in the future
+    const date = new Date(saleRequest.date)
+    pending.push({
+      index,
+      quantities,
+      request: {
+        id: clientId,
+        items,
+        payment_method: saleRequest.payment_method,
+        amount_received: saleRequest.amount_received,
+        date: isNaN(date) || date > new Date() ? new Date() : date
+      }
+    })
+  })
+  
+  // Sales recorded by an earlier attempt are reported, not recorded again,
+  // including old ones the retention job has moved to the archive since
+  const pendingIds = pending.map(entry => entry.request.id)
+  const [existing, archived] = await Promise.all([
+    db.collection('sales')
+      .find({ user_id: userId, id: { $in: pendingIds } }, { projection: { _id: 0 } })
+      .toArray(),
+    pending.length === 0 ? [] : db.collection('sales_archive').aggregate([
+      {
+        $match: {
+          ...archiveBucketQuery(userId, { $gte: new Date(Math.min(...pending.map(entry => entry.request.date))) }),
+          'sales.id': { $in: pendingIds }
+        }
+      },
+      { $unwind: '$sales' },
+      { $match: { 'sales.id': { $in: pendingIds } } },
+      { $replaceRoot: { newRoot: { $mergeObjects: ['$sales', { user_id: '$user_id' }] } } }
+    ]).toArray()
+  ])
+  const existingById = Object.fromEntries([...archived, ...existing].map(sale => [sale.id, sale]))
+  
+  const fresh = []
+  for (const entry of pending) {
+    if (existingById[entry.request.id]) {
+      Object.assign(results[entry.index], { status: 'duplicate', sale: existingById[entry.request.id] })
+    } else {
+      fresh.push(entry)
+    }
+  }
+  
+  // Validate every sale in order against a running copy of the stock
+  const products = await db.collection('products')
+    .find({ id: { $in: Object.keys(mergeQuantities(fresh.map(entry => entry.quantities))) }, user_id: userId })
+    .toArray()
+  const productsById = Object.fromEntries(products.map(product => [product.id, product]))
+  const stock = Object.fromEntries(products.map(product => [product.id, product.stock_quantity]))
+  
+  let accepted = []
+  for (const entry of fresh) {
+    const entries = Object.entries(entry.quantities)
+    const missing = entries.find(([productId]) => !productsById[productId])
+    const short = entries.find(([productId, quantity]) => productsById[productId] && stock[productId] < quantity)
+    if (missing) {
+      reject(entry.index, `Producto ${missing[0]} no encontrado`)
+    } else if (short) {
+      const product = productsById[short[0]]
+      reject(entry.index, `Stock insuficiente para ${product.name}. Disponible: ${stock[product.id]}`)
+    } else {
+      entries.forEach(([productId, quantity]) => { stock[productId] -= quantity })
+      accepted.push(entry)
+    }
+  }
+  
+  // One bulk decrement for the whole batch. If another terminal took the
+  // stock meanwhile, fall back to applying the sales one by one.
+  if (accepted.length > 0) {
+    const shortProductIds = await decrementStock(db, userId, mergeQuantities(accepted.map(entry => entry.quantities)))
+    if (shortProductIds.length > 0) {
+      const applied = []
+      for (const entry of accepted) {
+        const short = await decrementStock(db, userId, entry.quantities)
+        if (short.length > 0) {
+          reject(entry.index, `Stock insuficiente para ${productsById[short[0]].name}`)
+        } else {
+          applied.push(entry)
+        }
+      }
+      accepted = applied
+    }
+  }
+  
+  if (accepted.length > 0) {
+    const sales = accepted.map(entry => buildSale(userId, entry.request, productsById))
+    let insertedSales = sales
+    
+    try {
+      await db.collection('sales').insertMany(sales, { ordered: false })
+    } catch (error) {
+      // A concurrent flush of the same queue recorded some of these sales
+      // first: give their stock back and report the recorded sales
+      const writeErrors = error.writeErrors || []
+      if (writeErrors.length === 0 || writeErrors.some(writeError => writeError.code !== 11000)) throw error
+      const duplicateIndexes = new Set(writeErrors.map(writeError => writeError.index))
+      const duplicates = accepted.filter((_, index) => duplicateIndexes.has(index))
+      await restoreStock(db, userId, mergeQuantities(duplicates.map(entry => entry.quantities)))
+      const recorded = await db.collection('sales')
+        .find({ user_id: userId, id: { $in: duplicates.map(entry => entry.request.id) } }, { projection: { _id: 0 } })
+        .toArray()
+      const recordedById = Object.fromEntries(recorded.map(sale => [sale.id, sale]))
+      duplicates.forEach(entry => {
+        Object.assign(results[entry.index], { status: 'duplicate', sale: recordedById[entry.request.id] })
+      })
+      insertedSales = sales.filter((_, index) => !duplicateIndexes.has(index))
+      accepted = accepted.filter((_, index) => !duplicateIndexes.has(index))
+    }
+    
+    if (insertedSales.length > 0) {
+      applyCatalogStockChanges(userId, mergeQuantities(accepted.map(entry => entry.quantities)))
+      await applySalesToAggregates(db, userId, insertedSales)
+    }
+    accepted.forEach((entry, index) => {
+      const { _id, ...cleanSale } = insertedSales[index]
+      Object.assign(results[entry.index], { status: 'created', sale: cleanSale })
+    })
+  }
+  
+  // Repeated keys within the batch share the outcome of their first occurrence
+  results.forEach(result => {
+    if (result.duplicateOf !== undefined) {
+      const original = results[result.duplicateOf]
+      delete result.duplicateOf
+      Object.assign(result, original.status === 'rejected' ? original : { status: 'duplicate', sale: original.sale })
+    }
+  })
+  
+  return NextResponse.json({ results })
+}
+
+// Get all sales, hot and archived - GET /api/sales
+async function listSales({ request, db, userId }) {
+  const url = new URL(request.url)
+  const startDate = url.searchParams.get('start_date')
+  const endDate = url.searchParams.get('end_date')
+  
+  let listParams
+  try {
+    listParams = parseListParams(url.searchParams, { allowedFields: SALE_FIELDS, defaultLimit: LIST_MAX_LIMIT })
+  } catch (error) {
+    if (!(error instanceof RangeError)) throw error
+    return NextResponse.json({ error: error.message }, { status: 400 })
+  }
+  
+  let dateRange = null
+  
+  if (startDate || endDate) {
+    dateRange = {}
+    if (startDate) dateRange.$gte = new Date(startDate)
+    if (endDate) dateRange.$lte = new Date(endDate)
+  }
+  
+  const page = await paginateSales(db, userId, dateRange, listParams)
+  return paginatedResponse(page)
+}
+
+// Get daily sales rollup - GET /api/sales/daily?from=YYYY-MM-DD&to=YYYY-MM-DD
+async function getSalesDaily({ request, db, userId }) {
+  const url = new URL(request.url)
+  const from = url.searchParams.get('from')
+  const to = url.searchParams.get('to')
+  const dayPattern = /^\d{4}-\d{2}-\d{2}$/
+  
+  if ((from && !dayPattern.test(from)) || (to && !dayPattern.test(to))) {
+    return NextResponse.json(
+      { error: 'Las fechas deben tener el formato YYYY-MM-DD' },
+      { status: 400 }
+    )
+  }
+  
+  let query = { user_id: userId }
+  
+  if (from || to) {
+    query.day = {}
+    if (from) query.day.$gte = from
+    if (to) query.day.$lte = to
+  }
+  
+  const days = await db.collection('sales_daily')
+    .find(query, { projection: { _id: 0, user_id: 0 } })
+    .sort({ day: 1 })
+    .toArray()
+  
+  return NextResponse.json(days)
+}
+
+// Rebuild daily sales rollup from raw sales - POST /api/sales/daily/rebuild
+async function rebuildDailySales({ db, userId }) {
+  const daysRebuilt = await rebuildSalesDaily(db, userId)
+  if (daysRebuilt === null) {
+    return NextResponse.json(
+      { error: 'El historial de ventas se está reconstruyendo o archivando; intenta de nuevo más tarde' },
+      { status: 409 }
+    )
+  }
+  return NextResponse.json({ message: 'Resumen diario reconstruido', days: daysRebuilt })
+}
+
+// Archived months with their totals - GET /api/sales/archive
+async function getSalesArchive({ db, userId }) {
+  const months = await db.collection('sales_archive_months')
+    .find({ user_id: userId }, { projection: { _id: 0, user_id: 0, buckets: 0 } })
+    .sort({ month: 1 })
+    .toArray()
+  
+  return NextResponse.json({ retention_days: SALES_RETENTION_DAYS, months })
+}
+
+// Archive the sales past the retention window now - POST /api/sales/archive
+async function archiveOldSales({ db, userId }) {
+  if (SALES_RETENTION_DAYS <= 0) {
+    return NextResponse.json(
+      { error: 'El archivado de ventas está desactivado (SALES_RETENTION_DAYS=0)' },
+      { status: 409 }
+    )
+  }
+  
+  const cutoff = getArchiveCutoff()
+  const result = await archiveSales(db, userId, cutoff)
+  if (!result) {
+    return NextResponse.json(
+      { error: 'El archivado de ventas ya está en curso' },
+      { status: 409 }
+    )
+  }
+  
+  return NextResponse.json({ message: 'Ventas archivadas', cutoff, ...result })
+}
+
+// ==================== CASH REGISTER ROUTES ====================
+
+// Open cash register - POST /api/cash-register/open
+async function openCashRegister({ request, db, userId }) {
+  const body = await request.json()
+  const { initial_cash } = body
+  
+  if (initial_cash === undefined || initial_cash < 0) {
+    return NextResponse.json(
+      { error: 'El fondo inicial es requerido y debe ser mayor o igual a 0' },
+      { status: 400 }
+    )
+  }
+  
+  // Get user info
+  const user = await getUserProfile(db, userId)
+  
+  // Check if there's already an open cash register
+  const existingOpen = await db.collection('cash_registers').findOne({
+    user_id: userId,
+    status: 'open'
+  })
+  
+  if (existingOpen) {
+    return NextResponse.json(
+      { error: 'Ya existe una caja abierta. Ciérrala antes de abrir una nueva.' },
+      { status: 400 }
+    )
+  }
+  
+  const cashRegister = {
+    id: uuidv4(),
+    user_id: userId,
+    opened_by: user.email,
+    opened_at: new Date(),
+    closed_at: null,
+    initial_cash: parseFloat(initial_cash),
+    cash_sales: 0,
+    card_sales: 0,
+    expenses: [],
+    withdrawals: [],
+    total_expenses: 0,
+    total_withdrawals: 0,
+    expected_cash: parseFloat(initial_cash),
+    actual_cash: null,
+    difference: null,
+    difference_percentage: null,
+    closing_notes: null,
+    closing_photo_url: null,
+    status: 'open'
+  }
+  
+  await db.collection('cash_registers').insertOne(cashRegister)
+  const { _id, ...cleanCashRegister } = cashRegister
+  
+  publish(userId, 'cash_register', pickFields(cleanCashRegister, CASH_REGISTER_TOTALS_PROJECTION))
+  return NextResponse.json(cleanCashRegister)
+}
+
+// Get current open cash register - GET /api/cash-register/current
+async function getCurrentCashRegister({ db, userId }) {
+  const cashRegister = await db.collection('cash_registers').findOne({
+    user_id: userId,
+    status: 'open'
+  })
+  
+  if (!cashRegister) {
+    return NextResponse.json({ cashRegister: null })
+  }
+  
+  const { _id, ...cleanCashRegister } = cashRegister
+  return NextResponse.json(cleanCashRegister)
+}
+
+// Register expense - POST /api/cash-register/expense
+async function registerExpense({ request, db, userId }) {
+  const body = await request.json()
+  const { amount, description } = body
+  
+  if (!amount || amount <= 0 || !description) {
+    return NextResponse.json(
+      { error: 'Monto y descripción son requeridos' },
+      { status: 400 }
+    )
+  }
+  
+  const expense = {
+    id: uuidv4(),
+    amount: parseFloat(amount),
+    description,
+    date: new Date()
+  }
+  
+  // Append and update the running totals atomically on the open register
+  const cashRegister = await db.collection('cash_registers').findOneAndUpdate(
+    { user_id: userId, status: 'open' },
+    {
+      $push: { expenses: expense },
+      $inc: { total_expenses: expense.amount, expected_cash: -expense.amount }
+    },
+    { returnDocument: 'after', projection: CASH_REGISTER_TOTALS_PROJECTION }
+  )
+  
+  if (!cashRegister) {
+    return NextResponse.json(
+      { error: 'No hay caja abierta' },
+      { status: 400 }
+    )
+  }
+  
+  publish(userId, 'cash_register', cashRegister)
+  return NextResponse.json({ expense, expected_cash: cashRegister.expected_cash })
+}
+
+// Register withdrawal - POST /api/cash-register/withdrawal
+async function registerWithdrawal({ request, db, userId }) {
+  const body = await request.json()
+  const { amount, description } = body
+  
+  if (!amount || amount <= 0 || !description) {
+    return NextResponse.json(
+      { error: 'Monto y descripción son requeridos' },
+      { status: 400 }
+    )
+  }
+  
+  const withdrawal = {
+    id: uuidv4(),
+    amount: parseFloat(amount),
+    description,
+    date: new Date()
+  }
+  
+  // Append and update the running totals atomically on the open register
+  const cashRegister = await db.collection('cash_registers').findOneAndUpdate(
+    { user_id: userId, status: 'open' },
+    {
+      $push: { withdrawals: withdrawal },
+      $inc: { total_withdrawals: withdrawal.amount, expected_cash: -withdrawal.amount }
+    },
+    { returnDocument: 'after', projection: CASH_REGISTER_TOTALS_PROJECTION }
+  )
+  
+  if (!cashRegister) {
+    return NextResponse.json(
+      { error: 'No hay caja abierta' },
+      { status: 400 }
+    )
+  }
+  
+  publish(userId, 'cash_register', cashRegister)
+  return NextResponse.json({ withdrawal, expected_cash: cashRegister.expected_cash })
+}
+
+// Close cash register - POST /api/cash-register/close
+async function closeCashRegister({ request, db, userId }) {
+  const body = await request.json()
+  const { actual_cash, closing_notes, closing_photo_url } = body
+  
+  if (actual_cash === undefined || actual_cash < 0) {
+    return NextResponse.json(
+      { error: 'El conteo real es requerido' },
+      { status: 400 }
+    )
+  }
+  
+  const actualCash = parseFloat(actual_cash)
+  const difference = { $subtract: [actualCash, '$expected_cash'] }
+  
+  // Compute the difference against the stored expected_cash in the same
+  // write that closes the register, so a late expense cannot be missed
+  const cashRegister = await db.collection('cash_registers').findOneAndUpdate(
+    { user_id: userId, status: 'open' },
+    [{
+      $set: {
+        actual_cash: actualCash,
+        difference,
+        difference_percentage: {
+          $cond: [{ $gt: ['$expected_cash', 0] }, { $multiply: [{ $divide: [difference, '$expected_cash'] }, 100] }, 0]
+        },
+        closing_notes: { $literal: closing_notes || null },
+        closing_photo_url: { $literal: closing_photo_url || null },
+        closed_at: new Date(),
+        status: 'closed'
       }
-      
-      const cashRegister = {
-        id: uuidv4(),
-        user_id: userId,
-        opened_by: user.email,
-        opened_at: new Date(),
-        closed_at: null,
-        initial_cash: parseFloat(initial_cash),
-        cash_sales: 0,
-        card_sales: 0,
-        expenses: [],
-        withdrawals: [],
-        expected_cash: parseFloat(initial_cash),
-        actual_cash: null,
-        difference: null,
-        difference_percentage: null,
-        closing_notes: null,
-        closing_photo_url: null,
-        status: 'open'
+    }],
+    { returnDocument: 'after', projection: { _id: 0 } }
+  )
+  
+  if (!cashRegister) {
+    return NextResponse.json(
+      { error: 'No hay caja abierta' },
+      { status: 400 }
+    )
+  }
+  
+  publish(userId, 'cash_register', pickFields(cashRegister, CASH_REGISTER_TOTALS_PROJECTION))
+  return NextResponse.json(cashRegister)
+}
+
+// Get cash register history - GET /api/cash-register/history
+async function getCashRegisterHistory({ request, db, userId }) {
+  const url = new URL(request.url)
+  const limit = parseInt(url.searchParams.get('limit')) || 30
+  
+  const cashRegisters = await db.collection('cash_registers')
+    .find({ 
+      user_id: userId,
+      status: 'closed'
+    })
+    .sort({ closed_at: -1 })
+    .limit(limit)
+    .toArray()
+  
+  const cleanedCashRegisters = cashRegisters.map(({ _id, ...rest }) => rest)
+  return NextResponse.json(cleanedCashRegisters)
+}
+
+// ==================== DASHBOARD ROUTES ====================
+
+// Get dashboard stats - GET /api/dashboard/stats
+// Every dashboard of a tenant refreshes on the same sale events, so
+// concurrent loads share one computation.
+async function getDashboardStats({ db, userId }) {
+  const stats = await coalesceQuery(userId, 'dashboard.stats', null, () => loadDashboardStats(db, userId))
+  return NextResponse.json(stats)
+}
+
+// Sales totals for today and this month, and inventory counts
+async function loadDashboardStats(db, userId) {
+  // Day and month boundaries in SALES_TIMEZONE, like sales_daily
+  const todayKey = getDayKey(new Date())
+  const today = getDayStart(todayKey)
+  const monthStart = getDayStart(`${todayKey.slice(0, 8)}01`)
+  
+  // Sales totals are reduced server-side in a single pass over this month's
+  // sales (archived ones too, with a short retention window); only the
+  // scalars cross the wire, never the sale documents.
+  const salesStatsPromise = db.collection('sales').aggregate([
+    { $match: { user_id: userId, date: { $gte: monthStart } } },
+    unionArchivedSales(userId, { $gte: monthStart }),
+    {
+      $group: {
+        _id: null,
+        month_revenue: { $sum: '$total_amount' },
+        month_profit: { $sum: '$profit' },
+        today_revenue: { $sum: { $cond: [{ $gte: ['$date', today] }, '$total_amount', 0] } },
+        today_profit: { $sum: { $cond: [{ $gte: ['$date', today] }, '$profit', 0] } },
+        today_count: { $sum: { $cond: [{ $gte: ['$date', today] }, 1, 0] } }
       }
-      
-      await db.collection('cash_registers').insertOne(cashRegister)
-      const { _id, ...cleanCashRegister } = cashRegister
-      
-      return handleCORS(NextResponse.json(cleanCashRegister))
     }
-    
-    // Get current open cash register - GET /api/cash-register/current
-    if (route === '/cash-register/current' && method === 'GET') {
-      const cashRegister = await db.collection('cash_registers').findOne({
-        user_id: userId,
-        status: 'open'
-      })
-      
-      if (!cashRegister) {
-        return handleCORS(NextResponse.json({ cashRegister: null }))
+  ]).toArray()
+  
+  // Product counts and a capped, projected low stock list in one round trip
+  const inventoryStatsPromise = db.collection('products').aggregate([
+    { $match: { user_id: userId } },
+    {
+      $facet: {
+        total: [{ $count: 'count' }],
+        low_stock: [
+          { $match: { stock_quantity: { $lt: LOW_STOCK_THRESHOLD } } },
+          { $count: 'count' }
+        ],
+        low_stock_products: [
+          { $match: { stock_quantity: { $lt: LOW_STOCK_THRESHOLD } } },
+          { $sort: { stock_quantity: 1, name: 1 } },
+          { $limit: LOW_STOCK_LIST_LIMIT },
+          { $project: { _id: 0, id: 1, name: 1, category: 1, barcode: 1, stock_quantity: 1, sale_price: 1 } }
+        ]
       }
-      
-      const { _id, ...cleanCashRegister } = cashRegister
-      return handleCORS(NextResponse.json(cleanCashRegister))
     }
-    
-    // Register expense - POST /api/cash-register/expense
-    if (route === '/cash-register/expense' && method === 'POST') {
-      const body = await request.json()
-      const { amount, description } = body
-      
-      if (!amount || amount <= 0 || !description) {
-        return handleCORS(NextResponse.json(
-          { error: 'Monto y descripción son requeridos' },
-          { status: 400 }
-        ))
-      }
-      
-      const cashRegister = await db.collection('cash_registers').findOne({
-        user_id: userId,
-        status: 'open'
-      })
-      
-      if (!cashRegister) {
-        return handleCORS(NextResponse.json(
-          { error: 'No hay caja abierta' },
-          { status: 400 }
-        ))
-      }
-      
-      const expense = {
-        id: uuidv4(),
-        amount: parseFloat(amount),
-        description,
-        date: new Date()
-      }
-      
-      const newExpenses = [...cashRegister.expenses, expense]
-      const totalExpenses = newExpenses.reduce((sum, e) => sum + e.amount, 0)
-      const totalWithdrawals = cashRegister.withdrawals.reduce((sum, w) => sum + w.amount, 0)
-      const expected_cash = cashRegister.initial_cash + cashRegister.cash_sales - totalExpenses - totalWithdrawals
-      
-      await db.collection('cash_registers').updateOne(
-        { id: cashRegister.id },
-        { 
-          $set: { 
-            expenses: newExpenses,
-            expected_cash
-          } 
-        }
-      )
-      
-      return handleCORS(NextResponse.json({ expense, expected_cash }))
+  ]).toArray()
+  
+  const [[salesStats], [inventoryStats]] = await Promise.all([salesStatsPromise, inventoryStatsPromise])
+  
+  return {
+    today: {
+      revenue: salesStats?.today_revenue || 0,
+      profit: salesStats?.today_profit || 0,
+      sales_count: salesStats?.today_count || 0
+    },
+    month: {
+      revenue: salesStats?.month_revenue || 0,
+      profit: salesStats?.month_profit || 0
+    },
+    inventory: {
+      total_products: inventoryStats.total[0]?.count || 0,
+      low_stock_count: inventoryStats.low_stock[0]?.count || 0,
+      low_stock_products: inventoryStats.low_stock_products
     }
-    
-    // Register withdrawal - POST /api/cash-register/withdrawal
-    if (route === '/cash-register/withdrawal' && method === 'POST') {
-      const body = await request.json()
-      const { amount, description } = body
-      
-      if (!amount || amount <= 0 || !description) {
-        return handleCORS(NextResponse.json(
-          { error: 'Monto y descripción son requeridos' },
-          { status: 400 }
-        ))
+  }
+}
+
+// ==================== REPORTS ROUTES ====================
+
+// Sales analytics - GET /api/reports/analytics?from=YYYY-MM-DD&to=YYYY-MM-DD&bucket=hour|day|week&top=10
+// Days are calendar days in SALES_TIMEZONE (default: the last 30 days). One
+// aggregation over hot and archived sales returns the revenue timeline, an
+// hour-of-week heatmap, totals and per-product figures; top products and
+// categories are ranked from those.
+async function getSalesAnalytics({ request, db, userId }) {
+  const url = new URL(request.url)
+  const dayPattern = /^\d{4}-\d{2}-\d{2}$/
+  const to = url.searchParams.get('to') || getDayKey(new Date())
+  const from = url.searchParams.get('from') || (dayPattern.test(to) && !isNaN(Date.parse(to))
+    ? new Date(Date.parse(to) - (ANALYTICS_DEFAULT_DAYS - 1) * 86400000).toISOString().slice(0, 10)
+    : '')
+  const bucket = url.searchParams.get('bucket') || 'day'
+  const top = Math.min(parseInt(url.searchParams.get('top')) || ANALYTICS_TOP_DEFAULT, ANALYTICS_TOP_MAX)
+  
+  if (!dayPattern.test(from) || !dayPattern.test(to) || isNaN(Date.parse(from)) || isNaN(Date.parse(to)) || from > to) {
+    return NextResponse.json(
+      { error: 'Las fechas deben tener el formato YYYY-MM-DD y from no puede ser posterior a to' },
+      { status: 400 }
+    )
+  }
+  if (!ANALYTICS_BUCKET_DAYS[bucket]) {
+    return NextResponse.json(
+      { error: 'bucket debe ser hour, day o week' },
+      { status: 400 }
+    )
+  }
+  
+  const rangeDays = (Date.parse(to) - Date.parse(from)) / 86400000 + 1
+  if (rangeDays / ANALYTICS_BUCKET_DAYS[bucket] > ANALYTICS_MAX_BUCKETS) {
+    return NextResponse.json(
+      { error: `El rango genera más de ${ANALYTICS_MAX_BUCKETS} intervalos; usa un bucket mayor` },
+      { status: 400 }
+    )
+  }
+  
+  // The index narrows to the UTC range that covers both days in any
+  // timezone (UTC-14 to UTC+14); the day key then matches exactly
+  const dayExpression = { $dateToString: { format: '%Y-%m-%d', date: '$date', timezone: SALES_TIMEZONE } }
+  const dateRange = {
+    $gte: new Date(Date.parse(from) - 14 * 3600000),
+    $lt: new Date(Date.parse(to) + 38 * 3600000)
+  }
+  const [analytics] = await db.collection('sales').aggregate([
+    { $match: { user_id: userId, date: dateRange } },
+    unionArchivedSales(userId, dateRange),
+    { $match: { $expr: { $and: [{ $gte: [dayExpression, from] }, { $lte: [dayExpression, to] }] } } },
+    {
+      $facet: {
+        totals: [
+          { $group: { _id: null, revenue: { $sum: '$total_amount' }, profit: { $sum: '$profit' }, sales_count: { $sum: 1 } } }
+        ],
+        timeline: [
+          {
+            $group: {
+              _id: { $dateTrunc: { date: '$date', unit: bucket, timezone: SALES_TIMEZONE, startOfWeek: 'monday' } },
+              revenue: { $sum: '$total_amount' },
+              profit: { $sum: '$profit' },
+              sales_count: { $sum: 1 }
+            }
+          },
+          { $sort: { _id: 1 } },
+          { $project: { _id: 0, start: '$_id', revenue: 1, profit: 1, sales_count: 1 } }
+        ],
+        heatmap: [
+          {
+            $group: {
+              _id: {
+                day: { $isoDayOfWeek: { date: '$date', timezone: SALES_TIMEZONE } },
+                hour: { $hour: { date: '$date', timezone: SALES_TIMEZONE } }
+              },
+              revenue: { $sum: '$total_amount' },
+              sales_count: { $sum: 1 }
+            }
+          }
+        ],
+        products: [
+          { $unwind: '$items' },
+          {
+            $group: {
+              _id: '$items.product_id',
+              name: { $last: '$items.product_name' },
+              units: { $sum: '$items.quantity' },
+              revenue: { $sum: { $multiply: ['$items.quantity', '$items.price_at_sale'] } },
+              profit: {
+                $sum: { $multiply: ['$items.quantity', { $subtract: ['$items.price_at_sale', '$items.cost_at_sale'] }] }
+              }
+            }
+          }
+        ]
       }
-      
-      const cashRegister = await db.collection('cash_registers').findOne({
-        user_id: userId,
-        status: 'open'
+    }
+  ]).toArray()
+  
+  // Sale lines do not store the category: take it from the current product
+  const productIds = analytics.products.map(product => product._id)
+  const categories = await db.collection('products')
+    .find({ user_id: userId, id: { $in: productIds } }, { projection: { _id: 0, id: 1, category: 1 } })
+    .toArray()
+  const categoryById = Object.fromEntries(categories.map(product => [product.id, product.category]))
+  
+  const products = analytics.products.map(({ _id, ...product }) => ({
+    product_id: _id,
+    ...product,
+    category: categoryById[_id] || 'Sin categoría'
+  }))
+  
+  const { _id, ...totals } = analytics.totals[0] || { revenue: 0, profit: 0, sales_count: 0 }
+  
+  const byCategory = {}
+  for (const product of products) {
+    const entry = byCategory[product.category] ||= { category: product.category, units: 0, revenue: 0, profit: 0 }
+    entry.units += product.units
+    entry.revenue += product.revenue
+    entry.profit += product.profit
+  }
+  
+  // Rows Monday..Sunday, columns hour 0..23
+  const heatmap = {
+    sales_count: Array.from({ length: 7 }, () => Array(24).fill(0)),
+    revenue: Array.from({ length: 7 }, () => Array(24).fill(0))
+  }
+  for (const cell of analytics.heatmap) {
+    heatmap.sales_count[cell._id.day - 1][cell._id.hour] = cell.sales_count
+    heatmap.revenue[cell._id.day - 1][cell._id.hour] = cell.revenue
+  }
+  
+  return NextResponse.json({
+    from,
+    to,
+    bucket,
+    timezone: SALES_TIMEZONE,
+    totals,
+    timeline: analytics.timeline,
+    top_by_units: [...products].sort((a, b) => b.units - a.units).slice(0, top),
+    top_by_profit: [...products].sort((a, b) => b.profit - a.profit).slice(0, top),
+    categories: Object.values(byCategory).sort((a, b) => b.revenue - a.revenue),
+    heatmap
+  })
+}
+
+// ==================== EXPORT ROUTES ====================
+
+// Export sales as CSV, one row per line item - GET /api/export/sales
+async function exportSales({ request, db, userId }) {
+  const url = new URL(request.url)
+  const startDate = url.searchParams.get('start_date')
+  const endDate = url.searchParams.get('end_date')
+  
+  let query = { user_id: userId }
+  
+  if (startDate || endDate) {
+    query.date = {}
+    if (startDate) query.date.$gte = new Date(startDate)
+    if (endDate) query.date.$lte = new Date(endDate)
+  }
+  
+  // Hot sales in index order, then archived ones bucket by bucket, so the
+  // export streams without sorting the whole history in memory
+  const cursor = db.collection('sales').aggregate([
+    { $match: query },
+    { $sort: { date: -1, id: -1 } },
+    unionArchivedSales(userId, query.date),
+    { $project: { _id: 0, id: 1, date: 1, payment_method: 1, total_amount: 1, profit: 1, items: 1 } }
+  ], { batchSize: EXPORT_CHUNK_SIZE })
+  
+  const header = ['Venta', 'Fecha', 'Método de Pago', 'Producto ID', 'Producto', 'Cantidad', 'Precio', 'Costo', 'Subtotal', 'Ganancia', 'Total Venta']
+  const stream = streamCsv(cursor, header, (sale) => sale.items.map(item => [
+    sale.id,
+    sale.date,
+    sale.payment_method === 'cash' ? 'Efectivo' : 'Tarjeta',
+    item.product_id,
+    item.product_name,
+    item.quantity,
+    item.price_at_sale,
+    item.cost_at_sale,
+    item.price_at_sale * item.quantity,
+    (item.price_at_sale - item.cost_at_sale) * item.quantity,
+    sale.total_amount
+  ]))
+  
+  const filename = `Reporte_Ventas_${startDate || 'inicio'}_${endDate || new Date().toISOString().split('T')[0]}.csv`
+  return csvResponse(stream, filename)
+}
+
+// Export inventory as CSV - GET /api/export/products
+async function exportProducts({ db, userId }) {
+  const cursor = db.collection('products')
+    .find({ user_id: userId }, { projection: { _id: 0, search_tokens: 0 } })
+    .sort({ created_at: -1, id: -1 })
+    .batchSize(EXPORT_CHUNK_SIZE)
+  
+  const header = ['ID', 'Código de Barras', 'Nombre', 'Categoría', 'Precio Costo', 'Precio Venta', 'Stock', 'Stock Bajo', 'Creado']
+  const stream = streamCsv(cursor, header, (product) => [[
+    product.id,
+    product.barcode,
+    product.name,
+    product.category,
+    product.cost_price,
+    product.sale_price,
+    product.stock_quantity,
+    product.low_stock_alert ? 'Sí' : 'No',
+    product.created_at
+  ]])
+  
+  const filename = `Inventario_${new Date().toISOString().split('T')[0]}.csv`
+  return csvResponse(stream, filename)
+}
+
+// ==================== DIAGNOSTICS ROUTES ====================
+
+// Query plan report - GET /api/diagnostics/query-plans
+async function getQueryPlans({ db, userId }) {
+  await databaseReady
+  const plans = await explainRouteQueries(db, userId)
+  return NextResponse.json({
+    collscan_count: plans.filter(plan => plan.collscan).length,
+    plans
+  })
+}
+
+// Cache statistics - GET /api/diagnostics/cache
+async function getCacheStats() {
+  return NextResponse.json({
+    catalog: catalogCache.stats(),
+    tokens: tokenCache.stats(),
+    users: userCache.stats(),
+    queries: { ...queryCache.stats(), in_flight: queryLoads.size, shared_loads: querySharedLoads }
+  })
+}
+
+// ==================== EVENTS ROUTES ====================
+
+// Live tenant events - GET /api/events (Server-Sent Events)
+// Pushes `sale` summaries, `stock` deltas, `cash_register` totals and
+// `catalog` changes as they happen. A `ready` event is sent on every
+// (re)connection: clients resync then, since events are not replayed.
+async function streamEvents({ request, userId }) {
+  const encoder = new TextEncoder()
+  let cleanup = () => {}
+  
+  const stream = new ReadableStream({
+    start(controller) {
+      const write = text => controller.enqueue(encoder.encode(text))
+      
+      const unsubscribe = subscribe(userId, ({ type, data }) => {
+        // A client that stopped reading is dropped instead of buffering forever
+        if (controller.desiredSize < -EVENTS_MAX_QUEUED) {
+          cleanup()
+          controller.error(new Error('Event stream client is not reading'))
+          return
+        }
+        write(`event: ${type}\ndata: ${JSON.stringify(data)}\n\n`)
       })
+      // Comments keep proxies from closing an idle connection
+      const heartbeat = setInterval(() => write(': ping\n\n'), EVENTS_HEARTBEAT_MS)
       
-      if (!cashRegister) {
-        return handleCORS(NextResponse.json(
-          { error: 'No hay caja abierta' },
-          { status: 400 }
-        ))
-      }
-      
-      const withdrawal = {
-        id: uuidv4(),
-        amount: parseFloat(amount),
-        description,
-        date: new Date()
+      cleanup = () => {
+        unsubscribe()
+        clearInterval(heartbeat)
+        request.signal.removeEventListener('abort', onAbort)
       }
-      
-      const newWithdrawals = [...cashRegister.withdrawals, withdrawal]
-      const totalExpenses = cashRegister.expenses.reduce((sum, e) => sum + e.amount, 0)
-      const totalWithdrawals = newWithdrawals.reduce((sum, w) => sum + w.amount, 0)
-      const expected_cash = cashRegister.initial_cash + cashRegister.cash_sales - totalExpenses - totalWithdrawals
-      
-      await db.collection('cash_registers').updateOne(
-        { id: cashRegister.id },
-        { 
-          $set: { 
-            withdrawals: newWithdrawals,
-            expected_cash
-          } 
+      const onAbort = () => {
+        cleanup()
+        try {
+          controller.close()
+        } catch (error) {
+          // Already closed or errored
         }
-      )
+      }
+      request.signal.addEventListener('abort', onAbort)
       
-      return handleCORS(NextResponse.json({ withdrawal, expected_cash }))
+      write(`retry: 5000\nevent: ready\ndata: ${JSON.stringify({ connected_at: new Date() })}\n\n`)
+    },
+    cancel() {
+      cleanup()
     }
-    
-    // Close cash register - POST /api/cash-register/close
-    if (route === '/cash-register/close' && method === 'POST') {
-      const body = await request.json()
-      const { actual_cash, closing_notes, closing_photo_url } = body
-      
-      if (actual_cash === undefined || actual_cash < 0) {
-        return handleCORS(NextResponse.json(
-          { error: 'El conteo real es requerido' },
-          { status: 400 }
-        ))
+  })
+  
+  return new NextResponse(stream, {
+    headers: {
+      'Content-Type': 'text/event-stream; charset=utf-8',
+      'Cache-Control': 'no-cache, no-transform',
+      Connection: 'keep-alive',
+      'X-Accel-Buffering': 'no'
+    }
+  })
+}
+
+// ==================== METRICS ROUTES ====================
+
+// Prometheus metrics - GET /api/metrics
+// Public so scrapers need no session; set METRICS_TOKEN to require a bearer token.
+async function getMetrics({ request }) {
+  if (process.env.METRICS_TOKEN && request.headers.get('authorization') !== `Bearer ${process.env.METRICS_TOKEN}`) {
+    return NextResponse.json(
+      { error: 'No autenticado' },
+      { status: 401 }
+    )
+  }
+  
+  return new NextResponse(renderMetrics(), {
+    headers: { 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8' }
+  })
+}
+
+// In-process cache statistics, sampled at scrape time
+registerCollector(() => {
+  const caches = { catalog: catalogCache.stats(), tokens: tokenCache.stats(), users: userCache.stats(), queries: queryCache.stats() }
+  const family = (field, type, help) => ({
+    name: `cloudpos_cache_${field}${type === 'counter' ? '_total' : ''}`,
+    help,
+    type,
+    samples: Object.entries(caches).map(([cache, stats]) => ({ labels: { cache }, value: stats[field] }))
+  })
+  return [
+    family('size', 'gauge', 'Entries currently held by each cache'),
+    family('hits', 'counter', 'Cache lookups served from memory'),
+    family('misses', 'counter', 'Cache lookups that missed'),
+    family('evictions', 'counter', 'Entries evicted to stay within the size limit'),
+    {
+      name: 'cloudpos_query_shared_loads_total',
+      help: 'Read queries answered by joining an identical query already in flight',
+      type: 'counter',
+      samples: [{ value: querySharedLoads }]
+    }
+  ]
+})
+
+// Live event subscribers, sampled at scrape time
+registerCollector(() => {
+  const stats = eventStats()
+  return [
+    { name: 'cloudpos_event_subscribers', help: 'Open live event streams', type: 'gauge', samples: [{ value: stats.subscribers }] },
+    { name: 'cloudpos_events_published_total', help: 'Events published to at least one subscriber', type: 'counter', samples: [{ value: stats.published }] }
+  ]
+})
+
+// Connection pool counters, sampled at scrape time
+registerCollector(() => {
+  const pool = getPoolStats()
+  const gauge = (field, help) => ({ name: `cloudpos_mongo_pool_${field}`, help, type: 'gauge', samples: [{ value: pool[field] }] })
+  const counter = (field, help) => ({ name: `cloudpos_mongo_pool_${field}_total`, help, type: 'counter', samples: [{ value: pool[field] }] })
+  return [
+    gauge('open', 'Open connections in the MongoDB pool'),
+    gauge('in_use', 'Pool connections checked out by an operation'),
+    gauge('waiting', 'Operations waiting for a pool connection'),
+    counter('created', 'Pool connections created'),
+    counter('checkout_failures', 'Pool checkouts that failed or timed out')
+  ]
+})
+
+// ==================== HEALTH ROUTES ====================
+
+// Readiness probe - GET /api/health
+// 200 once MongoDB answers a ping and the index check has finished, 503 otherwise.
+async function getHealth() {
+  const started = performance.now()
+  let mongo
+  try {
+    const db = await connectToMongo()
+    await db.command({ ping: 1 })
+    mongo = { status: 'ok', ping_ms: Math.round(performance.now() - started) }
+  } catch (error) {
+    mongo = { status: 'error', error: error.message }
+  }
+  
+  const pool = getPoolStats()
+  const ready = mongo.status === 'ok' && pool.indexes_checked_at !== null
+  return NextResponse.json(
+    {
+      status: ready ? 'ok' : 'unavailable',
+      uptime_seconds: Math.round(process.uptime()),
+      mongo,
+      pool
+    },
+    { status: ready ? 200 : 503, headers: { 'Cache-Control': 'no-store' } }
+  )
+}
+
+// ==================== ROUTING ====================
+
+// Route table. `:name` path segments are captured into `params`; routes are
+// authenticated unless marked public, and handlers receive the caller's userId.
+// The dispatcher connects to MongoDB first unless a route sets database: false.
+const ROUTES = [
+  { method: 'POST', path: '/auth/register', handler: register, public: true },
+  { method: 'POST', path: '/auth/login', handler: login, public: true },
+  { method: 'POST', path: '/auth/logout', handler: logout, public: true },
+  { method: 'GET', path: '/auth/me', handler: getCurrentUser },
+  { method: 'GET', path: '/products', handler: listProducts },
+  { method: 'GET', path: '/products/changes', handler: getProductChanges },
+  { method: 'POST', path: '/products', handler: createProduct },
+  { method: 'POST', path: '/products/import', handler: importProducts },
+  { method: 'PUT', path: '/products/:id', handler: updateProduct },
+  { method: 'DELETE', path: '/products/:id', handler: deleteProduct },
+  { method: 'POST', path: '/sales', handler: createSale },
+  { method: 'POST', path: '/sales/batch', handler: createSalesBatch },
+  { method: 'GET', path: '/sales', handler: listSales },
+  { method: 'GET', path: '/sales/daily', handler: getSalesDaily },
+  { method: 'POST', path: '/sales/daily/rebuild', handler: rebuildDailySales },
+  { method: 'GET', path: '/sales/archive', handler: getSalesArchive },
+  { method: 'POST', path: '/sales/archive', handler: archiveOldSales },
+  { method: 'POST', path: '/cash-register/open', handler: openCashRegister },
+  { method: 'GET', path: '/cash-register/current', handler: getCurrentCashRegister },
+  { method: 'POST', path: '/cash-register/expense', handler: registerExpense },
+  { method: 'POST', path: '/cash-register/withdrawal', handler: registerWithdrawal },
+  { method: 'POST', path: '/cash-register/close', handler: closeCashRegister },
+  { method: 'GET', path: '/cash-register/history', handler: getCashRegisterHistory },
+  { method: 'GET', path: '/dashboard/stats', handler: getDashboardStats },
+  { method: 'GET', path: '/reports/analytics', handler: getSalesAnalytics },
+  { method: 'GET', path: '/export/sales', handler: exportSales },
+  { method: 'GET', path: '/export/products', handler: exportProducts },
+  { method: 'GET', path: '/diagnostics/query-plans', handler: getQueryPlans },
+  { method: 'GET', path: '/diagnostics/cache', handler: getCacheStats },
+  { method: 'GET', path: '/events', handler: streamEvents, database: false },
+  { method: 'GET', path: '/metrics', handler: getMetrics, public: true, database: false },
+  { method: 'GET', path: '/health', handler: getHealth, public: true, database: false }
+]
+
+// Static routes are looked up directly; parameterized ones are matched in order
+const staticRoutes = new Map()
+const dynamicRoutes = []
+for (const route of ROUTES) {
+  if (route.path.includes('/:')) {
+    dynamicRoutes.push({ ...route, segments: route.path.split('/').slice(1) })
+  } else {
+    staticRoutes.set(`${route.method} ${route.path}`, route)
+  }
+}
+
+function matchRoute(method, path) {
+  const route = staticRoutes.get(`${method} /${path.join('/')}`)
+  if (route) return { route, params: {} }
+  
+  for (const candidate of dynamicRoutes) {
+    if (candidate.method !== method || candidate.segments.length !== path.length) continue
+    const params = {}
+    const matches = candidate.segments.every((segment, index) => {
+      if (segment.startsWith(':')) {
+        params[segment.slice(1)] = path[index]
+        return true
       }
-      
-      const cashRegister = await db.collection('cash_registers').findOne({
-        user_id: userId,
-        status: 'open'
-      })
-      
-      if (!cashRegister) {
-        return handleCORS(NextResponse.json(
-          { error: 'No hay caja abierta' },
-          { status: 400 }
-        ))
+      return segment === path[index]
+    })
+    if (matches) return { route: candidate, params }
+  }
+  return null
+}
+
+// Authenticate when required and run the matched handler
+async function dispatch(request, path, match) {
+  try {
+    // Routes marked `database: false` must answer even when MongoDB is down
+    const db = match?.route.database === false ? null : await connectToMongo()
+    
+    let userId = null
+    if (!match?.route.public) {
+      const decoded = verifyToken(request)
+      if (!decoded) {
+        return NextResponse.json(
+          { error: 'No autenticado' },
+          { status: 401 }
+        )
       }
-      
-      const actualCash = parseFloat(actual_cash)
-      const difference = actualCash - cashRegister.expected_cash
-      const difference_percentage = cashRegister.expected_cash > 0 
-        ? (difference / cashRegister.expected_cash) * 100 
-        : 0
-      
-      await db.collection('cash_registers').updateOne(
-        { id: cashRegister.id },
-        { 
-          $set: { 
-            actual_cash: actualCash,
-            difference,
-            difference_percentage,
-            closing_notes: closing_notes || null,
-            closing_photo_url: closing_photo_url || null,
-            closed_at: new Date(),
-            status: 'closed'
-          } 
-        }
-      )
-      
-      const updatedCashRegister = await db.collection('cash_registers').findOne({
-        id: cashRegister.id
-      })
-      
-      const { _id, ...cleanCashRegister } = updatedCashRegister
-      return handleCORS(NextResponse.json(cleanCashRegister))
+      userId = decoded.userId
     }
     
-    // Get cash register history - GET /api/cash-register/history
-    if (route === '/cash-register/history' && method === 'GET') {
-      const url = new URL(request.url)
-      const limit = parseInt(url.searchParams.get('limit')) || 30
-      
-      const cashRegisters = await db.collection('cash_registers')
-        .find({ 
-          user_id: userId,
-          status: 'closed'
-        })
-        .sort({ closed_at: -1 })
-        .limit(limit)
-        .toArray()
-      
-      const cleanedCashRegisters = cashRegisters.map(({ _id, ...rest }) => rest)
-      return handleCORS(NextResponse.json(cleanedCashRegisters))
+    if (!match) {
+      return NextResponse.json(
+        { error: `Route /${path.join('/')} not found` },
+        { status: 404 }
+      )
     }
     
-    // ==================== DASHBOARD ROUTES ====================
-    
-    // Get dashboard stats - GET /api/dashboard/stats
-    if (route === '/dashboard/stats' && method === 'GET') {
-      const today = new Date()
-      today.setHours(0, 0, 0, 0)
-      
-      // Sales today
-      const salesToday = await db.collection('sales')
-        .find({
-          user_id: userId,
-          date: { $gte: today }
-        })
-        .toArray()
-      
-      const todayRevenue = salesToday.reduce((sum, sale) => sum + sale.total_amount, 0)
-      const todayProfit = salesToday.reduce((sum, sale) => sum + sale.profit, 0)
-      const todaySalesCount = salesToday.length
-      
-      // Low stock products
-      const lowStockProducts = await db.collection('products')
-        .find({
-          user_id: userId,
-          stock_quantity: { $lt: 10 }
-        })
-        .toArray()
-      
-      // Total products
-      const totalProducts = await db.collection('products').countDocuments({ user_id: userId })
-      
-      // This month stats
-      const monthStart = new Date(today.getFullYear(), today.getMonth(), 1)
-      const salesThisMonth = await db.collection('sales')
-        .find({
-          user_id: userId,
-          date: { $gte: monthStart }
-        })
-        .toArray()
-      
-      const monthRevenue = salesThisMonth.reduce((sum, sale) => sum + sale.total_amount, 0)
-      const monthProfit = salesThisMonth.reduce((sum, sale) => sum + sale.profit, 0)
-      
-      return handleCORS(NextResponse.json({
-        today: {
-          revenue: todayRevenue,
-          profit: todayProfit,
-          sales_count: todaySalesCount
-        },
-        month: {
-          revenue: monthRevenue,
-          profit: monthProfit
-        },
-        inventory: {
-          total_products: totalProducts,
-          low_stock_count: lowStockProducts.length,
-          low_stock_products: lowStockProducts.map(({ _id, ...rest }) => rest)
-        }
-      }))
+    try {
+      return await match.route.handler({ request, db, userId, params: match.params })
+    } finally {
+      // Results read before a write of the tenant must not be served after it
+      if (userId && request.method !== 'GET') invalidateQueries(userId)
     }
-    
-    // Route not found
-    return handleCORS(NextResponse.json(
-      { error: `Route ${route} not found` },
-      { status: 404 }
-    ))
-
   } catch (error) {
     console.error('API Error:', error)
-    return handleCORS(NextResponse.json(
+    return NextResponse.json(
       { error: 'Internal server error', details: error.message },
       { status: 500 }
-    ))
+    )
   }
 }
 
+// Route handler function
+async function handleRoute(request, { params }) {
+  const { path = [] } = params
+  const match = matchRoute(request.method, path)
+  const routeLabel = match ? match.route.path : 'unmatched'
+  
+  const timing = { mongoCommands: 0, mongoMs: 0 }
+  const started = performance.now()
+  const response = await requestTiming.run(timing, () => dispatch(request, path, match))
+  const durationMs = performance.now() - started
+  
+  const labels = { method: request.method, route: routeLabel }
+  httpRequestsTotal.inc({ ...labels, status: response.status })
+  httpRequestDuration.observe(labels, durationMs / 1000)
+  mongoCommandsTotal.inc(labels, timing.mongoCommands)
+  mongoCommandSeconds.inc(labels, timing.mongoMs / 1000)
+  
+  response.headers.set(
+    'Server-Timing',
+    `app;dur=${durationMs.toFixed(1)}, db;dur=${timing.mongoMs.toFixed(1)};desc="${timing.mongoCommands} queries"`
+  )
+  return handleCORS(response)
+}
+
 // Export all HTTP methods
 export const GET = handleRoute
 export const POST = handleRoute
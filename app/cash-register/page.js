@@ -4,6 +4,7 @@ import { useEffect, useState } from 'react'
 import { useRouter } from 'next/navigation'
 import Navbar from '@/components/Navbar'
 import CashRegisterReceipt from '@/components/CashRegisterReceipt'
+import { useTenantEvents } from '@/hooks/use-tenant-events'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Button } from '@/components/ui/button'
 import { Input } from '@/components/ui/input'
@@ -123,6 +124,25 @@ export default function CashRegisterPage() {
     }
   }, [user])
   
+  // Sales from every terminal update the open register's totals live; other
+  // changes (new expenses, opening or closing elsewhere) reload the register
+  const handleRegisterEvent = (register) => {
+    const onlySalesChanged = cashRegister && register.id === cashRegister.id && register.status === 'open' &&
+      register.total_expenses === cashRegister.total_expenses &&
+      register.total_withdrawals === cashRegister.total_withdrawals
+    if (onlySalesChanged) {
+      setCashRegister(current => ({ ...current, ...register }))
+    } else {
+      fetchCashRegister()
+      if (register.status === 'closed') fetchHistory()
+    }
+  }
+  
+  useTenantEvents(Boolean(user), {
+    ready: fetchCashRegister,
+    cash_register: handleRegisterEvent
+  })
+  
   const handleOpenCash = async () => {
     if (!initialCash || parseFloat(initialCash) < 0) {
       toast.error('Ingresa un monto válido para el fondo inicial')
@@ -404,7 +424,7 @@ export default function CashRegisterPage() {
                       <div className="flex justify-between items-center pt-2 border-t">
                         <span className="font-semibold">Total Gastos:</span>
                         <span className="font-bold text-red-600">
-                          -{currency}{cashRegister.expenses.reduce((sum, e) => sum + e.amount, 0).toFixed(2)}
+                          -{currency}{(cashRegister.total_expenses ?? cashRegister.expenses.reduce((sum, e) => sum + e.amount, 0)).toFixed(2)}
                         </span>
                       </div>
                     </div>
@@ -439,7 +459,7 @@ export default function CashRegisterPage() {
                       <div className="flex justify-between items-center pt-2 border-t">
                         <span className="font-semibold">Total Retiros:</span>
                         <span className="font-bold text-orange-600">
-                          -{currency}{cashRegister.withdrawals.reduce((sum, w) => sum + w.amount, 0).toFixed(2)}
+                          -{currency}{(cashRegister.total_withdrawals ?? cashRegister.withdrawals.reduce((sum, w) => sum + w.amount, 0)).toFixed(2)}
                         </span>
                       </div>
                     </div>
@@ -1,8 +1,9 @@
 'use client'
 
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import { useRouter } from 'next/navigation'
 import Navbar from '@/components/Navbar'
+import { useTenantEvents } from '@/hooks/use-tenant-events'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { DollarSign, TrendingUp, Package, AlertTriangle } from 'lucide-react'
 import { Button } from '@/components/ui/button'
@@ -17,6 +18,72 @@ export default function DashboardPage() {
   const [salesData, setSalesData] = useState([])
   const [categoryData, setCategoryData] = useState([])
   
+  const fetchStats = async () => {
+    const statsResponse = await fetch('/api/dashboard/stats')
+    if (statsResponse.ok) {
+      const statsData = await statsResponse.json()
+      setStats(statsData)
+    }
+  }
+  
+  // Inventory figures are refetched at most every few seconds while stock keeps changing
+  const statsRefreshRef = useRef(null)
+  const scheduleStatsRefresh = () => {
+    if (statsRefreshRef.current) return
+    statsRefreshRef.current = setTimeout(() => {
+      statsRefreshRef.current = null
+      fetchStats().catch(error => console.error('Error refreshing stats:', error))
+    }, 3000)
+  }
+  useEffect(() => () => clearTimeout(statsRefreshRef.current), [])
+  
+  // Sales made on any terminal are added to today's figures as they happen
+  const applySale = (sale) => {
+    const date = new Date(sale.date)
+    const now = new Date()
+    const isToday = date.toDateString() === now.toDateString()
+    const isThisMonth = date.getFullYear() === now.getFullYear() && date.getMonth() === now.getMonth()
+    
+    setStats(current => current && {
+      ...current,
+      today: isToday ? {
+        revenue: current.today.revenue + sale.total_amount,
+        profit: current.today.profit + sale.profit,
+        sales_count: current.today.sales_count + 1
+      } : current.today,
+      month: isThisMonth ? {
+        revenue: current.month.revenue + sale.total_amount,
+        profit: current.month.profit + sale.profit
+      } : current.month
+    })
+    
+    const label = date.toLocaleDateString('es-ES', { month: 'short', day: 'numeric' })
+    setSalesData(current => current.map(point =>
+      point.date === label ? { ...point, ventas: point.ventas + sale.total_amount } : point
+    ))
+    if (isToday) {
+      const method = sale.payment_method === 'cash' ? 'Efectivo' : 'Tarjeta'
+      setCategoryData(current => current.some(entry => entry.name === method)
+        ? current.map(entry => entry.name === method ? { ...entry, value: entry.value + sale.total_amount } : entry)
+        : [...current, { name: method, value: sale.total_amount }]
+      )
+    }
+  }
+  
+  // Events published while disconnected are lost: refetch after a reconnection
+  const connectedRef = useRef(false)
+  const handleReady = () => {
+    if (connectedRef.current) scheduleStatsRefresh()
+    connectedRef.current = true
+  }
+  
+  useTenantEvents(Boolean(user), {
+    ready: handleReady,
+    sale: applySale,
+    stock: scheduleStatsRefresh,
+    catalog: scheduleStatsRefresh
+  })
+  
   useEffect(() => {
     const fetchData = async () => {
       try {
@@ -29,58 +96,44 @@ export default function DashboardPage() {
         const authData = await authResponse.json()
         setUser(authData.user)
         
-        // Fetch stats
-        const statsResponse = await fetch('/api/dashboard/stats')
-        if (statsResponse.ok) {
-          const statsData = await statsResponse.json()
-          setStats(statsData)
+        await fetchStats()
+        
+        // Fetch daily sales rollup for the last 7 days
+        const toDayKey = (date) => {
+          const year = date.getFullYear()
+          const month = String(date.getMonth() + 1).padStart(2, '0')
+          const day = String(date.getDate()).padStart(2, '0')
+          return `${year}-${month}-${day}`
         }
+        const firstDay = new Date()
+        firstDay.setDate(firstDay.getDate() - 6)
         
-        // Fetch sales for charts
-        const salesResponse = await fetch('/api/sales')
-        if (salesResponse.ok) {
-          const sales = await salesResponse.json()
+        const dailyResponse = await fetch(`/api/sales/daily?from=${toDayKey(firstDay)}&to=${toDayKey(new Date())}`)
+        if (dailyResponse.ok) {
+          const days = await dailyResponse.json()
+          const daysByKey = Object.fromEntries(days.map(day => [day.day, day]))
           
           // Process sales by day for last 7 days
           const last7Days = []
           for (let i = 6; i >= 0; i--) {
             const date = new Date()
             date.setDate(date.getDate() - i)
-            date.setHours(0, 0, 0, 0)
-            const nextDay = new Date(date)
-            nextDay.setDate(nextDay.getDate() + 1)
-            
-            const daySales = sales.filter(sale => {
-              const saleDate = new Date(sale.date)
-              return saleDate >= date && saleDate < nextDay
-            })
-            
-            const dayTotal = daySales.reduce((sum, sale) => sum + sale.total_amount, 0)
             
             last7Days.push({
               date: date.toLocaleDateString('es-ES', { month: 'short', day: 'numeric' }),
-              ventas: dayTotal
+              ventas: daysByKey[toDayKey(date)]?.revenue || 0
             })
           }
           setSalesData(last7Days)
           
-          // Process sales by category
-          const categoryMap = {}
-          sales.forEach(sale => {
-            sale.items.forEach(item => {
-              // We don't have category in sale items, so we'll group by payment method instead
-              const method = sale.payment_method === 'cash' ? 'Efectivo' : 'Tarjeta'
-              if (!categoryMap[method]) {
-                categoryMap[method] = 0
-              }
-              categoryMap[method] += item.quantity * item.price_at_sale
-            })
-          })
+          // Process sales by payment method
+          const cashTotal = days.reduce((sum, day) => sum + (day.cash_revenue || 0), 0)
+          const cardTotal = days.reduce((sum, day) => sum + (day.card_revenue || 0), 0)
           
-          const categoryArray = Object.keys(categoryMap).map(key => ({
-            name: key,
-            value: categoryMap[key]
-          }))
+          const categoryArray = [
+            { name: 'Efectivo', value: cashTotal },
+            { name: 'Tarjeta', value: cardTotal }
+          ].filter(entry => entry.value > 0)
           setCategoryData(categoryArray)
         }
       } catch (error) {
@@ -1,6 +1,6 @@
 'use client'
 
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import { useRouter } from 'next/navigation'
 import Navbar from '@/components/Navbar'
 import { Button } from '@/components/ui/button'
@@ -24,7 +24,7 @@ import {
 } from '@/components/ui/table'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { toast } from 'sonner'
-import { Plus, Pencil, Trash2, Search, AlertCircle, Package } from 'lucide-react'
+import { Plus, Pencil, Trash2, Search, AlertCircle, Package, FileSpreadsheet, Upload, Loader2 } from 'lucide-react'
 import { Badge } from '@/components/ui/badge'
 
 export default function InventoryPage() {
@@ -36,6 +36,7 @@ export default function InventoryPage() {
   const [user, setUser] = useState(null)
   const [isDialogOpen, setIsDialogOpen] = useState(false)
   const [editingProduct, setEditingProduct] = useState(null)
+  const [isImporting, setIsImporting] = useState(false)
   const [formData, setFormData] = useState({
     barcode: '',
     name: '',
@@ -83,6 +84,40 @@ export default function InventoryPage() {
     }
   }, [user])
   
+  const importInputRef = useRef(null)
+  
+  // Upload a CSV (same columns as the export) to create or update products by barcode
+  const handleImport = async (event) => {
+    const file = event.target.files?.[0]
+    event.target.value = ''
+    if (!file) return
+    
+    setIsImporting(true)
+    try {
+      const response = await fetch('/api/products/import', {
+        method: 'POST',
+        headers: { 'Content-Type': 'text/csv' },
+        body: file
+      })
+      const data = await response.json()
+      if (!response.ok) {
+        toast.error(data.error || 'Error al importar productos')
+        return
+      }
+      
+      toast.success(`Importación completada: ${data.created} nuevos, ${data.updated} actualizados`)
+      if (data.failed > 0) {
+        const details = data.errors.slice(0, 3).map(error => `fila ${error.row}: ${error.error}`).join('; ')
+        toast.error(`${data.failed} filas con errores. ${details}`)
+      }
+      fetchProducts()
+    } catch (error) {
+      toast.error('Error al importar productos')
+    } finally {
+      setIsImporting(false)
+    }
+  }
+  
   useEffect(() => {
     const filtered = products.filter(product =>
       product.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
@@ -193,6 +228,28 @@ export default function InventoryPage() {
                   className="pl-10"
                 />
               </div>
+              <Button asChild variant="outline" className="gap-2">
+                <a href="/api/export/products" download>
+                  <FileSpreadsheet className="h-4 w-4" />
+                  Exportar
+                </a>
+              </Button>
+              <input
+                ref={importInputRef}
+                type="file"
+                accept=".csv,text/csv"
+                className="hidden"
+                onChange={handleImport}
+              />
+              <Button
+                variant="outline"
+                className="gap-2"
+                disabled={isImporting}
+                onClick={() => importInputRef.current?.click()}
+              >
+                {isImporting ? <Loader2 className="h-4 w-4 animate-spin" /> : <Upload className="h-4 w-4" />}
+                Importar
+              </Button>
               <Button onClick={() => handleOpenDialog()} className="gap-2">
                 <Plus className="h-4 w-4" />
                 Nuevo Producto
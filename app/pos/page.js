@@ -1,16 +1,27 @@
 'use client'
 
-import { useEffect, useState } from 'react'
+import { useEffect, useMemo, useRef, useState } from 'react'
 import { useRouter } from 'next/navigation'
 import Navbar from '@/components/Navbar'
 import useCartStore from '@/lib/store'
+import {
+  enqueueSale,
+  flushSaleQueue,
+  countQueuedSales,
+  getRejectedSales,
+  retryRejectedSale,
+  discardRejectedSale
+} from '@/lib/sale-queue'
+import { emptyCatalog, syncCatalog, listCatalog, searchCatalog } from '@/lib/catalog-sync'
+import { useTenantEvents } from '@/hooks/use-tenant-events'
+import { v4 as uuidv4 } from 'uuid'
 import TicketReceipt from '@/components/TicketReceipt'
 import { Button } from '@/components/ui/button'
 import { Input } from '@/components/ui/input'
 import { Label } from '@/components/ui/label'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { toast } from 'sonner'
-import { Search, Trash2, Plus, Minus, DollarSign, Loader2 } from 'lucide-react'
+import { Search, Trash2, Plus, Minus, DollarSign, Loader2, AlertTriangle, RotateCcw } from 'lucide-react'
 import { Badge } from '@/components/ui/badge'
 import { Separator } from '@/components/ui/separator'
 import {
@@ -31,7 +42,7 @@ import {
 
 export default function POSPage() {
   const router = useRouter()
-  const [products, setProducts] = useState([])
+  const [catalog, setCatalog] = useState(emptyCatalog)
   const [searchTerm, setSearchTerm] = useState('')
   const [user, setUser] = useState(null)
   const [isProcessing, setIsProcessing] = useState(false)
@@ -40,6 +51,8 @@ export default function POSPage() {
   const [paymentMethod, setPaymentMethod] = useState('cash')
   const [amountReceived, setAmountReceived] = useState('')
   const [lastSale, setLastSale] = useState(null)
+  const [pendingSalesCount, setPendingSalesCount] = useState(0)
+  const [rejectedSales, setRejectedSales] = useState([])
   
   const { items, addItem, removeItem, updateQuantity, clearCart, getTotal, getItemCount } = useCartStore()
   
@@ -60,35 +73,52 @@ export default function POSPage() {
     checkAuth()
   }, [router])
   
-  const fetchProducts = async (search = '') => {
-    try {
-      const url = search ? `/api/products?search=${encodeURIComponent(search)}` : '/api/products'
-      const response = await fetch(url)
-      if (response.ok) {
-        const data = await response.json()
-        setProducts(data)
-      }
-    } catch (error) {
-      console.error('Error fetching products:', error)
+  const catalogRef = useRef(catalog)
+  const catalogSyncRef = useRef(null)
+  
+  // Bring the local catalog up to date; concurrent callers share one request
+  const refreshCatalog = () => {
+    if (!catalogSyncRef.current) {
+      catalogSyncRef.current = syncCatalog(catalogRef.current)
+        .then(next => {
+          catalogRef.current = next
+          setCatalog(next)
+        })
+        .catch(error => console.error('Error syncing catalog:', error))
+        .finally(() => { catalogSyncRef.current = null })
     }
+    return catalogSyncRef.current
   }
   
   useEffect(() => {
     if (user) {
-      fetchProducts()
+      refreshCatalog()
     }
   }, [user])
   
-  useEffect(() => {
-    if (searchTerm) {
-      const debounce = setTimeout(() => {
-        fetchProducts(searchTerm)
-      }, 300)
-      return () => clearTimeout(debounce)
-    } else {
-      fetchProducts()
-    }
-  }, [searchTerm])
+  // Stock and catalog changes from any terminal arrive as live events; a burst
+  // of them (e.g. a synced offline batch) is coalesced into one resync
+  const catalogRefreshTimerRef = useRef(null)
+  const scheduleCatalogRefresh = () => {
+    if (catalogRefreshTimerRef.current) return
+    catalogRefreshTimerRef.current = setTimeout(() => {
+      catalogRefreshTimerRef.current = null
+      refreshCatalog()
+    }, 500)
+  }
+  useEffect(() => () => clearTimeout(catalogRefreshTimerRef.current), [])
+  
+  useTenantEvents(Boolean(user), {
+    ready: scheduleCatalogRefresh,
+    stock: scheduleCatalogRefresh,
+    catalog: scheduleCatalogRefresh
+  })
+  
+  // Search runs against the local catalog, so no request per keystroke
+  const products = useMemo(() => {
+    const search = searchTerm.trim()
+    return search ? searchCatalog(catalog, search, 50) : listCatalog(catalog)
+  }, [catalog, searchTerm])
   
   const handleAddToCart = (product) => {
     if (product.stock_quantity <= 0) {
@@ -118,6 +148,69 @@ export default function POSPage() {
     setIsPaymentDialogOpen(true)
   }
   
+  // Send queued sales to the server; failures leave them queued for the next attempt
+  const syncPendingSales = async () => {
+    if (!user) return
+    try {
+      const { rejected } = await flushSaleQueue(user.id)
+      rejected.forEach(result => {
+        toast.error(`Venta ${result.client_id.slice(0, 8).toUpperCase()} no registrada: ${result.error}`)
+      })
+      // A rejected sale's units were taken locally: restore the server's stock
+      if (rejected.length > 0) {
+        await refreshCatalog()
+      }
+    } catch (error) {
+      console.error('Error syncing sales:', error)
+    }
+    try {
+      setPendingSalesCount(await countQueuedSales(user.id))
+      setRejectedSales(await getRejectedSales(user.id))
+    } catch (error) {
+      console.error('Error reading sale queue:', error)
+    }
+  }
+  
+  // Rejected sales stay on this terminal until the cashier decides what to do
+  const handleRetryRejectedSale = async (clientId) => {
+    try {
+      await retryRejectedSale(clientId)
+    } catch (error) {
+      console.error('Error retrying sale:', error)
+      toast.error('Error al reintentar la venta')
+    }
+    syncPendingSales()
+  }
+  
+  const handleDiscardRejectedSale = async (clientId) => {
+    if (!window.confirm('¿Descartar esta venta? No se registrará en el servidor.')) return
+    try {
+      await discardRejectedSale(clientId)
+      setRejectedSales(await getRejectedSales(user.id))
+    } catch (error) {
+      console.error('Error discarding sale:', error)
+      toast.error('Error al descartar la venta')
+    }
+  }
+  
+  // Live events drive catalog resyncs, but a dropped or silently stalled
+  // stream must not leave the terminal stale: the timer also pulls a delta
+  const syncPeriodically = () => {
+    syncPendingSales()
+    refreshCatalog()
+  }
+  
+  useEffect(() => {
+    if (!user) return
+    syncPendingSales()
+    const interval = setInterval(syncPeriodically, 15000)
+    window.addEventListener('online', syncPendingSales)
+    return () => {
+      clearInterval(interval)
+      window.removeEventListener('online', syncPendingSales)
+    }
+  }, [user])
+  
   const handleCompleteSale = async () => {
     const total = getTotal()
     const received = parseFloat(amountReceived) || total
@@ -130,44 +223,68 @@ export default function POSPage() {
     setIsProcessing(true)
     
     try {
-      const saleData = {
+      const saleId = uuidv4()
+      const date = new Date().toISOString()
+      
+      // Commit the sale locally; it is sent to the server in the background
+      // with the prices the customer was charged
+      await enqueueSale({
+        client_id: saleId,
+        user_id: user.id,
         items: items.map(item => ({
           product_id: item.id,
-          quantity: item.quantity
+          product_name: item.name,
+          quantity: item.quantity,
+          price_at_sale: item.sale_price
         })),
+        total_amount: total,
         payment_method: paymentMethod,
-        amount_received: received
+        amount_received: received,
+        date
+      })
+      
+      const change = received - total
+      if (paymentMethod === 'cash' && change > 0) {
+        toast.success(`¡Venta completada! Cambio: ${user?.currency_symbol}${change.toFixed(2)}`)
+      } else {
+        toast.success('¡Venta completada exitosamente!')
       }
       
-      const response = await fetch('/api/sales', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(saleData)
+      // Store sale for printing, priced from the cart
+      setLastSale({
+        id: saleId,
+        total_amount: total,
+        payment_method: paymentMethod,
+        amount_received: received,
+        change_given: change,
+        items: items.map(item => ({
+          product_id: item.id,
+          product_name: item.name,
+          quantity: item.quantity,
+          price_at_sale: item.sale_price,
+          cost_at_sale: item.cost_price
+        })),
+        date
       })
       
-      if (response.ok) {
-        const data = await response.json()
-        const change = data.change_given
-        
-        if (paymentMethod === 'cash' && change > 0) {
-          toast.success(`¡Venta completada! Cambio: ${user?.currency_symbol}${change.toFixed(2)}`)
-        } else {
-          toast.success('¡Venta completada exitosamente!')
+      // Reflect the sold units locally until the server confirms the sale
+      const localProducts = new Map(catalogRef.current.products)
+      items.forEach(item => {
+        const product = localProducts.get(item.id)
+        if (product) {
+          localProducts.set(item.id, { ...product, stock_quantity: product.stock_quantity - item.quantity })
         }
-        
-        // Store sale for printing
-        setLastSale(data)
-        
-        clearCart()
-        setIsPaymentDialogOpen(false)
-        setIsPrintDialogOpen(true)
-        fetchProducts() // Refresh to update stock
-      } else {
-        const data = await response.json()
-        toast.error(data.error || 'Error al procesar la venta')
-      }
+      })
+      catalogRef.current = { ...catalogRef.current, products: localProducts }
+      setCatalog(catalogRef.current)
+      
+      clearCart()
+      setIsPaymentDialogOpen(false)
+      setIsPrintDialogOpen(true)
+      syncPendingSales()
     } catch (error) {
-      toast.error('Error de conexión')
+      console.error('Error queueing sale:', error)
+      toast.error('Error al guardar la venta')
     } finally {
       setIsProcessing(false)
     }
@@ -185,8 +302,49 @@ export default function POSPage() {
         <div className="mb-6">
           <h1 className="text-3xl font-bold mb-2">Terminal de Venta</h1>
           <p className="text-muted-foreground">Escanea o busca productos para vender</p>
+          {pendingSalesCount > 0 && (
+            <Badge variant="secondary" className="mt-2">
+              {pendingSalesCount} {pendingSalesCount === 1 ? 'venta pendiente' : 'ventas pendientes'} de sincronizar
+            </Badge>
+          )}
         </div>
         
+        {rejectedSales.length > 0 && (
+          <Card className="mb-6 border-destructive">
+            <CardHeader>
+              <CardTitle className="flex items-center gap-2 text-destructive">
+                <AlertTriangle className="h-5 w-5" />
+                {rejectedSales.length === 1 ? 'Venta no registrada' : 'Ventas no registradas'}
+              </CardTitle>
+            </CardHeader>
+            <CardContent className="space-y-3">
+              {rejectedSales.map((sale) => (
+                <div key={sale.client_id} className="flex items-center justify-between gap-4">
+                  <div className="text-sm">
+                    <p className="font-semibold">
+                      #{sale.client_id.slice(0, 8).toUpperCase()} · {currency}{(sale.total_amount || 0).toFixed(2)} · {new Date(sale.date).toLocaleString()}
+                    </p>
+                    <p className="text-muted-foreground">
+                      {sale.items.map(item => `${item.quantity} x ${item.product_name || item.product_id}`).join(', ')}
+                    </p>
+                    <p className="text-destructive">{sale.error}</p>
+                  </div>
+                  <div className="flex gap-2">
+                    <Button size="sm" variant="outline" onClick={() => handleRetryRejectedSale(sale.client_id)}>
+                      <RotateCcw className="h-4 w-4 mr-1" />
+                      Reintentar
+                    </Button>
+                    <Button size="sm" variant="ghost" onClick={() => handleDiscardRejectedSale(sale.client_id)}>
+                      <Trash2 className="h-4 w-4 mr-1" />
+                      Descartar
+                    </Button>
+                  </div>
+                </div>
+              ))}
+            </CardContent>
+          </Card>
+        )}
+        
         <div className="grid lg:grid-cols-3 gap-6">
           {/* Left Side - Product Search and Grid */}
           <div className="lg:col-span-2 space-y-4">
@@ -17,7 +17,6 @@ import {
 } from '@/components/ui/table'
 import { Badge } from '@/components/ui/badge'
 import { FileText, Calendar, FileSpreadsheet } from 'lucide-react'
-import * as XLSX from 'xlsx'
 import { toast } from 'sonner'
 import { BarChart, Bar, LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts'
 
@@ -28,7 +27,7 @@ export default function ReportsPage() {
   const [isLoading, setIsLoading] = useState(true)
   const [startDate, setStartDate] = useState('')
   const [endDate, setEndDate] = useState('')
-  const [chartData, setChartData] = useState([])
+  const [analytics, setAnalytics] = useState(null)
   
   useEffect(() => {
     const checkAuth = async () => {
@@ -56,22 +55,28 @@ export default function ReportsPage() {
       if (endDate) params.append('end_date', endDate)
       if (params.toString()) url += `?${params.toString()}`
       
-      const response = await fetch(url)
-      if (response.ok) {
-        const data = await response.json()
-        setSales(data)
-        
-        // Process data for chart
-        const dateMap = {}
-        data.forEach(sale => {
-          const date = new Date(sale.date).toLocaleDateString('es-ES', { month: 'short', day: 'numeric' })
-          if (!dateMap[date]) {
-            dateMap[date] = { date, ventas: 0, ganancia: 0 }
-          }
-          dateMap[date].ventas += sale.total_amount
-          dateMap[date].ganancia += sale.profit
-        })
-        setChartData(Object.values(dateMap))
+      // Charts and totals are aggregated server-side over the whole range;
+      // the table below only lists the most recent sales
+      const analyticsParams = new URLSearchParams()
+      if (startDate) analyticsParams.append('from', startDate)
+      if (endDate) analyticsParams.append('to', endDate)
+      if (startDate && endDate) {
+        const days = (Date.parse(endDate) - Date.parse(startDate)) / 86400000
+        if (days > 180) analyticsParams.append('bucket', 'week')
+      }
+      
+      const [salesResponse, analyticsResponse] = await Promise.all([
+        fetch(url),
+        fetch(`/api/reports/analytics?${analyticsParams.toString()}`)
+      ])
+      if (salesResponse.ok) {
+        setSales(await salesResponse.json())
+      }
+      if (analyticsResponse.ok) {
+        setAnalytics(await analyticsResponse.json())
+      } else {
+        const data = await analyticsResponse.json()
+        toast.error(data.error || 'Error al cargar el análisis de ventas')
       }
     } catch (error) {
       console.error('Error fetching sales:', error)
@@ -81,88 +86,20 @@ export default function ReportsPage() {
   }
   
   const handleExportToExcel = () => {
-    if (sales.length === 0) {
-      toast.error('No hay datos para exportar')
-      return
-    }
+    // The server streams every matching sale as CSV, so exports are not
+    // limited to the sales loaded on this page
+    const params = new URLSearchParams()
+    if (startDate) params.append('start_date', startDate)
+    if (endDate) params.append('end_date', endDate)
     
-    try {
-      // Prepare data for Excel
-      const excelData = []
-      
-      sales.forEach((sale) => {
-        const saleDate = new Date(sale.date).toLocaleString('es-ES', {
-          year: 'numeric',
-          month: '2-digit',
-          day: '2-digit',
-          hour: '2-digit',
-          minute: '2-digit'
-        })
-        
-        const itemsList = sale.items.map(item => 
-          `${item.quantity}x ${item.product_name} (${currency}${item.price_at_sale.toFixed(2)})`
-        ).join(', ')
-        
-        excelData.push({
-          'Fecha': saleDate,
-          'Items Vendidos': itemsList,
-          'Cantidad de Items': sale.items.reduce((sum, item) => sum + item.quantity, 0),
-          'Método de Pago': sale.payment_method === 'cash' ? 'Efectivo' : 'Tarjeta',
-          'Total Venta': `${currency}${sale.total_amount.toFixed(2)}`,
-          'Ganancia': `${currency}${sale.profit.toFixed(2)}`,
-          'Monto Recibido': `${currency}${(sale.amount_received || sale.total_amount).toFixed(2)}`,
-          'Cambio': `${currency}${(sale.change_given || 0).toFixed(2)}`
-        })
-      })
-      
-      // Add summary row
-      excelData.push({
-        'Fecha': '',
-        'Items Vendidos': '',
-        'Cantidad de Items': '',
-        'Método de Pago': 'TOTAL',
-        'Total Venta': `${currency}${totalRevenue.toFixed(2)}`,
-        'Ganancia': `${currency}${totalProfit.toFixed(2)}`,
-        'Monto Recibido': '',
-        'Cambio': ''
-      })
-      
-      // Create worksheet
-      const ws = XLSX.utils.json_to_sheet(excelData)
-      
-      // Set column widths
-      ws['!cols'] = [
-        { wch: 20 }, // Fecha
-        { wch: 50 }, // Items
-        { wch: 15 }, // Cantidad
-        { wch: 15 }, // Método
-        { wch: 15 }, // Total
-        { wch: 15 }, // Ganancia
-        { wch: 15 }, // Recibido
-        { wch: 15 }  // Cambio
-      ]
-      
-      // Create workbook
-      const wb = XLSX.utils.book_new()
-      XLSX.utils.book_append_sheet(wb, ws, 'Ventas')
-      
-      // Generate filename with date range or current date
-      let filename = 'Reporte_Ventas'
-      if (startDate || endDate) {
-        filename += `_${startDate || 'inicio'}_${endDate || 'fin'}`
-      } else {
-        filename += `_${new Date().toISOString().split('T')[0]}`
-      }
-      filename += '.xlsx'
-      
-      // Download file
-      XLSX.writeFile(wb, filename)
-      
-      toast.success(`Archivo ${filename} descargado exitosamente`)
-    } catch (error) {
-      console.error('Error exporting to Excel:', error)
-      toast.error('Error al exportar a Excel')
-    }
+    const link = document.createElement('a')
+    link.href = `/api/export/sales${params.toString() ? `?${params.toString()}` : ''}`
+    link.download = ''
+    document.body.appendChild(link)
+    link.click()
+    link.remove()
+    
+    toast.success('Descarga del reporte iniciada')
   }
   
   useEffect(() => {
@@ -171,8 +108,13 @@ export default function ReportsPage() {
     }
   }, [user])
   
-  const totalRevenue = sales.reduce((sum, sale) => sum + sale.total_amount, 0)
-  const totalProfit = sales.reduce((sum, sale) => sum + sale.profit, 0)
+  const totals = analytics?.totals || { revenue: 0, profit: 0, sales_count: 0 }
+  const chartData = (analytics?.timeline || []).map(point => ({
+    date: new Date(point.start).toLocaleDateString('es-ES', { month: 'short', day: 'numeric' }),
+    ventas: point.revenue,
+    ganancia: point.profit
+  }))
+  const maxHeatmapCount = Math.max(1, ...(analytics?.heatmap.sales_count.flat() || []))
   const currency = user?.currency_symbol || '$'
   
   return (
@@ -229,7 +171,7 @@ export default function ReportsPage() {
         </Card>
         
         {/* Charts Section */}
-        {sales.length > 0 && chartData.length > 0 && (
+        {chartData.length > 0 && (
           <Card className="mb-6">
             <CardHeader>
               <CardTitle>Tendencia de Ventas</CardTitle>
@@ -262,7 +204,7 @@ export default function ReportsPage() {
               </CardTitle>
             </CardHeader>
             <CardContent>
-              <div className="text-2xl font-bold">{sales.length}</div>
+              <div className="text-2xl font-bold">{totals.sales_count}</div>
             </CardContent>
           </Card>
           
@@ -274,7 +216,7 @@ export default function ReportsPage() {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold">
-                {currency}{totalRevenue.toFixed(2)}
+                {currency}{totals.revenue.toFixed(2)}
               </div>
             </CardContent>
           </Card>
@@ -287,12 +229,97 @@ export default function ReportsPage() {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold text-green-600">
-                {currency}{totalProfit.toFixed(2)}
+                {currency}{totals.profit.toFixed(2)}
               </div>
             </CardContent>
           </Card>
         </div>
         
+        {/* Top Products and Categories */}
+        {analytics && analytics.top_by_units.length > 0 && (
+          <div className="grid gap-6 lg:grid-cols-2 mb-6">
+            <Card>
+              <CardHeader>
+                <CardTitle>Productos Más Vendidos</CardTitle>
+              </CardHeader>
+              <CardContent>
+                <Table>
+                  <TableHeader>
+                    <TableRow>
+                      <TableHead>Producto</TableHead>
+                      <TableHead>Unidades</TableHead>
+                      <TableHead>Ingresos</TableHead>
+                      <TableHead>Ganancia</TableHead>
+                    </TableRow>
+                  </TableHeader>
+                  <TableBody>
+                    {analytics.top_by_units.map((product) => (
+                      <TableRow key={product.product_id}>
+                        <TableCell>{product.name}</TableCell>
+                        <TableCell>{product.units}</TableCell>
+                        <TableCell>{currency}{product.revenue.toFixed(2)}</TableCell>
+                        <TableCell className="text-green-600">{currency}{product.profit.toFixed(2)}</TableCell>
+                      </TableRow>
+                    ))}
+                  </TableBody>
+                </Table>
+              </CardContent>
+            </Card>
+            
+            <Card>
+              <CardHeader>
+                <CardTitle>Ventas por Categoría</CardTitle>
+              </CardHeader>
+              <CardContent>
+                <ResponsiveContainer width="100%" height={300}>
+                  <BarChart data={analytics.categories} layout="vertical">
+                    <CartesianGrid strokeDasharray="3 3" stroke="#374151" />
+                    <XAxis type="number" stroke="#9ca3af" />
+                    <YAxis type="category" dataKey="category" stroke="#9ca3af" width={100} />
+                    <Tooltip 
+                      contentStyle={{ backgroundColor: '#1f2937', border: 'none', borderRadius: '8px' }}
+                      labelStyle={{ color: '#fff' }}
+                    />
+                    <Legend />
+                    <Bar dataKey="revenue" fill="#10b981" name="Ingresos" />
+                    <Bar dataKey="profit" fill="#3b82f6" name="Ganancia" />
+                  </BarChart>
+                </ResponsiveContainer>
+              </CardContent>
+            </Card>
+          </div>
+        )}
+        
+        {/* Hour of Week Heatmap */}
+        {analytics && totals.sales_count > 0 && (
+          <Card className="mb-6">
+            <CardHeader>
+              <CardTitle>Ventas por Día y Hora</CardTitle>
+            </CardHeader>
+            <CardContent className="overflow-x-auto">
+              <div className="grid gap-1 min-w-[640px]" style={{ gridTemplateColumns: 'auto repeat(24, minmax(0, 1fr))' }}>
+                <div />
+                {Array.from({ length: 24 }, (_, hour) => (
+                  <div key={hour} className="text-xs text-center text-muted-foreground">{hour}</div>
+                ))}
+                {['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom'].map((day, dayIndex) => (
+                  <div key={day} className="contents">
+                    <div className="text-xs text-muted-foreground pr-2">{day}</div>
+                    {analytics.heatmap.sales_count[dayIndex].map((count, hour) => (
+                      <div
+                        key={hour}
+                        className="h-6 rounded-sm bg-primary"
+                        style={{ opacity: count === 0 ? 0.05 : 0.15 + 0.85 * count / maxHeatmapCount }}
+                        title={`${day} ${hour}:00 - ${count} ventas, ${currency}${analytics.heatmap.revenue[dayIndex][hour].toFixed(2)}`}
+                      />
+                    ))}
+                  </div>
+                ))}
+              </div>
+            </CardContent>
+          </Card>
+        )}
+        
         {/* Sales Table */}
         <Card>
           <CardHeader>
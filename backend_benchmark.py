@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Load generation and latency benchmark for the POS backend.
+
+Provisions N tenants with M products each, then drives a concurrent mix of
+realistic POS traffic (barcode scans, type-ahead searches, multi-item sales,
+dashboard loads) and reports throughput and p50/p95/p99 latency per endpoint
+as JSON, so builds can be compared against each other.
+
+With --dataset it logs in to the tenants of a backend_dataset.py manifest
+instead, so the same traffic runs against years of generated history.
+
+Usage:
+    python backend_benchmark.py --base-url http://localhost:3000/api \\
+        --tenants 5 --products 200 --concurrency 16 --duration 30 \\
+        --output bench_results.json
+    python backend_benchmark.py --dataset dataset.json --concurrency 16 --duration 30
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import requests
+
+DEFAULT_BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000/api")
+
+# Relative weight of each workload in the traffic mix
+WORKLOAD_WEIGHTS = {
+    "barcode_scan": 40,
+    "search": 25,
+    "sale": 20,
+    "dashboard": 10,
+    "auth_me": 5,
+}
+
+SEARCH_WORDS = ["coca", "pan", "leche", "arroz", "agua", "jabon", "cafe", "galleta", "queso", "jugo"]
+CATEGORIES = ["Bebidas", "Panadería", "Lácteos", "Granos", "Limpieza", "Snacks"]
+
+# Workloads that pick a product from the tenant's catalog
+CATALOG_WORKLOADS = {"barcode_scan", "sale"}
+
+# Stock large enough that benchmark sales never run out
+PRODUCT_STOCK = 1_000_000
+# Dataset products with less stock than this are only scanned, not sold
+MIN_SELLABLE_STOCK = 100
+
+
+class Tenant:
+    """A registered store with its own authenticated session and catalog"""
+
+    def __init__(self, base_url, email):
+        self.base_url = base_url
+        self.email = email
+        self.session = requests.Session()
+        self.products = []
+        # Products the sale workload draws from
+        self.sellable = []
+
+    def request(self, method, endpoint, **kwargs):
+        return self.session.request(method, f"{self.base_url}{endpoint}", timeout=30, **kwargs)
+
+
+class LatencyRecorder:
+    """Thread-safe per-endpoint latency and error collection"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, name, elapsed_ms, ok):
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed_ms)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration_s):
+        endpoints = {}
+        with self.lock:
+            for name, samples in sorted(self.samples.items()):
+                ordered = sorted(samples)
+                endpoints[name] = {
+                    "count": len(ordered),
+                    "errors": self.errors.get(name, 0),
+                    "throughput_rps": round(len(ordered) / duration_s, 2),
+                    "mean_ms": round(sum(ordered) / len(ordered), 2),
+                    "p50_ms": round(percentile(ordered, 50), 2),
+                    "p95_ms": round(percentile(ordered, 95), 2),
+                    "p99_ms": round(percentile(ordered, 99), 2),
+                    "max_ms": round(ordered[-1], 2),
+                }
+        return endpoints
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def provision_tenant(base_url, run_id, index, product_count):
+    """Register a tenant and create its catalog"""
+    tenant = Tenant(base_url, f"bench-{run_id}-{index}@bench.local")
+    response = tenant.request("POST", "/auth/register", json={
+        "email": tenant.email,
+        "password": "BenchPass123!",
+        "store_name": f"Benchmark Store {index}",
+        "currency_symbol": "$",
+    })
+    response.raise_for_status()
+
+    rng = random.Random(f"{run_id}-{index}")
+    for product_index in range(product_count):
+        cost = round(rng.uniform(1, 50), 2)
+        response = tenant.request("POST", "/products", json={
+            "barcode": f"{index:03d}{product_index:07d}",
+            "name": f"{rng.choice(SEARCH_WORDS).capitalize()} {rng.choice(['Grande', 'Chico', 'Light', 'Familiar', 'Original'])} {product_index}",
+            "cost_price": cost,
+            "sale_price": round(cost * rng.uniform(1.2, 1.8), 2),
+            "stock_quantity": PRODUCT_STOCK,
+            "category": rng.choice(CATEGORIES),
+        })
+        response.raise_for_status()
+        tenant.products.append(response.json())
+    tenant.sellable = tenant.products
+    return tenant
+
+
+def load_dataset_tenant(base_url, entry):
+    """Log in to a tenant generated by backend_dataset.py and fetch its catalog"""
+    tenant = Tenant(base_url, entry["email"])
+    response = tenant.request("POST", "/auth/login", json={"email": entry["email"], "password": entry["password"]})
+    response.raise_for_status()
+
+    params = {"limit": 1000, "fields": "id,barcode,stock_quantity"}
+    while True:
+        response = tenant.request("GET", "/products", params=params)
+        response.raise_for_status()
+        tenant.products.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        params["after"] = cursor
+
+    # Sell only SKUs with room to sell, so the sale workload does not run out;
+    # with none left, sales still run and their stock errors are reported
+    tenant.sellable = [product for product in tenant.products if product["stock_quantity"] >= MIN_SELLABLE_STOCK]
+    if not tenant.sellable:
+        print(f"⚠️  {entry['email']} has no product with {MIN_SELLABLE_STOCK}+ units; sales will draw from the whole catalog", file=sys.stderr)
+        tenant.sellable = tenant.products
+    return tenant
+
+
+def run_workload(tenant, name, rng):
+    """Issue one request of the given workload; returns the HTTP response"""
+    if name == "barcode_scan":
+        product = rng.choice(tenant.products)
+        return tenant.request("GET", "/products", params={"barcode": product["barcode"]})
+    if name == "search":
+        word = rng.choice(SEARCH_WORDS)
+        # Type-ahead sends every prefix of the word
+        return tenant.request("GET", "/products", params={"search": word[:rng.randint(2, len(word))]})
+    if name == "sale":
+        basket = rng.sample(tenant.sellable, min(len(tenant.sellable), rng.randint(1, 8)))
+        return tenant.request("POST", "/sales", json={
+            "items": [{"product_id": product["id"], "quantity": rng.randint(1, 3)} for product in basket],
+            "payment_method": rng.choice(["cash", "card"]),
+        })
+    if name == "dashboard":
+        return tenant.request("GET", "/dashboard/stats")
+    if name == "auth_me":
+        return tenant.request("GET", "/auth/me")
+    raise ValueError(f"Unknown workload {name}")
+
+
+def worker(tenants, recorder, deadline, seed):
+    """Drive the weighted workload mix until the deadline"""
+    rng = random.Random(seed)
+    # Tenants with an empty catalog only take the workloads that need no product
+    stocked = [tenant for tenant in tenants if tenant.products]
+    names = [name for name in WORKLOAD_WEIGHTS if stocked or name not in CATALOG_WORKLOADS]
+    weights = [WORKLOAD_WEIGHTS[name] for name in names]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        tenant = rng.choice(stocked if name in CATALOG_WORKLOADS else tenants)
+        started = time.perf_counter()
+        try:
+            response = run_workload(tenant, name, rng)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        recorder.record(name, (time.perf_counter() - started) * 1000, ok)
+
+
+def run_benchmark(args):
+    run_id = uuid.uuid4().hex[:8]
+    if args.dataset:
+        with open(args.dataset, encoding="utf-8") as f:
+            entries = json.load(f)["tenants"]
+        print(f"🏗️  Logging in to {len(entries)} dataset tenants (run {run_id})", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=min(len(entries), args.concurrency)) as pool:
+            tenants = list(pool.map(lambda entry: load_dataset_tenant(args.base_url, entry), entries))
+    else:
+        print(f"🏗️  Provisioning {args.tenants} tenants x {args.products} products (run {run_id})", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=min(args.tenants, args.concurrency)) as pool:
+            futures = [
+                pool.submit(provision_tenant, args.base_url, run_id, index, args.products)
+                for index in range(args.tenants)
+            ]
+            tenants = [future.result() for future in as_completed(futures)]
+
+    print(f"🚀 Running {args.concurrency} workers for {args.duration}s", file=sys.stderr)
+    recorder = LatencyRecorder()
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    deadline = started + args.duration
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(worker, tenants, recorder, deadline, f"{run_id}-{i}") for i in range(args.concurrency)]:
+            future.result()
+
+    duration_s = time.perf_counter() - started
+    endpoints = recorder.summary(duration_s)
+    total_requests = sum(stats["count"] for stats in endpoints.values())
+
+    return {
+        "run_id": run_id,
+        "base_url": args.base_url,
+        "started_at": started_at.isoformat(),
+        "config": {
+            "tenants": len(tenants),
+            "products": args.products if not args.dataset else None,
+            "dataset": args.dataset,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "workload_weights": WORKLOAD_WEIGHTS,
+        },
+        "duration_s": round(duration_s, 2),
+        "total_requests": total_requests,
+        "total_errors": sum(stats["errors"] for stats in endpoints.values()),
+        "throughput_rps": round(total_requests / duration_s, 2),
+        "endpoints": endpoints,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="POS backend load and latency benchmark")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="API base URL (default: $BASE_URL or %(default)s)")
+    parser.add_argument("--tenants", type=int, default=5, help="Tenants to provision")
+    parser.add_argument("--products", type=int, default=200, help="Products per tenant")
+    parser.add_argument("--dataset", help="Use the tenants of a backend_dataset.py manifest instead of provisioning new ones")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent workers")
+    parser.add_argument("--duration", type=float, default=30, help="Measured run time in seconds")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        report = run_benchmark(args)
+    except KeyboardInterrupt:
+        print("\n\n⏹️  Benchmark interrupted by user", file=sys.stderr)
+        sys.exit(1)
+    except requests.RequestException as e:
+        print(f"\n\n💥 Benchmark failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"📋 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
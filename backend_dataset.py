@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic dataset generator for benchmarking the POS backend.
+
+Writes straight to MongoDB the documents the API would have produced over
+a long history: N tenants with M SKUs each, years of sales with realistic
+basket sizes, product popularity and time-of-day/day-of-week patterns, one
+cash register cycle per day (with expenses and withdrawals), and the
+matching sales_daily rollup. The same seed and end date always produce the
+same data; rerunning replaces the tenants of that seed.
+
+The tenants it creates (email, password, id and volumes) are written to a
+JSON manifest that backend_benchmark.py accepts with --dataset, so the
+benchmark runs against production-sized data instead of an empty store.
+
+Day keys and cash register cycles follow the store timezone, which must be
+the server's SALES_TIMEZONE: it is read from that variable, or given with
+--timezone when the variable is not set.
+
+Usage:
+    pip install -r requirements.txt
+    python backend_dataset.py --mongo-url mongodb://localhost:27017 --db-name cloudpos_db \\
+        --timezone America/Mexico_City \\
+        --tenants 3 --products 2000 --days 730 --sales-per-day 150 --output dataset.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+import uuid
+from datetime import date, datetime, time as day_time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+DEFAULT_MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DEFAULT_DB_NAME = os.environ.get("DB_NAME", "cloudpos_db")
+# No fallback: the server defaults to its own process timezone, which this
+# script cannot know, and a mismatch shifts every sales_daily day key
+DEFAULT_TIMEZONE = os.environ.get("SALES_TIMEZONE")
+
+PASSWORD = "SeedPass123!"
+# Same threshold as the API's low stock flag
+LOW_STOCK_THRESHOLD = 10
+
+PRODUCT_WORDS = [
+    "Café", "Leche", "Pan", "Arroz", "Frijol", "Azúcar", "Agua", "Refresco", "Jugo", "Galleta",
+    "Queso", "Yogur", "Jabón", "Detergente", "Atún", "Aceite", "Harina", "Huevo", "Cereal", "Chocolate",
+]
+BRANDS = ["Del Valle", "La Costeña", "Nutrisa", "Doña María", "Sol", "Montaña", "Andina", "Ñandú", "Estrella", "Campo Real"]
+SIZES = ["250g", "500g", "1kg", "355ml", "600ml", "1L", "2L", "Chico", "Grande", "Familiar"]
+CATEGORIES = ["Bebidas", "Panadería", "Lácteos", "Abarrotes", "Limpieza", "Snacks", "Enlatados"]
+EXPENSE_DESCRIPTIONS = ["Compra de hielo", "Pago de proveedor", "Artículos de limpieza", "Gas", "Reparaciones"]
+WITHDRAWAL_DESCRIPTIONS = ["Depósito bancario", "Retiro del dueño", "Cambio para otra caja"]
+
+# Share of a day's sales per local hour: the store opens at 8:00, closes at
+# 22:00 and peaks at lunch and after work
+HOUR_WEIGHTS = {
+    8: 3, 9: 5, 10: 6, 11: 7, 12: 9, 13: 11, 14: 9, 15: 6,
+    16: 5, 17: 6, 18: 9, 19: 11, 20: 8, 21: 5,
+}
+OPENING_HOUR = 7
+CLOSING_HOUR = 22
+# Traffic multiplier by weekday, Monday first
+WEEKDAY_FACTORS = [0.85, 0.9, 0.9, 0.95, 1.15, 1.35, 0.9]
+# Units per sale line
+QUANTITY_WEIGHTS = {1: 70, 2: 18, 3: 7, 4: 2, 5: 1, 6: 2}
+# Bills a cash customer pays with
+BILLS = [20, 50, 100, 200, 500, 1000]
+# Growth of daily traffic per year of history, and the December bump
+YEARLY_GROWTH = 0.12
+DECEMBER_FACTOR = 1.3
+CASH_SHARE = 0.6
+
+
+def normalize_text(text):
+    """Lowercase, accent-folded form of a string, as the API normalizes it"""
+    decomposed = unicodedata.normalize("NFD", str(text or ""))
+    return "".join(char for char in decomposed if not "\u0300" <= char <= "\u036f").lower()
+
+
+def tokenize_name(name):
+    """Distinct normalized word tokens of a product name (the API's search_tokens)"""
+    tokens = []
+    for token in re.split(r"[^a-z0-9]+", normalize_text(name)):
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def seeded_uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def money(value):
+    return round(value, 2)
+
+
+class DatasetWriter:
+    """Buffers documents per collection and inserts them in batches"""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, collection, document):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(document)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection=None):
+        for name in [collection] if collection else list(self.buffers):
+            buffer = self.buffers.get(name)
+            if buffer:
+                self.db[name].insert_many(buffer, ordered=False)
+                self.counts[name] = self.counts.get(name, 0) + len(buffer)
+                buffer.clear()
+
+
+def delete_tenant(db, email):
+    """Remove a tenant created by an earlier run, with all of its data"""
+    user = db.users.find_one({"email": email}, {"id": 1})
+    if not user:
+        return
+    for collection in ["products", "sales", "sales_daily", "sales_archive", "sales_archive_months",
+                       "cash_registers", "catalog_versions", "product_tombstones"]:
+        db[collection].delete_many({"user_id": user["id"]})
+    db.users.delete_one({"id": user["id"]})
+
+
+def build_products(rng, user_id, count, created_at):
+    products = []
+    for index in range(count):
+        cost = money(rng.uniform(5, 200))
+        # Most SKUs are well stocked; a few sit below the low stock threshold
+        stock = rng.randint(0, LOW_STOCK_THRESHOLD - 1) if rng.random() < 0.04 else rng.randint(100, 5000)
+        name = f"{rng.choice(PRODUCT_WORDS)} {rng.choice(BRANDS)} {rng.choice(SIZES)} {index}"
+        products.append({
+            "id": seeded_uuid(rng),
+            "user_id": user_id,
+            "barcode": f"75{index:06d}{rng.randrange(10 ** 5):05d}",
+            "name": name,
+            "cost_price": cost,
+            "sale_price": money(cost * rng.uniform(1.15, 1.8)),
+            "stock_quantity": stock,
+            "category": rng.choice(CATEGORIES),
+            "low_stock_alert": stock < LOW_STOCK_THRESHOLD,
+            "search_tokens": tokenize_name(name),
+            "created_at": created_at + timedelta(seconds=index),
+            "catalog_version": 1,
+        })
+    return products
+
+
+def daily_sales_target(rng, args, day, day_index):
+    """Expected sales of a day, with growth, weekday and season applied, plus noise"""
+    mean = args.sales_per_day * (1 + YEARLY_GROWTH) ** ((day_index - args.days) / 365)
+    mean *= WEEKDAY_FACTORS[day.weekday()]
+    if day.month == 12:
+        mean *= DECEMBER_FACTOR
+    return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+
+
+def build_sale(rng, user_id, products, popularity, sold_at):
+    basket_size = min(len(products), 1 + int(rng.expovariate(1 / 2.2)), 15)
+    chosen = {}
+    while len(chosen) < basket_size:
+        product = rng.choices(products, cum_weights=popularity)[0]
+        chosen[product["id"]] = product
+
+    items = []
+    total_amount = 0
+    total_cost = 0
+    for product in chosen.values():
+        quantity = rng.choices(list(QUANTITY_WEIGHTS), list(QUANTITY_WEIGHTS.values()))[0]
+        items.append({
+            "product_id": product["id"],
+            "product_name": product["name"],
+            "quantity": quantity,
+            "price_at_sale": product["sale_price"],
+            "cost_at_sale": product["cost_price"],
+        })
+        total_amount += product["sale_price"] * quantity
+        total_cost += product["cost_price"] * quantity
+
+    total_amount = money(total_amount)
+    payment_method = "cash" if rng.random() < CASH_SHARE else "card"
+    amount_received = total_amount
+    if payment_method == "cash":
+        bill = next((bill for bill in BILLS if bill >= total_amount), None)
+        amount_received = bill if bill and rng.random() < 0.7 else float(math.ceil(total_amount))
+    return {
+        "id": seeded_uuid(rng),
+        "user_id": user_id,
+        "total_amount": total_amount,
+        "profit": money(total_amount - total_cost),
+        "payment_method": payment_method,
+        "amount_received": amount_received,
+        "change_given": money(amount_received - total_amount),
+        "items": items,
+        "date": sold_at,
+    }
+
+
+def add_to_rollup(rollup, sale):
+    """Fold a sale into its day's sales_daily document"""
+    is_cash = sale["payment_method"] == "cash"
+    rollup["revenue"] = money(rollup["revenue"] + sale["total_amount"])
+    rollup["profit"] = money(rollup["profit"] + sale["profit"])
+    rollup["sales_count"] += 1
+    rollup["cash_revenue" if is_cash else "card_revenue"] = money(rollup["cash_revenue" if is_cash else "card_revenue"] + sale["total_amount"])
+    rollup["cash_count" if is_cash else "card_count"] += 1
+    for item in sale["items"]:
+        rollup["products"][item["product_id"]] = rollup["products"].get(item["product_id"], 0) + item["quantity"]
+
+
+def build_register_movements(rng, day_start, count, descriptions, low, high):
+    movements = []
+    for _ in range(count):
+        movements.append({
+            "id": seeded_uuid(rng),
+            "amount": money(rng.uniform(low, high)),
+            "description": rng.choice(descriptions),
+            "date": day_start + timedelta(hours=rng.uniform(OPENING_HOUR + 1, CLOSING_HOUR - 1)),
+        })
+    return sorted(movements, key=lambda movement: movement["date"])
+
+
+def build_cash_register(rng, user_id, email, day_start, cash_sales, card_sales, is_open):
+    """One register cycle: opened before the first sale, closed after the last"""
+    initial_cash = float(rng.choice([500, 1000, 1500, 2000]))
+    expenses = build_register_movements(rng, day_start, rng.choices([0, 1, 2, 3], [50, 30, 15, 5])[0], EXPENSE_DESCRIPTIONS, 50, 800)
+    withdrawals = build_register_movements(rng, day_start, rng.choices([0, 1, 2], [40, 45, 15])[0], WITHDRAWAL_DESCRIPTIONS, 500, 5000)
+    total_expenses = money(sum(expense["amount"] for expense in expenses))
+    total_withdrawals = money(sum(withdrawal["amount"] for withdrawal in withdrawals))
+    expected_cash = money(initial_cash + cash_sales - total_expenses - total_withdrawals)
+
+    register = {
+        "id": seeded_uuid(rng),
+        "user_id": user_id,
+        "opened_by": email,
+        "opened_at": day_start + timedelta(hours=OPENING_HOUR, minutes=rng.randint(30, 59)),
+        "closed_at": None,
+        "initial_cash": initial_cash,
+        "cash_sales": money(cash_sales),
+        "card_sales": money(card_sales),
+        "expenses": expenses,
+        "withdrawals": withdrawals,
+        "total_expenses": total_expenses,
+        "total_withdrawals": total_withdrawals,
+        "expected_cash": expected_cash,
+        "actual_cash": None,
+        "difference": None,
+        "difference_percentage": None,
+        "closing_notes": None,
+        "closing_photo_url": None,
+        "status": "open",
+    }
+    if not is_open:
+        # Most counts match; some are off by a few coins or a missing bill
+        difference = 0.0 if rng.random() < 0.8 else money(rng.choice([-1, 1]) * rng.choice([0.5, 1, 5, 10, 50, 100]))
+        register.update({
+            "closed_at": day_start + timedelta(hours=CLOSING_HOUR, minutes=rng.randint(0, 45)),
+            "actual_cash": money(expected_cash + difference),
+            "difference": difference,
+            "difference_percentage": difference / expected_cash * 100 if expected_cash > 0 else 0,
+            "status": "closed",
+        })
+    return register
+
+
+def generate_tenant(db, writer, args, index, zone, now):
+    rng = random.Random(f"{args.seed}-{index}")
+    email = f"seed-{args.seed}-{index}@bench.local"
+    delete_tenant(db, email)
+
+    first_day = args.end_date - timedelta(days=args.days - 1)
+    history_start = datetime.combine(first_day, day_time(), zone)
+    user = {
+        "id": seeded_uuid(rng),
+        "email": email,
+        "password": PASSWORD,
+        "store_name": f"Tienda Sintética {index}",
+        "currency_symbol": "$",
+        "created_at": history_start - timedelta(days=7),
+    }
+    db.users.insert_one(user)
+
+    products = build_products(rng, user["id"], args.products, user["created_at"])
+    db.products.insert_many(products, ordered=False)
+    db.catalog_versions.insert_one({"user_id": user["id"], "version": 1})
+
+    # Zipf-like popularity: a few SKUs sell far more often than the long tail
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(products))]
+    popularity = []
+    running = 0
+    for weight in rng.sample(weights, len(weights)):
+        running += weight
+        popularity.append(running)
+
+    hours = list(HOUR_WEIGHTS)
+    hour_weights = list(HOUR_WEIGHTS.values())
+    sales_count = 0
+    registers = 0
+    for day_index in range(args.days):
+        day = first_day + timedelta(days=day_index)
+        day_start = datetime.combine(day, day_time(), zone)
+        if day_start > now:
+            break
+
+        rollup = {"revenue": 0, "profit": 0, "sales_count": 0, "cash_revenue": 0, "card_revenue": 0,
+                  "cash_count": 0, "card_count": 0, "products": {}}
+        times = sorted(
+            day_start + timedelta(hours=rng.choices(hours, hour_weights)[0], seconds=rng.uniform(0, 3600))
+            for _ in range(daily_sales_target(rng, args, day, day_index))
+        )
+        for sold_at in times:
+            if sold_at > now:
+                break
+            sale = build_sale(rng, user["id"], products, popularity, sold_at.astimezone(timezone.utc))
+            writer.add("sales", sale)
+            add_to_rollup(rollup, sale)
+            sales_count += 1
+
+        if rollup["sales_count"] > 0:
+            writer.add("sales_daily", {
+                "user_id": user["id"],
+                "day": day.isoformat(),
+                **rollup,
+                "updated_at": now,
+            })
+        writer.add("cash_registers", build_cash_register(
+            rng, user["id"], email, day_start, rollup["cash_revenue"], rollup["card_revenue"],
+            is_open=day_start + timedelta(hours=CLOSING_HOUR) > now,
+        ))
+        registers += 1
+
+    writer.flush()
+    return {
+        "email": email,
+        "password": PASSWORD,
+        "user_id": user["id"],
+        "products": len(products),
+        "sales": sales_count,
+        "cash_registers": registers,
+    }
+
+
+def run_generator(args):
+    zone = ZoneInfo(args.timezone)
+    now = datetime.now(timezone.utc)
+    client = MongoClient(args.mongo_url)
+    db = client[args.db_name]
+    writer = DatasetWriter(db, args.batch_size)
+
+    started = time.perf_counter()
+    tenants = []
+    for index in range(args.tenants):
+        print(f"🏗️  Generating tenant {index + 1}/{args.tenants}", file=sys.stderr)
+        tenants.append(generate_tenant(db, writer, args, index, zone, now))
+    client.close()
+
+    return {
+        "seed": args.seed,
+        "db_name": args.db_name,
+        "generated_at": now.isoformat(),
+        "config": {
+            "tenants": args.tenants,
+            "products": args.products,
+            "days": args.days,
+            "end_date": args.end_date.isoformat(),
+            "sales_per_day": args.sales_per_day,
+            "timezone": args.timezone,
+        },
+        "duration_s": round(time.perf_counter() - started, 2),
+        "documents": writer.counts,
+        "tenants": tenants,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Seeded synthetic POS dataset generator (writes to MongoDB)")
+    parser.add_argument("--mongo-url", default=DEFAULT_MONGO_URL, help="MongoDB URL (default: $MONGO_URL or %(default)s)")
+    parser.add_argument("--db-name", default=DEFAULT_DB_NAME, help="Database name (default: $DB_NAME or %(default)s)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed; the same seed and end date reproduce the same data")
+    parser.add_argument("--tenants", type=int, default=3, help="Tenants to generate")
+    parser.add_argument("--products", type=int, default=2000, help="SKUs per tenant")
+    parser.add_argument("--days", type=int, default=730, help="Days of sales history")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date.today(),
+                        help="Last day of history, YYYY-MM-DD (default: today; sales after now are skipped)")
+    parser.add_argument("--sales-per-day", type=float, default=150, help="Average sales per tenant and day at the end of the history")
+    parser.add_argument("--timezone", default=DEFAULT_TIMEZONE, required=DEFAULT_TIMEZONE is None,
+                        help="The server's SALES_TIMEZONE, for day keys and opening hours (default: $SALES_TIMEZONE; required when unset)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents per insert_many")
+    parser.add_argument("--output", help="Write the tenants manifest to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        manifest = run_generator(args)
+    except KeyboardInterrupt:
+        print("\n\n⏹️  Generation interrupted by user", file=sys.stderr)
+        sys.exit(1)
+    except PyMongoError as e:
+        print(f"\n\n💥 Generation failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    output = json.dumps(manifest, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"📋 Manifest written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Concurrency-correctness stress test for stock and cash register counters.
+
+Creates a fresh tenant with a few SKUs and an open cash register, then fires
+hundreds of parallel sales (plus register expenses and withdrawals) against
+the same products and register. Afterwards it checks that final stock, the
+recorded sales and the register totals are exactly consistent with the
+requests the API acknowledged, and reports lost updates and oversells.
+
+Usage:
+    python backend_stress_test.py --base-url http://localhost:3000/api \\
+        --sales 300 --concurrency 32 --products 3 --stock 200
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000/api")
+
+# Money comparisons tolerate float rounding only
+TOLERANCE = 0.01
+
+
+def call(session, method, endpoint, **kwargs):
+    return session.request(method, f"{BASE_URL}{endpoint}", timeout=60, **kwargs)
+
+
+def setup_tenant(args):
+    """Register a tenant, create the contended SKUs and open a register"""
+    session = requests.Session()
+    run_id = uuid.uuid4().hex[:8]
+    response = call(session, "POST", "/auth/register", json={
+        "email": f"stress-{run_id}@bench.local",
+        "password": "StressPass123!",
+        "store_name": f"Stress Store {run_id}",
+    })
+    response.raise_for_status()
+
+    products = []
+    for index in range(args.products):
+        response = call(session, "POST", "/products", json={
+            "barcode": f"STRESS{run_id}{index}",
+            "name": f"Stress SKU {index}",
+            "cost_price": 4.0,
+            "sale_price": 10.0 + index,
+            "stock_quantity": args.stock,
+        })
+        response.raise_for_status()
+        products.append(response.json())
+
+    response = call(session, "POST", "/cash-register/open", json={"initial_cash": args.initial_cash})
+    response.raise_for_status()
+    return session, products, response.json()
+
+
+def build_operations(args, products):
+    """Randomized but reproducible mix of sales, expenses and withdrawals"""
+    rng = random.Random(args.seed)
+    operations = []
+    for _ in range(args.sales):
+        basket = rng.sample(products, rng.randint(1, len(products)))
+        operations.append(("sale", {
+            "items": [{"product_id": product["id"], "quantity": rng.randint(1, 3)} for product in basket],
+            "payment_method": rng.choice(["cash", "card"]),
+        }))
+    for kind, count in (("expense", args.expenses), ("withdrawal", args.withdrawals)):
+        for index in range(count):
+            operations.append((kind, {"amount": round(rng.uniform(1, 20), 2), "description": f"stress {kind} {index}"}))
+    rng.shuffle(operations)
+    return operations
+
+
+def execute(session, operation):
+    kind, payload = operation
+    endpoint = "/sales" if kind == "sale" else f"/cash-register/{kind}"
+    try:
+        response = call(session, "POST", endpoint, json=payload)
+        return kind, payload, response.status_code, response.json() if response.content else {}
+    except requests.RequestException as e:
+        return kind, payload, 0, {"error": str(e)}
+
+
+def fetch_all_sales(session):
+    sales = []
+    params = {"limit": 1000}
+    while True:
+        response = call(session, "GET", "/sales", params=params)
+        response.raise_for_status()
+        sales.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return sales
+        params = {"limit": 1000, "after": cursor}
+
+
+def verify(session, args, products, results):
+    """Compare server state with the acknowledged operations"""
+    problems = []
+    accepted_sales = [body for kind, _, status, body in results if kind == "sale" and status == 200]
+    rejected_sales = [body for kind, _, status, body in results if kind == "sale" and status != 200]
+    unexpected = [(kind, status, body) for kind, _, status, body in results if status not in (200, 400)]
+    accepted_expenses = [payload for kind, payload, status, _ in results if kind == "expense" and status == 200]
+    accepted_withdrawals = [payload for kind, payload, status, _ in results if kind == "withdrawal" and status == 200]
+
+    for kind, status, body in unexpected:
+        problems.append(f"{kind} returned unexpected status {status}: {body}")
+
+    # Stock: initial minus units of every acknowledged sale, never negative
+    sold_units = {product["id"]: 0 for product in products}
+    for sale in accepted_sales:
+        for item in sale["items"]:
+            sold_units[item["product_id"]] += item["quantity"]
+
+    response = call(session, "GET", "/products")
+    response.raise_for_status()
+    stock = {product["id"]: product["stock_quantity"] for product in response.json()}
+    oversells = []
+    lost_stock_updates = []
+    for product in products:
+        expected = args.stock - sold_units[product["id"]]
+        actual = stock.get(product["id"])
+        if actual is not None and actual < 0:
+            oversells.append({"product_id": product["id"], "stock": actual})
+        if actual != expected:
+            lost_stock_updates.append({"product_id": product["id"], "expected": expected, "actual": actual})
+    for item in oversells:
+        problems.append(f"Oversold {item['product_id']}: stock {item['stock']}")
+    for item in lost_stock_updates:
+        problems.append(f"Stock mismatch for {item['product_id']}: expected {item['expected']}, got {item['actual']}")
+
+    # Sales: exactly the acknowledged sales were recorded
+    recorded = {sale["id"]: sale for sale in fetch_all_sales(session)}
+    missing_sales = [sale["id"] for sale in accepted_sales if sale["id"] not in recorded]
+    if missing_sales:
+        problems.append(f"{len(missing_sales)} acknowledged sales missing from /sales")
+    if len(recorded) != len(accepted_sales):
+        problems.append(f"/sales has {len(recorded)} sales, {len(accepted_sales)} were acknowledged")
+    recorded_total = sum(sale["total_amount"] for sale in recorded.values())
+    accepted_total = sum(sale["total_amount"] for sale in accepted_sales)
+    if abs(recorded_total - accepted_total) > TOLERANCE:
+        problems.append(f"Sales total mismatch: recorded {recorded_total:.2f}, acknowledged {accepted_total:.2f}")
+
+    # Register: running totals match the acknowledged events
+    response = call(session, "GET", "/cash-register/current")
+    response.raise_for_status()
+    register = response.json()
+    expected_register = {
+        "cash_sales": sum(sale["total_amount"] for sale in accepted_sales if sale["payment_method"] == "cash"),
+        "card_sales": sum(sale["total_amount"] for sale in accepted_sales if sale["payment_method"] != "cash"),
+        "expenses": sum(payload["amount"] for payload in accepted_expenses),
+        "withdrawals": sum(payload["amount"] for payload in accepted_withdrawals),
+    }
+    expected_register["expected_cash"] = (
+        args.initial_cash + expected_register["cash_sales"]
+        - expected_register["expenses"] - expected_register["withdrawals"]
+    )
+    actual_register = {
+        "cash_sales": register.get("cash_sales", 0),
+        "card_sales": register.get("card_sales", 0),
+        "expenses": sum(expense["amount"] for expense in register.get("expenses", [])),
+        "withdrawals": sum(withdrawal["amount"] for withdrawal in register.get("withdrawals", [])),
+        "expected_cash": register.get("expected_cash", 0),
+    }
+    lost_register_updates = {
+        field: {"expected": round(expected_register[field], 2), "actual": round(actual_register[field], 2)}
+        for field in expected_register
+        if abs(expected_register[field] - actual_register[field]) > TOLERANCE
+    }
+    for field, values in lost_register_updates.items():
+        problems.append(f"Register {field} mismatch: expected {values['expected']}, got {values['actual']}")
+
+    return {
+        "operations": len(results),
+        "sales_accepted": len(accepted_sales),
+        "sales_rejected": len(rejected_sales),
+        "expenses_accepted": len(accepted_expenses),
+        "withdrawals_accepted": len(accepted_withdrawals),
+        "oversells": oversells,
+        "lost_stock_updates": lost_stock_updates,
+        "missing_sales": missing_sales,
+        "lost_register_updates": lost_register_updates,
+        "consistent": not problems,
+        "problems": problems,
+    }
+
+
+def run_stress_test(args):
+    session, products, _ = setup_tenant(args)
+    operations = build_operations(args, products)
+    print(f"🔥 Firing {len(operations)} operations with {args.concurrency} workers", file=sys.stderr)
+
+    # Each worker reuses the tenant's cookies through its own session
+    cookies = session.cookies.get_dict()
+
+    def run(operation):
+        worker_session = requests.Session()
+        worker_session.cookies.update(cookies)
+        return execute(worker_session, operation)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(run, operations))
+
+    return verify(session, args, products, results)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrency-correctness stress test for sales and cash register")
+    parser.add_argument("--base-url", default=BASE_URL, help="API base URL (default: $BASE_URL or %(default)s)")
+    parser.add_argument("--sales", type=int, default=300, help="Parallel sales to fire")
+    parser.add_argument("--expenses", type=int, default=30, help="Parallel register expenses to fire")
+    parser.add_argument("--withdrawals", type=int, default=30, help="Parallel register withdrawals to fire")
+    parser.add_argument("--products", type=int, default=3, help="Contended SKUs")
+    parser.add_argument("--stock", type=int, default=200, help="Initial stock per SKU (lower it to force stock-outs)")
+    parser.add_argument("--initial-cash", type=float, default=1000.0, help="Register opening cash")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent workers")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the operation mix")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    BASE_URL = args.base_url
+    try:
+        report = run_stress_test(args)
+    except KeyboardInterrupt:
+        print("\n\n⏹️  Stress test interrupted by user", file=sys.stderr)
+        sys.exit(1)
+    except requests.RequestException as e:
+        print(f"\n\n💥 Stress test failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if report["consistent"]:
+        print("🎉 Stock, sales and register totals are consistent", file=sys.stderr)
+    else:
+        print(f"❌ {len(report['problems'])} consistency problems found", file=sys.stderr)
+    sys.exit(0 if report["consistent"] else 1)
@@ -5,12 +5,17 @@ Tests all backend API endpoints following the testing requirements.
 """
 
 import requests
+import csv
+import io
 import json
-from datetime import datetime
+import os
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
 import time
 
-# Configuration
-BASE_URL = "https://cloud-pos-system-1.preview.emergentagent.com/api"
+# Configuration (override with BASE_URL=http://localhost:3000/api to test a local instance)
+BASE_URL = os.environ.get("BASE_URL", "https://cloud-pos-system-1.preview.emergentagent.com/api")
 session = requests.Session()
 
 # Test data
@@ -60,6 +65,68 @@ def make_request(method, endpoint, data=None, expect_status=200):
         print(f"  → Request failed: {str(e)}")
         return None, 0
 
+def raw_request(method, endpoint, **kwargs):
+    """HTTP request returning the full response, for checks on status and headers"""
+    response = session.request(method, f"{BASE_URL}{endpoint}", timeout=30, **kwargs)
+    print(f"  → {method.upper()} {endpoint}")
+    print(f"  → Status: {response.status_code}")
+    return response
+
+def walk_pages(endpoint, limit):
+    """Follow X-Next-Cursor from the first page to the last.
+    Returns (documents, X-Total-Count of the first page), or None on an error status"""
+    documents = []
+    total = None
+    params = {"limit": limit}
+    while True:
+        response = raw_request("GET", endpoint, params=params)
+        if response.status_code != 200:
+            return None
+        page = response.json()
+        if len(page) > limit:
+            print(f"  ❌ Page of {len(page)} documents exceeds limit {limit}")
+            return None
+        documents.extend(page)
+        if total is None:
+            total = int(response.headers.get("X-Total-Count", -1))
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return documents, total
+        params["after"] = cursor
+
+def check_pagination(endpoint, fields, excluded_field):
+    """Shared pagination contract of product and sale listings"""
+    walked = walk_pages(endpoint, 1)
+    if walked is None:
+        return "Paging with limit=1 failed"
+    documents, total = walked
+    ids = [document.get("id") for document in documents]
+    if len(set(ids)) != len(ids):
+        return "Cursor pages repeat documents"
+    if total != len(documents):
+        return f"X-Total-Count is {total} but the pages returned {len(documents)} documents"
+    print(f"  ✅ {len(documents)} documents in pages of 1, matching X-Total-Count")
+    
+    response = raw_request("GET", endpoint, params={"limit": 2, "fields": ",".join(fields)})
+    if response.status_code != 200:
+        return f"fields projection returned {response.status_code}"
+    if any(excluded_field in document for document in response.json()):
+        return f"fields projection still returns {excluded_field}"
+    if any("id" not in document for document in response.json()):
+        return "fields projection dropped the id"
+    print("  ✅ fields projection works")
+    
+    for params, problem in [
+        ({"limit": 2, "after": "not-a-cursor"}, "an invalid cursor"),
+        ({"fields": "id,password"}, "an unknown field"),
+        ({"limit": 0}, "limit=0"),
+    ]:
+        response = raw_request("GET", endpoint, params=params)
+        if response.status_code != 400:
+            return f"Expected 400 for {problem}, got {response.status_code}"
+    print("  ✅ Invalid cursor, field and limit are rejected with 400")
+    return None
+
 def test_auth_register():
     """Test user registration"""
     print("🔐 Testing Authentication - Register")
@@ -210,6 +277,9 @@ def test_products_list():
             print("  ✅ Search by name works")
         else:
             print("  ❌ Search by name failed")
+        if any("catalog_version" in p or "search_tokens" in p for p in result):
+            log_test_result("List & Search Products", False, "Search results leak internal fields")
+            return False
     
     # Test search by barcode
     result, status = make_request("GET", "/products?barcode=123456", expect_status=200)
@@ -219,9 +289,28 @@ def test_products_list():
         else:
             print("  ❌ Search by barcode failed")
     
+    # Projection and paging apply to barcode lookups too
+    result, status = make_request("GET", "/products?barcode=123456&fields=id,barcode&limit=1", expect_status=200)
+    if result is not None and len(result) == 1 and set(result[0]) == {"id", "barcode"}:
+        print("  ✅ Barcode lookup honors fields and limit")
+    else:
+        log_test_result("List & Search Products", False, f"Barcode lookup ignored fields/limit: {result}")
+        return False
+    
     log_test_result("List & Search Products", True, "All product listing tests passed")
     return True
 
+def test_products_pagination():
+    """Test cursor pagination, field projection and total count of the product listing"""
+    print("📦 Testing Products - Pagination")
+    
+    problem = check_pagination("/products", ["id", "name"], "cost_price")
+    if problem:
+        log_test_result("Products Pagination", False, problem)
+        return False
+    log_test_result("Products Pagination", True, "limit/after, fields and X-Total-Count work")
+    return True
+
 def test_products_update():
     """Test updating a product"""
     print("📦 Testing Products - Update")
@@ -248,6 +337,161 @@ def test_products_update():
         log_test_result("Update Product", False, f"Status: {status}")
         return False
 
+def test_product_changes():
+    """Test catalog deltas (/products/changes) and ETag revalidation of the product listing"""
+    print("📦 Testing Products - Catalog Changes & ETag")
+    
+    result, status = make_request("GET", "/products/changes?since=0", expect_status=200)
+    if result is None or not result.get("full"):
+        log_test_result("Catalog Changes", False, "since=0 did not return the full catalog")
+        return False
+    if not {p['id'] for p in created_products} <= {p['id'] for p in result.get("changed", [])}:
+        log_test_result("Catalog Changes", False, "Full resync is missing created products")
+        return False
+    version = result["version"]
+    print(f"  ✅ Full resync at version {version}")
+    
+    result, status = make_request("GET", f"/products/changes?since={version + 1000}", expect_status=200)
+    if result is None or not result.get("full"):
+        log_test_result("Catalog Changes", False, "A version the server never issued did not force a full resync")
+        return False
+    print("  ✅ Unknown version forces a full resync")
+    
+    etags = {}
+    for endpoint in ["/products", "/products?barcode=123456", "/products?search=coca", "/products?limit=2"]:
+        response = raw_request("GET", endpoint)
+        etag = response.headers.get("ETag")
+        if response.status_code != 200 or not etag:
+            log_test_result("Catalog Changes", False, f"{endpoint} returned no ETag")
+            return False
+        response = raw_request("GET", endpoint, headers={"If-None-Match": etag})
+        if response.status_code != 304 or response.content:
+            log_test_result("Catalog Changes", False, f"{endpoint} with its ETag returned {response.status_code}, expected an empty 304")
+            return False
+        etags[endpoint] = etag
+    print("  ✅ Unchanged listings revalidate with 304")
+    
+    # A write and a deletion show up as a delta after the version held
+    arroz = next((p for p in created_products if p.get('name') == "Arroz"), None)
+    temporary, status = make_request("POST", "/products", {
+        "barcode": "555000",
+        "name": "Producto Temporal",
+        "cost_price": 1.0,
+        "sale_price": 2.0,
+        "stock_quantity": 1,
+        "category": "General"
+    }, 200)
+    if not arroz or temporary is None:
+        log_test_result("Catalog Changes", False, "Could not prepare the catalog writes")
+        return False
+    result, status = make_request("GET", "/products/changes?since=0", expect_status=200)
+    if result is None:
+        log_test_result("Catalog Changes", False, f"Status: {status}")
+        return False
+    version = result["version"]
+    
+    updated, _ = make_request("PUT", f"/products/{arroz['id']}", {
+        "name": arroz['name'],
+        "cost_price": arroz['cost_price'],
+        "sale_price": arroz['sale_price'],
+        "stock_quantity": arroz['stock_quantity'],
+        "category": "Granos y Cereales"
+    }, 200)
+    deleted, _ = make_request("DELETE", f"/products/{temporary['id']}", expect_status=200)
+    if updated is None or deleted is None:
+        log_test_result("Catalog Changes", False, "Could not write to the catalog")
+        return False
+    
+    result, status = make_request("GET", f"/products/changes?since={version}", expect_status=200)
+    if result is None or result.get("full") or result.get("version", 0) <= version:
+        log_test_result("Catalog Changes", False, f"Expected a delta past version {version}, got {result}")
+        return False
+    if [p['id'] for p in result.get("changed", [])] != [arroz['id']] or result.get("deleted") != [temporary['id']]:
+        log_test_result("Catalog Changes", False, f"Delta does not match the writes: {result}")
+        return False
+    print("  ✅ Delta holds exactly the updated product and the deleted id")
+    
+    response = raw_request("GET", "/products", headers={"If-None-Match": etags["/products"]})
+    if response.status_code != 200 or response.headers.get("ETag") == etags["/products"]:
+        log_test_result("Catalog Changes", False, "Listing still revalidated after the catalog changed")
+        return False
+    print("  ✅ A changed catalog returns 200 with a new ETag")
+    
+    log_test_result("Catalog Changes", True, "Deltas, full resyncs and ETag revalidation work")
+    return True
+
+def test_products_import():
+    """Test bulk import: upsert by barcode, per-row errors and idempotent re-imports"""
+    print("📦 Testing Products - Import")
+    
+    rows = [
+        {"barcode": "IMP-001", "name": "Galletas", "sale_price": 12.5, "stock_quantity": 10},
+        {"barcode": "IMP-002", "name": "Jugo", "sale_price": "9,90", "category": "Bebidas"},
+        {"barcode": "901234", "category": "Granos"},
+        {"name": "Sin código", "sale_price": 5},
+        {"barcode": "IMP-003", "name": "Precio negativo", "sale_price": -1},
+        {"barcode": "IMP-004", "stock_quantity": 3},
+        {"barcode": "IMP-001", "name": "Galletas repetidas", "sale_price": 13}
+    ]
+    
+    def check_report(report, created, updated):
+        if report is None:
+            return "Import request failed"
+        counts = (report.get("processed"), report.get("created"), report.get("updated"), report.get("failed"))
+        if counts != (7, created, updated, 4):
+            return f"Expected processed/created/updated/failed {(7, created, updated, 4)}, got {counts}"
+        failed_rows = sorted(error.get("row") for error in report.get("errors", []))
+        if failed_rows != [4, 5, 6, 7]:
+            return f"Expected errors on rows 4-7, got {failed_rows}"
+        return None
+    
+    report, status = make_request("POST", "/products/import", rows, 200)
+    problem = check_report(report, 2, 1)
+    if problem:
+        log_test_result("Import Products", False, problem)
+        return False
+    print("  ✅ New barcodes created, existing barcode updated, bad rows reported by number")
+    
+    report, status = make_request("POST", "/products/import", rows, 200)
+    problem = check_report(report, 0, 3)
+    if problem:
+        log_test_result("Import Products", False, f"Re-import: {problem}")
+        return False
+    result, status = make_request("GET", "/products?barcode=IMP-001", expect_status=200)
+    if result is None or len(result) != 1 or result[0].get("stock_quantity") != 10:
+        log_test_result("Import Products", False, f"Re-import duplicated or changed IMP-001: {result}")
+        return False
+    print("  ✅ Re-importing the same file updates in place without duplicates")
+    
+    result, status = make_request("GET", "/products?barcode=901234", expect_status=200)
+    if result is None or len(result) != 1 or result[0].get("category") != "Granos" or result[0].get("stock_quantity") != 30:
+        log_test_result("Import Products", False, f"Partial row did not update only its columns: {result}")
+        return False
+    print("  ✅ A partial row only writes its columns")
+    
+    # CSV with the inventory export headers
+    csv_body = "Código de Barras,Nombre,Precio Venta,Stock\nIMP-005,Café,45.00,20\n".encode("utf-8")
+    outcomes = []
+    for _ in range(2):
+        response = raw_request("POST", "/products/import", data=csv_body, headers={"Content-Type": "text/csv"})
+        if response.status_code != 200:
+            log_test_result("Import Products", False, f"CSV import returned {response.status_code}")
+            return False
+        report = response.json()
+        outcomes.append((report.get("created"), report.get("updated"), report.get("failed")))
+    if outcomes != [(1, 0, 0), (0, 1, 0)]:
+        log_test_result("Import Products", False, f"CSV import counts {outcomes}, expected created then updated")
+        return False
+    print("  ✅ CSV import with export headers is idempotent")
+    
+    response = raw_request("POST", "/products/import", data="nombre,stock\nCafé,1\n".encode("utf-8"), headers={"Content-Type": "text/csv"})
+    if response.status_code != 400:
+        log_test_result("Import Products", False, f"CSV without barcode column returned {response.status_code}")
+        return False
+    
+    log_test_result("Import Products", True, "Upserts, row errors and re-imports work for JSON and CSV")
+    return True
+
 def test_sales_create():
     """Test creating a sale - CRITICAL FEATURE"""
     print("💰 Testing Sales - Create (CORE FEATURE)")
@@ -395,6 +639,245 @@ def test_sales_list():
         log_test_result("List Sales", False, f"Status: {status}")
         return False
 
+def test_sales_pagination():
+    """Test cursor pagination, field projection and total count of the sales listing"""
+    print("💰 Testing Sales - Pagination")
+    
+    problem = check_pagination("/sales", ["id", "total_amount"], "items")
+    if problem:
+        log_test_result("Sales Pagination", False, problem)
+        return False
+    log_test_result("Sales Pagination", True, "limit/after, fields and X-Total-Count work")
+    return True
+
+def product_stock():
+    """Current stock per product id, or None when the listing fails"""
+    result, status = make_request("GET", "/products", expect_status=200)
+    if result is None:
+        return None
+    return {product["id"]: product["stock_quantity"] for product in result}
+
+def test_sales_batch():
+    """Test offline sale sync: per-sale outcomes, terminal prices and idempotent replays"""
+    print("💰 Testing Sales - Offline Batch")
+    
+    leche = next((p for p in created_products if p.get('name') == "Leche"), None)
+    pan = next((p for p in created_products if p.get('name') == "Pan"), None)
+    if not leche or not pan:
+        log_test_result("Sales Batch", False, "Required products not found")
+        return False
+    
+    stock_before = product_stock()
+    if stock_before is None:
+        log_test_result("Sales Batch", False, "Could not fetch products")
+        return False
+    
+    # Charged offline at a price the catalog no longer has
+    offline_sale = {
+        "client_id": str(uuid.uuid4()),
+        "items": [{"product_id": leche['id'], "quantity": 2, "price_at_sale": 28.0}],
+        "total_amount": 56.0,
+        "payment_method": "cash",
+        "amount_received": 60.0,
+        "date": datetime.now().isoformat()
+    }
+    oversold_sale = {
+        "client_id": str(uuid.uuid4()),
+        "items": [{"product_id": pan['id'], "quantity": 1000}],
+        "payment_method": "cash"
+    }
+    plain_sale = {
+        "client_id": str(uuid.uuid4()),
+        "items": [{"product_id": leche['id'], "quantity": 1}],
+        "payment_method": "card"
+    }
+    
+    result, status = make_request("POST", "/sales/batch", {"sales": [offline_sale, oversold_sale, plain_sale]}, 200)
+    if result is None:
+        log_test_result("Sales Batch", False, f"Status: {status}")
+        return False
+    
+    statuses = [entry.get("status") for entry in result.get("results", [])]
+    if statuses != ["created", "rejected", "created"]:
+        log_test_result("Sales Batch", False, f"Expected created/rejected/created, got {statuses}")
+        return False
+    print("  ✅ A rejected sale does not affect the rest of the batch")
+    
+    offline_result, _, plain_result = result["results"]
+    if abs(offline_result["sale"]["total_amount"] - 56.0) > 0.01:
+        log_test_result("Sales Batch", False, f"Offline price not kept: total {offline_result['sale']['total_amount']}")
+        return False
+    if abs(plain_result["sale"]["total_amount"] - leche['sale_price']) > 0.01:
+        log_test_result("Sales Batch", False, "Unpriced line not charged at the catalog price")
+        return False
+    print("  ✅ Lines keep the terminal's price_at_sale; unpriced lines use the catalog price")
+    
+    stock_after = product_stock()
+    if stock_after is None or stock_after[leche['id']] != stock_before[leche['id']] - 3 or stock_after[pan['id']] != stock_before[pan['id']]:
+        log_test_result("Sales Batch", False, "Stock does not match the created sales")
+        return False
+    print("  ✅ Only the created sales took stock")
+    
+    # A terminal that lost the response sends the same sale again
+    result, status = make_request("POST", "/sales/batch", {"sales": [offline_sale, offline_sale]}, 200)
+    if result is None:
+        log_test_result("Sales Batch", False, f"Replay status: {status}")
+        return False
+    for entry in result.get("results", []):
+        if entry.get("status") != "duplicate" or (entry.get("sale") or {}).get("id") != offline_sale["client_id"]:
+            log_test_result("Sales Batch", False, f"Replay not reported as the recorded sale: {entry}")
+            return False
+    if product_stock() != stock_after:
+        log_test_result("Sales Batch", False, "Replaying the batch took stock again")
+        return False
+    print("  ✅ Replaying a client_id returns the recorded sale without selling twice")
+    
+    # Malformed prices and totals are rejected per sale
+    bad_price = {**offline_sale, "client_id": str(uuid.uuid4()), "items": [{"product_id": leche['id'], "quantity": 1, "price_at_sale": -1}]}
+    bad_total = {**offline_sale, "client_id": str(uuid.uuid4()), "total_amount": 99.0}
+    result, status = make_request("POST", "/sales/batch", {"sales": [bad_price, bad_total]}, 200)
+    if result is None or [entry.get("status") for entry in result.get("results", [])] != ["rejected", "rejected"]:
+        log_test_result("Sales Batch", False, "Invalid price_at_sale or total_amount accepted")
+        return False
+    print("  ✅ Invalid price_at_sale and mismatched total_amount are rejected")
+    
+    for payload in ["null", "[]", "{not json"]:
+        response = raw_request("POST", "/sales/batch", data=payload, headers={"Content-Type": "application/json"})
+        if response.status_code != 400:
+            log_test_result("Sales Batch", False, f"Body {payload!r} returned {response.status_code}, expected 400")
+            return False
+    print("  ✅ Malformed batch bodies are rejected with 400")
+    
+    log_test_result("Sales Batch", True, "Per-sale outcomes, offline prices and idempotent replays work")
+    return True
+
+def test_sales_daily():
+    """Test the daily rollup and its rebuild against the recorded sales"""
+    print("💰 Testing Sales - Daily Rollup")
+    
+    def daily_totals():
+        days, _ = make_request("GET", "/sales/daily", expect_status=200)
+        if days is None:
+            return None
+        return [{key: value for key, value in day.items() if key != "updated_at"} for day in days]
+    
+    before = daily_totals()
+    walked = walk_pages("/sales", 100)
+    if before is None or walked is None:
+        log_test_result("Sales Daily", False, "Could not read the rollup or the sales")
+        return False
+    sales, total = walked
+    
+    counted = sum(day.get("sales_count", 0) for day in before)
+    revenue = sum(day.get("revenue", 0) for day in before)
+    if counted != total or abs(revenue - sum(sale["total_amount"] for sale in sales)) > 0.01:
+        log_test_result("Sales Daily", False, f"Rollup has {counted} sales / ${revenue}, listing has {total}")
+        return False
+    print(f"  ✅ Rollup matches the {total} recorded sales")
+    
+    result, status = make_request("GET", "/sales/daily?from=2024-1-1", expect_status=400)
+    if status != 400:
+        log_test_result("Sales Daily", False, f"Malformed date returned {status}")
+        return False
+    
+    # Twice: the rebuild must also work once the rollup already exists
+    for attempt in range(2):
+        result, status = make_request("POST", "/sales/daily/rebuild", expect_status=200)
+        if result is None or result.get("days") != len(before):
+            log_test_result("Sales Daily", False, f"Rebuild {attempt + 1} returned {status}: {result}")
+            return False
+        if daily_totals() != before:
+            log_test_result("Sales Daily", False, "Rebuilt rollup differs from the incremental one")
+            return False
+    print("  ✅ Rebuild reproduces the incremental rollup")
+    
+    log_test_result("Sales Daily", True, "Daily rollup and rebuild match the recorded sales")
+    return True
+
+def test_sales_archive():
+    """Test that archiving old sales keeps the listing, its total and the daily rollup unchanged"""
+    print("💰 Testing Sales - Archive")
+    
+    result, status = make_request("GET", "/sales/archive", expect_status=200)
+    if result is None:
+        log_test_result("Sales Archive", False, f"Status: {status}")
+        return False
+    retention_days = result.get("retention_days", 0)
+    
+    if retention_days <= 0:
+        result, status = make_request("POST", "/sales/archive", expect_status=409)
+        if status != 409:
+            log_test_result("Sales Archive", False, f"Archiving ran while disabled (status {status})")
+            return False
+        log_test_result("Sales Archive", True, "Archiving disabled (SALES_RETENTION_DAYS=0); start the server with it set to test the archive")
+        return True
+    
+    leche = next((p for p in created_products if p.get('name') == "Leche"), None)
+    if not leche:
+        log_test_result("Sales Archive", False, "Required product not found")
+        return False
+    
+    # Sales recorded offline long ago are already past the retention window
+    old_date = datetime.now() - timedelta(days=retention_days + 40)
+    old_sales = [{
+        "client_id": str(uuid.uuid4()),
+        "items": [{"product_id": leche['id'], "quantity": 1}],
+        "payment_method": "cash",
+        "date": (old_date + timedelta(hours=index)).isoformat()
+    } for index in range(3)]
+    result, status = make_request("POST", "/sales/batch", {"sales": old_sales}, 200)
+    if result is None or any(entry.get("status") != "created" for entry in result.get("results", [])):
+        log_test_result("Sales Archive", False, "Could not record the old sales")
+        return False
+    
+    day_range = f"/sales/daily?from={(old_date - timedelta(days=2)):%Y-%m-%d}&to={(old_date + timedelta(days=2)):%Y-%m-%d}"
+    
+    def daily_totals():
+        days, _ = make_request("GET", day_range, expect_status=200)
+        if days is None:
+            return None
+        return [{key: value for key, value in day.items() if key != "updated_at"} for day in days]
+    
+    def snapshot():
+        walked = walk_pages("/sales", 5)
+        daily = daily_totals()
+        if walked is None or daily is None:
+            return None
+        documents, total = walked
+        return [document["id"] for document in documents], total, daily
+    
+    before = snapshot()
+    if before is None:
+        log_test_result("Sales Archive", False, "Could not read sales before archiving")
+        return False
+    
+    result, status = make_request("POST", "/sales/archive", expect_status=200)
+    if result is None or result.get("archived", 0) < len(old_sales):
+        log_test_result("Sales Archive", False, f"Expected at least {len(old_sales)} sales archived, got {result}")
+        return False
+    print(f"  ✅ Archived {result['archived']} sales")
+    
+    after = snapshot()
+    if after != before:
+        log_test_result("Sales Archive", False, "Listing, X-Total-Count or daily rollup changed after archiving")
+        return False
+    print(f"  ✅ {after[1]} sales listed in the same order across hot and archived tiers")
+    
+    result, status = make_request("POST", "/sales/daily/rebuild", expect_status=200)
+    if result is None or daily_totals() != before[2]:
+        log_test_result("Sales Archive", False, "Rebuilding the daily rollup lost the archived sales")
+        return False
+    print("  ✅ Daily rollup rebuilt from both tiers matches")
+    
+    result, status = make_request("POST", "/sales/batch", {"sales": old_sales[:1]}, 200)
+    if result is None or result["results"][0].get("status") != "duplicate":
+        log_test_result("Sales Archive", False, "Replaying an archived sale recorded it again")
+        return False
+    print("  ✅ Replaying an archived sale is reported as a duplicate")
+    
+    log_test_result("Sales Archive", True, "Archived sales stay listed, counted and summarized")
+    return True
+
 def test_dashboard_stats():
     """Test dashboard statistics"""
     print("📊 Testing Dashboard - Statistics")
@@ -412,6 +895,12 @@ def test_dashboard_stats():
         print(f"  → Total Products: {inventory_stats.get('total_products', 0)}")
         print(f"  → Low Stock Items: {inventory_stats.get('low_stock_count', 0)}")
         
+        # "Today" uses the same calendar day (SALES_TIMEZONE) as the daily rollup
+        days, _ = make_request("GET", "/sales/daily", expect_status=200)
+        if days and today_stats.get('sales_count', 0) != days[-1].get('sales_count'):
+            log_test_result("Dashboard Statistics", False, f"Today's sales ({today_stats.get('sales_count')}) differ from the rollup's latest day {days[-1]}")
+            return False
+        
         # Verify we have some data
         has_sales_today = today_stats.get('sales_count', 0) > 0
         has_products = inventory_stats.get('total_products', 0) > 0
@@ -430,6 +919,226 @@ def test_dashboard_stats():
         log_test_result("Dashboard Statistics", False, f"Status: {status}")
         return False
 
+def test_sales_analytics():
+    """Test the analytics report against the sales recorded by this run"""
+    print("📊 Testing Reports - Analytics")
+    
+    walked = walk_pages("/sales", 100)
+    products, _ = make_request("GET", "/products", expect_status=200)
+    if walked is None or products is None:
+        log_test_result("Sales Analytics", False, "Could not read sales or products")
+        return False
+    # Old sales the archive test may have recorded fall outside the range
+    since = datetime.now(timezone.utc) - timedelta(days=2)
+    sales = [sale for sale in walked[0] if datetime.fromisoformat(sale["date"].replace("Z", "+00:00")) >= since]
+    category_by_id = {product["id"]: product["category"] for product in products}
+    
+    units = {}
+    categories = {}
+    for sale in sales:
+        for item in sale["items"]:
+            units[item["product_id"]] = units.get(item["product_id"], 0) + item["quantity"]
+            category = category_by_id.get(item["product_id"], "Sin categoría")
+            categories[category] = categories.get(category, 0) + item["quantity"] * item["price_at_sale"]
+    
+    today = datetime.now()
+    params = f"from={(today - timedelta(days=2)):%Y-%m-%d}&to={(today + timedelta(days=2)):%Y-%m-%d}"
+    report, status = make_request("GET", f"/reports/analytics?{params}&bucket=hour&top=100", expect_status=200)
+    if report is None:
+        log_test_result("Sales Analytics", False, f"Status: {status}")
+        return False
+    
+    totals = report.get("totals", {})
+    if totals.get("sales_count") != len(sales) or \
+            abs(totals.get("revenue", 0) - sum(sale["total_amount"] for sale in sales)) > 0.01 or \
+            abs(totals.get("profit", 0) - sum(sale["profit"] for sale in sales)) > 0.01:
+        log_test_result("Sales Analytics", False, f"Totals {totals} do not match {len(sales)} recorded sales")
+        return False
+    print(f"  ✅ Totals match {len(sales)} sales")
+    
+    timeline = report.get("timeline", [])
+    if sum(point["sales_count"] for point in timeline) != len(sales) or \
+            abs(sum(point["revenue"] for point in timeline) - totals["revenue"]) > 0.01:
+        log_test_result("Sales Analytics", False, "Timeline does not add up to the totals")
+        return False
+    print(f"  ✅ Timeline of {len(timeline)} hourly buckets adds up to the totals")
+    
+    heatmap = report.get("heatmap", {})
+    for key in ["sales_count", "revenue"]:
+        grid = heatmap.get(key, [])
+        if len(grid) != 7 or any(len(row) != 24 for row in grid):
+            log_test_result("Sales Analytics", False, f"Heatmap {key} is not 7x24")
+            return False
+    if sum(map(sum, heatmap["sales_count"])) != len(sales):
+        log_test_result("Sales Analytics", False, "Heatmap does not add up to the sales count")
+        return False
+    print("  ✅ Heatmap is 7x24 and adds up to the sales count")
+    
+    top = report.get("top_by_units", [])
+    if {entry["product_id"]: entry["units"] for entry in top} != units or \
+            [entry["units"] for entry in top] != sorted(units.values(), reverse=True):
+        log_test_result("Sales Analytics", False, f"Top products {top} do not match units sold {units}")
+        return False
+    print("  ✅ Top products rank the units sold")
+    
+    reported = {entry["category"]: entry["revenue"] for entry in report.get("categories", [])}
+    if reported.keys() != categories.keys() or any(abs(reported[key] - categories[key]) > 0.01 for key in categories):
+        log_test_result("Sales Analytics", False, f"Category revenue {reported}, expected {categories}")
+        return False
+    print("  ✅ Category totals match the sale lines")
+    
+    for query, problem in [
+        (f"{params}&bucket=month", "an unknown bucket"),
+        (f"from={today:%Y-%m-%d}&to={(today - timedelta(days=1)):%Y-%m-%d}", "from after to"),
+    ]:
+        result, status = make_request("GET", f"/reports/analytics?{query}", expect_status=400)
+        if status != 400:
+            log_test_result("Sales Analytics", False, f"Expected 400 for {problem}, got {status}")
+            return False
+    print("  ✅ Unknown bucket and inverted range are rejected with 400")
+    
+    log_test_result("Sales Analytics", True, "Totals, timeline, heatmap, top products and categories match")
+    return True
+
+def read_csv_export(endpoint):
+    """Download a CSV export; returns (header, rows) or an error message"""
+    response = raw_request("GET", endpoint)
+    if response.status_code != 200:
+        return f"{endpoint} returned {response.status_code}"
+    if not response.headers.get("Content-Type", "").startswith("text/csv"):
+        return f"{endpoint} Content-Type is {response.headers.get('Content-Type')}"
+    if "attachment" not in response.headers.get("Content-Disposition", ""):
+        return f"{endpoint} is not sent as an attachment"
+    text = response.content.decode("utf-8")
+    if not text.startswith("\ufeff"):
+        return f"{endpoint} has no UTF-8 BOM"
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    return rows[0], rows[1:]
+
+def test_csv_exports():
+    """Test the sales and inventory CSV exports"""
+    print("📄 Testing Exports - CSV")
+    
+    # Cells a spreadsheet would run as formulas
+    risky, status = make_request("POST", "/products", {
+        "barcode": "@4455",
+        "name": "=HYPERLINK(\"http://example.com\")",
+        "cost_price": 1.0,
+        "sale_price": 2.0,
+        "stock_quantity": 5,
+        "category": "+Riesgo"
+    }, 200)
+    if risky is None:
+        log_test_result("CSV Exports", False, "Could not create the product")
+        return False
+    sale, status = make_request("POST", "/sales", {
+        "items": [{"product_id": risky['id'], "quantity": 1}],
+        "payment_method": "card"
+    }, 200)
+    if sale is None:
+        log_test_result("CSV Exports", False, "Could not sell the product")
+        return False
+    
+    exported = read_csv_export("/export/sales")
+    if isinstance(exported, str):
+        log_test_result("CSV Exports", False, exported)
+        return False
+    header, rows = exported
+    if header[:3] != ["Venta", "Fecha", "Método de Pago"] or header[-1] != "Total Venta":
+        log_test_result("CSV Exports", False, f"Unexpected sales header {header}")
+        return False
+    walked = walk_pages("/sales", 100)
+    lines = sum(len(listed["items"]) for listed in walked[0]) if walked else None
+    if len(rows) != lines:
+        log_test_result("CSV Exports", False, f"Sales export has {len(rows)} rows, expected one per sale line ({lines})")
+        return False
+    risky_rows = [row for row in rows if row[0] == sale['id']]
+    if len(risky_rows) != 1 or risky_rows[0][4] != "'" + risky['name']:
+        log_test_result("CSV Exports", False, f"Formula cell not neutralized in the sales export: {risky_rows}")
+        return False
+    print(f"  ✅ Sales export: {len(rows)} rows, one per sale line, formulas neutralized")
+    
+    exported = read_csv_export("/export/products")
+    if isinstance(exported, str):
+        log_test_result("CSV Exports", False, exported)
+        return False
+    header, rows = exported
+    if header[:3] != ["ID", "Código de Barras", "Nombre"]:
+        log_test_result("CSV Exports", False, f"Unexpected inventory header {header}")
+        return False
+    response = raw_request("GET", "/products", params={"limit": 1})
+    if len(rows) != int(response.headers.get("X-Total-Count", -1)):
+        log_test_result("CSV Exports", False, f"Inventory export has {len(rows)} rows, expected one per product")
+        return False
+    risky_row = next((row for row in rows if row[0] == risky['id']), None)
+    if risky_row is None or risky_row[1:4] != ["'@4455", "'" + risky['name'], "'+Riesgo"]:
+        log_test_result("CSV Exports", False, f"Formula cells not neutralized in the inventory export: {risky_row}")
+        return False
+    print(f"  ✅ Inventory export: {len(rows)} rows, formulas neutralized")
+    
+    log_test_result("CSV Exports", True, "Sales and inventory exports are complete and safe to open")
+    return True
+
+def read_metric(text, name, labels):
+    """Value of one Prometheus sample with exactly these labels (0 when absent)"""
+    for line in text.splitlines():
+        match = re.match(r'^(\w+)(?:\{(.*)\})? (\S+)$', line)
+        if match and match.group(1) == name and dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or "")) == labels:
+            return float(match.group(3))
+    return 0.0
+
+def test_metrics():
+    """Test the Server-Timing header and the Prometheus metrics endpoint"""
+    print("📈 Testing Metrics & Server-Timing")
+    
+    headers = {}
+    if os.environ.get("METRICS_TOKEN"):
+        headers["Authorization"] = f"Bearer {os.environ['METRICS_TOKEN']}"
+    
+    def scrape():
+        response = raw_request("GET", "/metrics", headers=headers)
+        if response.status_code != 200 or not response.headers.get("Content-Type", "").startswith("text/plain"):
+            return None
+        return response.text
+    
+    before = scrape()
+    if before is None:
+        log_test_result("Metrics", False, "GET /metrics failed (set METRICS_TOKEN if the server requires it)")
+        return False
+    
+    # A paged listing always reaches MongoDB
+    response = raw_request("GET", "/products", params={"limit": 2})
+    timing = re.match(r'app;dur=([\d.]+), db;dur=([\d.]+);desc="(\d+) queries"', response.headers.get("Server-Timing", ""))
+    if response.status_code != 200 or not timing or int(timing.group(3)) < 1:
+        log_test_result("Metrics", False, f"Unexpected Server-Timing: {response.headers.get('Server-Timing')}")
+        return False
+    queries = int(timing.group(3))
+    print(f"  ✅ Server-Timing reports {queries} MongoDB queries in {timing.group(2)}ms of {timing.group(1)}ms")
+    
+    after = scrape()
+    if after is None:
+        log_test_result("Metrics", False, "Second scrape failed")
+        return False
+    
+    # Deltas of exactly one request: listeners registered twice would double them
+    labels = {"method": "GET", "route": "/products"}
+    requests_delta = read_metric(after, "cloudpos_http_requests_total", {**labels, "status": "200"}) - \
+        read_metric(before, "cloudpos_http_requests_total", {**labels, "status": "200"})
+    commands_delta = read_metric(after, "cloudpos_mongo_commands_total", labels) - \
+        read_metric(before, "cloudpos_mongo_commands_total", labels)
+    if requests_delta != 1 or commands_delta != queries:
+        log_test_result("Metrics", False, f"Metrics moved by {requests_delta} requests / {commands_delta} commands, expected 1 / {queries}")
+        return False
+    print("  ✅ Request and MongoDB command counters match the request exactly")
+    
+    for family in ["cloudpos_http_request_duration_seconds", "cloudpos_mongo_command_seconds_total", "cloudpos_cache_hits_total"]:
+        if f"# TYPE {family}" not in after:
+            log_test_result("Metrics", False, f"Missing metric family {family}")
+            return False
+    
+    log_test_result("Metrics", True, "Server-Timing and /metrics agree on the request")
+    return True
+
 def test_multi_tenant_isolation():
     """Test multi-tenant isolation by creating another user"""
     print("🏢 Testing Multi-Tenant Isolation")
@@ -521,16 +1230,26 @@ def run_all_tests():
     # Product management tests (high priority)
     test_results.append(("Create Products", test_products_create()))
     test_results.append(("List Products", test_products_list()))
+    test_results.append(("Products Pagination", test_products_pagination()))
     test_results.append(("Update Product", test_products_update()))
+    test_results.append(("Catalog Changes", test_product_changes()))
+    test_results.append(("Import Products", test_products_import()))
     
     # Sales tests (CRITICAL - core feature)
     test_results.append(("Create Sale", test_sales_create()))
     test_results.append(("Stock Update Verification", test_stock_update_verification()))
     test_results.append(("Insufficient Stock Test", test_insufficient_stock()))
     test_results.append(("List Sales", test_sales_list()))
+    test_results.append(("Sales Pagination", test_sales_pagination()))
+    test_results.append(("Sales Batch", test_sales_batch()))
+    test_results.append(("Sales Daily", test_sales_daily()))
+    test_results.append(("Sales Archive", test_sales_archive()))
     
     # Dashboard tests (high priority)
     test_results.append(("Dashboard Stats", test_dashboard_stats()))
+    test_results.append(("Sales Analytics", test_sales_analytics()))
+    test_results.append(("CSV Exports", test_csv_exports()))
+    test_results.append(("Metrics", test_metrics()))
     
     # Additional tests
     test_results.append(("Multi-Tenant Isolation", test_multi_tenant_isolation()))
@@ -31,8 +31,8 @@ export default function CashRegisterReceipt({ cashRegister, storeName, currency
     minute: '2-digit'
   }) : 'N/A'
   
-  const totalExpenses = cashRegister.expenses.reduce((sum, e) => sum + e.amount, 0)
-  const totalWithdrawals = cashRegister.withdrawals.reduce((sum, w) => sum + w.amount, 0)
+  const totalExpenses = cashRegister.total_expenses ?? cashRegister.expenses.reduce((sum, e) => sum + e.amount, 0)
+  const totalWithdrawals = cashRegister.total_withdrawals ?? cashRegister.withdrawals.reduce((sum, w) => sum + w.amount, 0)
   
   return (
     <>
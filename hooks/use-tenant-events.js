@@ -0,0 +1,25 @@
+'use client'
+
+import { useEffect, useRef } from 'react'
+
+const EVENT_TYPES = ['ready', 'sale', 'stock', 'cash_register', 'catalog']
+
+// Subscribe to the store's live events (GET /api/events) while `enabled`.
+// `handlers` maps an event type to a callback receiving its data; the latest
+// handlers are always used, so passing new functions does not reconnect.
+// `ready` fires on every (re)connection, when missed events should be resynced.
+export function useTenantEvents(enabled, handlers) {
+  const handlersRef = useRef(handlers)
+  handlersRef.current = handlers
+
+  useEffect(() => {
+    if (!enabled) return
+    const source = new EventSource('/api/events')
+    EVENT_TYPES.forEach(type => {
+      source.addEventListener(type, event => {
+        handlersRef.current[type]?.(JSON.parse(event.data))
+      })
+    })
+    return () => source.close()
+  }, [enabled])
+}
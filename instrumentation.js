@@ -0,0 +1,12 @@
+// Runs once when the Next.js server starts, before it accepts requests
+export async function register() {
+  if (process.env.NEXT_RUNTIME !== 'nodejs' || !process.env.MONGO_URL) return
+  
+  const { warmUp } = await import('./lib/mongodb')
+  try {
+    await warmUp()
+  } catch (error) {
+    // Start anyway; the first request retries the connection and /api/health reports it
+    console.error('MongoDB warm-up failed:', error)
+  }
+}
@@ -0,0 +1,67 @@
+// In-process LRU cache with per-entry TTL and hit/miss counters.
+// Entries are kept in a Map, whose insertion order doubles as recency order.
+export class LRUCache {
+  constructor({ max = 100, ttl = 0 } = {}) {
+    this.max = max
+    this.ttl = ttl
+    this.entries = new Map()
+    this.hits = 0
+    this.misses = 0
+    this.evictions = 0
+  }
+
+  get(key) {
+    const entry = this.entries.get(key)
+    if (!entry || (entry.expiresAt && entry.expiresAt <= Date.now())) {
+      if (entry) this.entries.delete(key)
+      this.misses++
+      return undefined
+    }
+    // Move to the most recently used position
+    this.entries.delete(key)
+    this.entries.set(key, entry)
+    this.hits++
+    return entry.value
+  }
+
+  // Read without touching recency or counters
+  peek(key) {
+    const entry = this.entries.get(key)
+    if (!entry || (entry.expiresAt && entry.expiresAt <= Date.now())) return undefined
+    return entry.value
+  }
+
+  set(key, value, ttl = this.ttl) {
+    this.entries.delete(key)
+    this.entries.set(key, { value, expiresAt: ttl > 0 ? Date.now() + ttl : 0 })
+    while (this.entries.size > this.max) {
+      this.entries.delete(this.entries.keys().next().value)
+      this.evictions++
+    }
+    return this
+  }
+
+  delete(key) {
+    return this.entries.delete(key)
+  }
+
+  clear() {
+    this.entries.clear()
+  }
+
+  get size() {
+    return this.entries.size
+  }
+
+  stats() {
+    const lookups = this.hits + this.misses
+    return {
+      size: this.entries.size,
+      max: this.max,
+      hits: this.hits,
+      misses: this.misses,
+      evictions: this.evictions,
+      hit_rate: lookups > 0 ? this.hits / lookups : 0
+    }
+  }
+}
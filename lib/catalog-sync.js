@@ -0,0 +1,75 @@
+// Local copy of the product catalog for the POS terminal. The first sync
+// downloads the whole catalog; later ones ask GET /api/products/changes for
+// what was written or deleted since the version held, so a resync after a
+// sale transfers a handful of products instead of the full catalog.
+
+// Catalog state: { version, products: Map<id, product> }
+export function emptyCatalog() {
+  return { version: 0, products: new Map() }
+}
+
+// Fetch the changes since `catalog.version` and return the updated catalog
+export async function syncCatalog(catalog, { signal } = {}) {
+  const response = await fetch(`/api/products/changes?since=${catalog.version}`, { signal })
+  if (!response.ok) {
+    throw new Error(`Catalog sync failed with status ${response.status}`)
+  }
+
+  const { version, full, changed, deleted } = await response.json()
+  const products = full ? new Map() : new Map(catalog.products)
+  changed.forEach(product => products.set(product.id, product))
+  deleted.forEach(productId => products.delete(productId))
+  return { version, products }
+}
+
+// Newest products first, as GET /api/products lists them
+export function listCatalog(catalog) {
+  return [...catalog.products.values()].sort((a, b) =>
+    new Date(b.created_at) - new Date(a.created_at) || (a.id < b.id ? 1 : -1)
+  )
+}
+
+// Lowercase, accent-folded form of a string ("Café Ñandú" -> "cafe nandu")
+function normalizeText(text) {
+  return String(text || '')
+    .normalize('NFD')
+    .replace(/[\u0300-\u036f]/g, '')
+    .toLowerCase()
+}
+
+function tokenize(text) {
+  return [...new Set(normalizeText(text).split(/[^a-z0-9]+/).filter(Boolean))]
+}
+
+// Same matching and ranking as the server search: exact barcode first,
+// otherwise every query token must prefix a name token (or the query
+// prefixes the barcode), ranked by name prefix and token matches
+export function searchCatalog(catalog, search, limit = 50) {
+  const products = [...catalog.products.values()]
+  const exact = products.filter(product => product.barcode && product.barcode === search)
+  if (exact.length > 0) return exact.slice(0, limit)
+
+  const queryTokens = tokenize(search)
+  const query = queryTokens.join(' ')
+  const matches = []
+  for (const product of products) {
+    const nameTokens = tokenize(product.name)
+    const barcodeMatch = Boolean(product.barcode) && product.barcode.startsWith(search)
+    const nameMatch = queryTokens.length > 0 &&
+      queryTokens.every(token => nameTokens.some(candidate => candidate.startsWith(token)))
+    if (!barcodeMatch && !nameMatch) continue
+
+    let score = normalizeText(product.name).startsWith(query) ? 100 : 0
+    for (const token of queryTokens) {
+      if (nameTokens.includes(token)) score += 10
+      else if (nameTokens.some(candidate => candidate.startsWith(token))) score += 5
+    }
+    if (barcodeMatch) score += 1
+    matches.push({ product, score })
+  }
+
+  return matches
+    .sort((a, b) => b.score - a.score || a.product.name.localeCompare(b.product.name))
+    .slice(0, limit)
+    .map(({ product }) => product)
+}
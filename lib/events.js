@@ -0,0 +1,39 @@
+// In-process publish/subscribe of tenant events, streamed to browsers by
+// GET /api/events. Subscribers only receive events published by this server
+// process; the bus lives on globalThis so every bundle shares it.
+
+const bus = globalThis.__cloudposEvents ??= { listeners: new Map(), published: 0 }
+
+// Call `listener({ type, data })` for every event of the tenant. Returns the
+// unsubscribe function.
+export function subscribe(userId, listener) {
+  if (!bus.listeners.has(userId)) bus.listeners.set(userId, new Set())
+  bus.listeners.get(userId).add(listener)
+  return () => {
+    const listeners = bus.listeners.get(userId)
+    if (!listeners) return
+    listeners.delete(listener)
+    if (listeners.size === 0) bus.listeners.delete(userId)
+  }
+}
+
+// Deliver an event to the tenant's subscribers. A failing subscriber is
+// logged and never affects the request that published the event.
+export function publish(userId, type, data) {
+  const listeners = bus.listeners.get(userId)
+  if (!listeners) return
+  bus.published++
+  for (const listener of listeners) {
+    try {
+      listener({ type, data })
+    } catch (error) {
+      console.error('Event listener failed:', error)
+    }
+  }
+}
+
+export function eventStats() {
+  let subscribers = 0
+  for (const listeners of bus.listeners.values()) subscribers += listeners.size
+  return { tenants: bus.listeners.size, subscribers, published: bus.published }
+}
@@ -0,0 +1,98 @@
+// Minimal in-process metrics registry rendered in the Prometheus text format.
+// Metrics live for the lifetime of the server process.
+
+const metrics = []
+const collectors = []
+
+function labelKey(labelNames, labels) {
+  return JSON.stringify(labelNames.map(name => String(labels[name] ?? '')))
+}
+
+function formatLabels(labels) {
+  const entries = Object.entries(labels)
+  if (entries.length === 0) return ''
+  const formatted = entries.map(([name, value]) =>
+    `${name}="${String(value).replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/"/g, '\\"')}"`
+  )
+  return `{${formatted.join(',')}}`
+}
+
+function labelsFromKey(labelNames, key) {
+  const values = JSON.parse(key)
+  return Object.fromEntries(labelNames.map((name, index) => [name, values[index]]))
+}
+
+export class Counter {
+  constructor({ name, help, labelNames = [] }) {
+    Object.assign(this, { name, help, labelNames, type: 'counter', values: new Map() })
+    metrics.push(this)
+  }
+
+  inc(labels = {}, value = 1) {
+    const key = labelKey(this.labelNames, labels)
+    this.values.set(key, (this.values.get(key) || 0) + value)
+  }
+
+  render() {
+    return [...this.values].map(([key, value]) =>
+      `${this.name}${formatLabels(labelsFromKey(this.labelNames, key))} ${value}`
+    )
+  }
+}
+
+export class Histogram {
+  constructor({ name, help, labelNames = [], buckets }) {
+    Object.assign(this, { name, help, labelNames, buckets, type: 'histogram', values: new Map() })
+    metrics.push(this)
+  }
+
+  observe(labels = {}, value) {
+    const key = labelKey(this.labelNames, labels)
+    let series = this.values.get(key)
+    if (!series) {
+      series = { counts: this.buckets.map(() => 0), sum: 0, count: 0 }
+      this.values.set(key, series)
+    }
+    this.buckets.forEach((bound, index) => {
+      if (value <= bound) series.counts[index]++
+    })
+    series.sum += value
+    series.count++
+  }
+
+  render() {
+    const lines = []
+    for (const [key, series] of this.values) {
+      const labels = labelsFromKey(this.labelNames, key)
+      this.buckets.forEach((bound, index) => {
+        lines.push(`${this.name}_bucket${formatLabels({ ...labels, le: bound })} ${series.counts[index]}`)
+      })
+      lines.push(`${this.name}_bucket${formatLabels({ ...labels, le: '+Inf' })} ${series.count}`)
+      lines.push(`${this.name}_sum${formatLabels(labels)} ${series.sum}`)
+      lines.push(`${this.name}_count${formatLabels(labels)} ${series.count}`)
+    }
+    return lines
+  }
+}
+
+// Register a callback that reports point-in-time values at scrape time. It
+// returns [{ name, help, type, samples: [{ labels, value }] }].
+export function registerCollector(collect) {
+  collectors.push(collect)
+}
+
+export function renderMetrics() {
+  const lines = []
+  const write = ({ name, help, type }, samples) => {
+    lines.push(`# HELP ${name} ${help}`, `# TYPE ${name} ${type}`, ...samples)
+  }
+  for (const metric of metrics) {
+    write(metric, metric.render())
+  }
+  for (const collect of collectors) {
+    for (const family of collect()) {
+      write(family, family.samples.map(({ labels = {}, value }) => `${family.name}${formatLabels(labels)} ${value}`))
+    }
+  }
+  return lines.join('\n') + '\n'
+}
@@ -0,0 +1,175 @@
+// Shared MongoDB connection. One client (and one connection pool) per server
+// process: the connect promise lives on globalThis, so a burst of cold
+// requests, hot reloads and the startup warm-up in instrumentation.js all
+// await the same connection instead of opening their own.
+import { MongoClient } from 'mongodb'
+
+function envInt(name, fallback) {
+  const value = parseInt(process.env[name])
+  return Number.isNaN(value) ? fallback : value
+}
+
+// Pool and timeout settings, overridable per deployment
+const CLIENT_OPTIONS = {
+  maxPoolSize: envInt('MONGO_MAX_POOL_SIZE', 100),
+  minPoolSize: envInt('MONGO_MIN_POOL_SIZE', 5),
+  maxIdleTimeMS: envInt('MONGO_MAX_IDLE_TIME_MS', 60000),
+  connectTimeoutMS: envInt('MONGO_CONNECT_TIMEOUT_MS', 10000),
+  serverSelectionTimeoutMS: envInt('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+  // Command events feed the per-request timing in the API route
+  monitorCommands: true
+}
+
+// Indexes backing every hot query, keyed by collection
+const INDEXES = {
+  users: [
+    { key: { email: 1 }, name: 'email_unique', unique: true },
+    { key: { id: 1 }, name: 'id_unique', unique: true }
+  ],
+  products: [
+    { key: { user_id: 1, id: 1 }, name: 'user_id_id_unique', unique: true },
+    { key: { user_id: 1, barcode: 1 }, name: 'user_id_barcode' },
+    { key: { user_id: 1, search_tokens: 1 }, name: 'user_id_search_tokens' },
+    { key: { user_id: 1, created_at: -1, id: -1 }, name: 'user_id_created_at_id' },
+    { key: { user_id: 1, stock_quantity: 1 }, name: 'user_id_stock_quantity' },
+    { key: { user_id: 1, catalog_version: 1 }, name: 'user_id_catalog_version' }
+  ],
+  product_tombstones: [
+    { key: { user_id: 1, catalog_version: 1 }, name: 'user_id_catalog_version' }
+  ],
+  catalog_versions: [
+    { key: { user_id: 1 }, name: 'user_id_unique', unique: true }
+  ],
+  sales: [
+    { key: { user_id: 1, date: -1, id: -1 }, name: 'user_id_date_id' },
+    { key: { user_id: 1, id: 1 }, name: 'user_id_id_unique', unique: true }
+  ],
+  sales_daily: [
+    { key: { user_id: 1, day: 1 }, name: 'user_id_day_unique', unique: true }
+  ],
+  sales_archive: [
+    { key: { id: 1 }, name: 'id_unique', unique: true },
+    { key: { user_id: 1, end_date: -1 }, name: 'user_id_end_date' },
+    { key: { user_id: 1, month: 1 }, name: 'user_id_month' },
+    { key: { user_id: 1 }, name: 'user_id_pending', partialFilterExpression: { pending: true } }
+  ],
+  sales_archive_months: [
+    { key: { user_id: 1, month: 1 }, name: 'user_id_month_unique', unique: true }
+  ],
+  job_locks: [
+    { key: { name: 1 }, name: 'name_unique', unique: true }
+  ],
+  cash_registers: [
+    { key: { id: 1 }, name: 'id_unique', unique: true },
+    { key: { user_id: 1, status: 1, closed_at: -1 }, name: 'user_id_status_closed_at' }
+  ]
+}
+
+const state = globalThis.__cloudposMongo ??= {
+  clientPromise: null,
+  indexesReady: null,
+  connectedAt: null,
+  indexesCheckedAt: null,
+  commandHandlers: null,
+  pool: {
+    open: 0,
+    in_use: 0,
+    waiting: 0,
+    created: 0,
+    closed: 0,
+    checkout_failures: 0,
+    cleared: 0
+  }
+}
+
+// Keep live pool counters from the driver's connection pool events
+function trackPool(client) {
+  const { pool } = state
+  client.on('connectionCreated', () => { pool.open++; pool.created++ })
+  client.on('connectionClosed', () => { pool.open--; pool.closed++ })
+  client.on('connectionCheckOutStarted', () => { pool.waiting++ })
+  client.on('connectionCheckedOut', () => { pool.waiting--; pool.in_use++ })
+  client.on('connectionCheckOutFailed', () => { pool.waiting--; pool.checkout_failures++ })
+  client.on('connectionCheckedIn', () => { pool.in_use-- })
+  client.on('connectionPoolCleared', () => { pool.cleared++ })
+}
+
+// Forward command events to the handlers registered with
+// setCommandHandlers(). Attached once per client, so a hot reload of the API
+// route swaps the handlers instead of stacking another set of listeners.
+function trackCommands(client) {
+  client.on('commandStarted', event => state.commandHandlers?.started(event))
+  client.on('commandSucceeded', event => state.commandHandlers?.finished(event))
+  client.on('commandFailed', event => state.commandHandlers?.finished(event))
+}
+
+export function setCommandHandlers(handlers) {
+  state.commandHandlers = handlers
+}
+
+// Connected client, shared by every caller. A failed connect is forgotten so
+// the next call retries instead of returning the same rejection forever.
+export function getMongoClient() {
+  if (!state.clientPromise) {
+    const client = new MongoClient(process.env.MONGO_URL, CLIENT_OPTIONS)
+    trackPool(client)
+    trackCommands(client)
+    state.clientPromise = client.connect().then(() => {
+      state.connectedAt = new Date()
+      return client
+    }, error => {
+      state.clientPromise = null
+      client.close().catch(() => {})
+      throw error
+    })
+  }
+  return state.clientPromise
+}
+
+// Application database. The first call also starts the index check, which
+// runs in the background; await whenIndexesReady() to wait for it.
+export async function getDb() {
+  const client = await getMongoClient()
+  const db = client.db(process.env.DB_NAME)
+  if (!state.indexesReady) {
+    state.indexesReady = ensureIndexes(db)
+  }
+  return db
+}
+
+export function whenIndexesReady() {
+  return state.indexesReady || Promise.resolve()
+}
+
+// Idempotently create all indexes. A failure on one collection (for example
+// duplicate emails blocking the unique index) is logged and does not stop the rest.
+async function ensureIndexes(db) {
+  const results = await Promise.allSettled(
+    Object.entries(INDEXES).map(([collection, indexes]) => db.collection(collection).createIndexes(indexes))
+  )
+  results.forEach((result, index) => {
+    if (result.status === 'rejected') {
+      console.error(`Index creation failed for ${Object.keys(INDEXES)[index]}:`, result.reason)
+    }
+  })
+  state.indexesCheckedAt = new Date()
+}
+
+// Connect and check indexes before the first request arrives
+export async function warmUp() {
+  const started = Date.now()
+  await getDb()
+  await whenIndexesReady()
+  console.log(`MongoDB ready in ${Date.now() - started}ms`)
+}
+
+// Connection state and pool counters for the health endpoint and metrics
+export function getPoolStats() {
+  return {
+    connected_at: state.connectedAt,
+    indexes_checked_at: state.indexesCheckedAt,
+    max_pool_size: CLIENT_OPTIONS.maxPoolSize,
+    min_pool_size: CLIENT_OPTIONS.minPoolSize,
+    ...state.pool
+  }
+}
@@ -0,0 +1,171 @@
+// Offline queue of POS sales. Sales are stored in IndexedDB as soon as the
+// cashier confirms them and sent to POST /api/sales/batch in the background;
+// each sale's client_id makes resending after a dropped connection safe.
+// Sales the server refuses (e.g. stock sold meanwhile by another terminal) are
+// kept in a separate store until the cashier retries or discards them.
+
+const DB_NAME = 'cloudpos'
+const STORE = 'pending_sales'
+const REJECTED_STORE = 'rejected_sales'
+const BATCH_SIZE = 100
+
+let dbPromise = null
+let flushPromise = null
+
+function openQueue() {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve, reject) => {
+      const request = indexedDB.open(DB_NAME, 2)
+      request.onupgradeneeded = () => {
+        const db = request.result
+        ;[STORE, REJECTED_STORE].forEach(name => {
+          if (db.objectStoreNames.contains(name)) return
+          const store = db.createObjectStore(name, { keyPath: 'client_id' })
+          store.createIndex('user_id', 'user_id')
+        })
+      }
+      request.onsuccess = () => resolve(request.result)
+      request.onerror = () => reject(request.error)
+    })
+    dbPromise.catch(() => { dbPromise = null })
+  }
+  return dbPromise
+}
+
+// Run `callback(...stores)` in one transaction over `names` and resolve with
+// its result once committed
+async function withStores(names, mode, callback) {
+  const db = await openQueue()
+  return new Promise((resolve, reject) => {
+    const transaction = db.transaction(names, mode)
+    let result
+    const stores = names.map(name => transaction.objectStore(name))
+    Promise.resolve(callback(...stores)).then(value => { result = value }, reject)
+    transaction.oncomplete = () => resolve(result)
+    transaction.onerror = () => reject(transaction.error)
+    transaction.onabort = () => reject(transaction.error)
+  })
+}
+
+function withStore(mode, callback) {
+  return withStores([STORE], mode, callback)
+}
+
+function requestToPromise(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result)
+    request.onerror = () => reject(request.error)
+  })
+}
+
+export function enqueueSale(sale) {
+  return withStore('readwrite', store => requestToPromise(store.put(sale)))
+}
+
+export function getQueuedSales(userId, limit = BATCH_SIZE) {
+  return withStore('readonly', store => requestToPromise(store.index('user_id').getAll(userId, limit)))
+}
+
+export function countQueuedSales(userId) {
+  return withStore('readonly', store => requestToPromise(store.index('user_id').count(userId)))
+}
+
+export function removeQueuedSales(clientIds) {
+  return withStore('readwrite', store => {
+    clientIds.forEach(clientId => store.delete(clientId))
+  })
+}
+
+export function getRejectedSales(userId) {
+  return withStores([REJECTED_STORE], 'readonly', store => requestToPromise(store.index('user_id').getAll(userId)))
+}
+
+export function countRejectedSales(userId) {
+  return withStores([REJECTED_STORE], 'readonly', store => requestToPromise(store.index('user_id').count(userId)))
+}
+
+// Move rejected sales out of the queue, keeping the server's reason
+function rejectQueuedSales(entries) {
+  const rejectedAt = new Date().toISOString()
+  return withStores([STORE, REJECTED_STORE], 'readwrite', (queue, rejected) => {
+    entries.forEach(({ sale, error }) => {
+      queue.delete(sale.client_id)
+      rejected.put({ ...sale, error, rejected_at: rejectedAt })
+    })
+  })
+}
+
+// Put a rejected sale back in the queue; it is sent again on the next flush
+export function retryRejectedSale(clientId) {
+  return withStores([STORE, REJECTED_STORE], 'readwrite', (queue, rejected) => {
+    // Chain the writes from the read's callback so the transaction stays active
+    const request = rejected.get(clientId)
+    request.onsuccess = () => {
+      if (!request.result) return
+      const { error, rejected_at, ...sale } = request.result
+      queue.put(sale)
+      rejected.delete(clientId)
+    }
+  })
+}
+
+export function discardRejectedSale(clientId) {
+  return withStores([REJECTED_STORE], 'readwrite', store => {
+    store.delete(clientId)
+  })
+}
+
+// Send the user's queued sales in batches until the queue is empty. Only one
+// flush runs at a time; concurrent callers share it. Resolves with the number
+// of sales the server recorded and the sales it rejected, which are moved to
+// the rejected store; rejects (leaving the queue intact) when the server
+// cannot be reached.
+export function flushSaleQueue(userId) {
+  if (!flushPromise) {
+    flushPromise = flush(userId).finally(() => { flushPromise = null })
+  }
+  return flushPromise
+}
+
+async function flush(userId) {
+  let synced = 0
+  const rejected = []
+
+  while (true) {
+    const queued = await getQueuedSales(userId)
+    if (queued.length === 0) break
+
+    const response = await fetch('/api/sales/batch', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ sales: queued.map(({ user_id, ...sale }) => sale) })
+    })
+    if (!response.ok) {
+      throw new Error(`Sale sync failed with status ${response.status}`)
+    }
+
+    const { results } = await response.json()
+    const queuedById = new Map(queued.map(sale => [sale.client_id, sale]))
+    const recorded = []
+    const refused = []
+    results.forEach(result => {
+      const sale = queuedById.get(result.client_id)
+      if (!sale) return
+      if (result.status === 'created' || result.status === 'duplicate') {
+        if (result.status === 'created') synced++
+        recorded.push(result.client_id)
+      } else if (result.status === 'rejected') {
+        rejected.push(result)
+        refused.push({ sale, error: result.error })
+      }
+    })
+    // Nothing in this round left the queue: stop rather than resend it forever
+    if (recorded.length === 0 && refused.length === 0) {
+      throw new Error('Sale sync made no progress')
+    }
+    await removeQueuedSales(recorded)
+    await rejectQueuedSales(refused)
+  }
+
+  return { synced, rejected }
+}